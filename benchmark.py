@@ -0,0 +1,420 @@
+# benchmark.py
+"""
+Нагрузочное тестирование API кофейни
+
+Запускает смешанную нагрузку (чтение меню, оформление заказов, оплата и
+завершение, поиск клиентов) несколькими параллельными клиентами и выводит
+по каждому эндпоинту: число запросов, ошибки, RPS и задержки p50/p95/p99.
+
+Примеры:
+  python benchmark.py                                   - 30 секунд, 16 клиентов
+  python benchmark.py -c 64 -d 60 --save before.json    - сохранить результаты
+  python benchmark.py --compare before.json after.json  - сравнить два запуска
+  python benchmark.py --cpu                             - CPU на запрос для списков: обычные
+                                                          ответы FastAPI против быстрых и сжатых
+
+Сервер должен быть запущен (python main.py) и содержать данные (python main.py seed,
+или реалистичный большой объем: python generate_data.py).
+Режим --cpu сервер не требует: приложение запускается в этом же процессе с SQLite в памяти.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+BASE_URL = "http://localhost:8000"
+
+# Доля каждого сценария в нагрузке (как часто он выбирается)
+DEFAULT_MIX = {
+    "menu": 40,       # Чтение меню
+    "search": 20,     # Поиск клиента на кассе
+    "checkout": 20,   # Оформление заказа
+    "pay": 15,        # Оплата и завершение заказа
+    "detail": 5,      # Просмотр заказа
+}
+
+PERCENTILES = (50, 95, 99)
+REGRESSION_THRESHOLD = 10.0  # Ухудшение p95 или RPS больше чем на 10% считается регрессией
+
+def percentile(sorted_values, p):
+    """Перцентиль по отсортированному списку (метод ближайшего ранга)"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(p / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+class Recorder:
+    """Собирает задержки всех запросов по эндпоинтам (потокобезопасно)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}  # эндпоинт -> список задержек в секундах
+        self.errors = {}     # эндпоинт -> число ответов с ошибкой
+        self.enabled = True  # Во время прогрева запросы не учитываются
+
+    def record(self, endpoint, elapsed, ok):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(elapsed)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self, duration):
+        """Итоги по эндпоинтам: запросы, ошибки, RPS, задержки в миллисекундах"""
+        endpoints = {}
+        with self._lock:
+            for endpoint, values in self.latencies.items():
+                values = sorted(values)
+                endpoints[endpoint] = {
+                    "requests": len(values),
+                    "errors": self.errors.get(endpoint, 0),
+                    "rps": round(len(values) / duration, 2),
+                    "mean_ms": round(sum(values) / len(values) * 1000, 2),
+                    **{f"p{p}_ms": round(percentile(values, p) * 1000, 2) for p in PERCENTILES},
+                    "max_ms": round(values[-1] * 1000, 2),
+                }
+        total = sum(entry["requests"] for entry in endpoints.values())
+        return {
+            "total_requests": total,
+            "total_errors": sum(entry["errors"] for entry in endpoints.values()),
+            "rps": round(total / duration, 2),
+            "endpoints": endpoints,
+        }
+
+class Workload:
+    """Сценарии нагрузки; каждый поток использует свое соединение (requests.Session)"""
+
+    def __init__(self, base_url, recorder, rng_seed):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.rng_seed = rng_seed
+        self.local = threading.local()
+        self.created_orders = deque(maxlen=10000)  # Оформленные заказы, ожидающие оплаты
+        self.menu_ids = []
+        self.customer_ids = []
+        self.search_queries = []
+
+    def start_worker(self, worker_no):
+        """
+        Соединение и генератор случайных чисел потока нагрузки
+        Генератор зависит от номера клиента, а не от потока, поэтому запуски с тем же
+        --seed повторяют одни и те же последовательности запросов
+        """
+        self.local.session = requests.Session()
+        self.local.rng = random.Random(f"{self.rng_seed}-{worker_no}")
+
+    def session(self):
+        return self.local.session
+
+    def request(self, endpoint, method, path, **kwargs):
+        """Выполняет запрос и записывает его задержку под именем эндпоинта"""
+        started = time.perf_counter()
+        try:
+            response = self.session().request(method, self.base_url + path, timeout=30, **kwargs)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        self.recorder.record(endpoint, time.perf_counter() - started, ok)
+        return response if ok else None
+
+    def load_reference_data(self):
+        """Позиции меню и клиенты, по которым строится нагрузка"""
+        menu = requests.get(f"{self.base_url}/menu/available", timeout=30).json()
+        customers = requests.get(f"{self.base_url}/customers", params={"limit": 1000}, timeout=30).json()
+        if not menu or not customers:
+            print("В базе нет меню или клиентов. Добавьте данные: python main.py seed")
+            sys.exit(1)
+        self.menu_ids = [item["id"] for item in menu]
+        self.customer_ids = [customer["id"] for customer in customers]
+        # Поиск по началу имени и по последним цифрам телефона, как на кассе
+        for customer in customers:
+            if customer.get("name"):
+                self.search_queries.append(customer["name"].split()[0][:3])
+            digits = "".join(ch for ch in customer.get("phone") or "" if ch.isdigit())
+            if len(digits) >= 7:
+                self.search_queries.append(digits[:7])
+
+    def run_menu(self):
+        rng = self.local.rng
+        if rng.random() < 0.5:
+            self.request("GET /menu", "GET", "/menu")
+        else:
+            self.request("GET /menu/available", "GET", "/menu/available")
+
+    def run_search(self):
+        query = self.local.rng.choice(self.search_queries or ["Ив"])
+        self.request("GET /customers/search", "GET", "/customers/search", params={"q": query})
+
+    def run_checkout(self):
+        rng = self.local.rng
+        lines = [
+            {"menu_item_id": rng.choice(self.menu_ids), "quantity": rng.randint(1, 3)}
+            for _ in range(rng.randint(1, 4))
+        ]
+        response = self.request("POST /checkout", "POST", "/checkout", json={
+            "customer_id": rng.choice(self.customer_ids),
+            "items": lines
+        })
+        if response is not None:
+            self.created_orders.append(response.json()["order_id"])
+
+    def run_pay(self):
+        try:
+            order_id = self.created_orders.popleft()
+        except IndexError:
+            self.run_checkout()  # Пока нечего оплачивать - оформляем заказ
+            return
+        if self.request("PATCH /orders/{id}/pay", "PATCH", f"/orders/{order_id}/pay") is not None:
+            self.request("PATCH /orders/{id}/complete", "PATCH", f"/orders/{order_id}/complete")
+
+    def run_detail(self):
+        if not self.created_orders:
+            self.run_checkout()
+            return
+        order_id = self.local.rng.choice(list(self.created_orders)[-100:])
+        self.request("GET /orders/{id}/detail", "GET", f"/orders/{order_id}/detail")
+
+def run_benchmark(base_url, concurrency, duration, warmup, mix, rng_seed):
+    """Запускает нагрузку и возвращает результаты"""
+    recorder = Recorder()
+    workload = Workload(base_url, recorder, rng_seed)
+    workload.load_reference_data()
+
+    scenarios = [name for name, weight in mix.items() if weight > 0]
+    weights = [mix[name] for name in scenarios]
+    stop_at = [0.0]
+
+    def worker(worker_no):
+        workload.start_worker(worker_no)
+        rng = workload.local.rng
+        while time.perf_counter() < stop_at[0]:
+            getattr(workload, f"run_{rng.choices(scenarios, weights)[0]}")()
+
+    print(f"Нагрузка: {concurrency} клиентов, {duration} с (прогрев {warmup} с), сценарии: {mix}")
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        recorder.enabled = False
+        stop_at[0] = time.perf_counter() + warmup + duration
+        futures = [executor.submit(worker, worker_no) for worker_no in range(concurrency)]
+        time.sleep(warmup)
+        recorder.enabled = True
+        started = time.perf_counter()
+        for future in futures:
+            future.result()
+        measured = time.perf_counter() - started
+
+    return {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "base_url": base_url,
+        "concurrency": concurrency,
+        "duration_s": round(measured, 2),
+        "mix": mix,
+        **recorder.summary(measured),
+    }
+
+def print_results(results):
+    """Таблица результатов по эндпоинтам"""
+    print("\n" + "=" * 100)
+    print(f"{'Эндпоинт':<30} {'Запросов':>9} {'Ошибок':>7} {'RPS':>9} "
+          f"{'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'max, мс':>9}")
+    print("-" * 100)
+    for endpoint, entry in sorted(results["endpoints"].items()):
+        print(f"{endpoint:<30} {entry['requests']:>9} {entry['errors']:>7} {entry['rps']:>9} "
+              f"{entry['p50_ms']:>9} {entry['p95_ms']:>9} {entry['p99_ms']:>9} {entry['max_ms']:>9}")
+    print("-" * 100)
+    print(f"{'ВСЕГО':<30} {results['total_requests']:>9} {results['total_errors']:>7} {results['rps']:>9}")
+    print("=" * 100)
+
+def change_percent(before, after):
+    if not before:
+        return 0.0
+    return (after - before) / before * 100
+
+def compare_results(before, after, threshold):
+    """
+    Сравнивает два запуска по каждому эндпоинту
+    Возвращает список регрессий (p95 выросла или RPS упал больше чем на threshold %)
+    """
+    regressions = []
+    print("\n" + "=" * 100)
+    print(f"Сравнение: {before.get('started_at')} -> {after.get('started_at')} (порог {threshold}%)")
+    print(f"{'Эндпоинт':<30} {'RPS было':>9} {'стало':>9} {'Δ%':>7} "
+          f"{'p95 было':>9} {'стало':>9} {'Δ%':>7} {'p99 Δ%':>7}")
+    print("-" * 100)
+    for endpoint in sorted(set(before["endpoints"]) | set(after["endpoints"])):
+        old, new = before["endpoints"].get(endpoint), after["endpoints"].get(endpoint)
+        if not old or not new:
+            print(f"{endpoint:<30} {'есть только в одном запуске':>40}")
+            continue
+        rps_change = change_percent(old["rps"], new["rps"])
+        p95_change = change_percent(old["p95_ms"], new["p95_ms"])
+        p99_change = change_percent(old["p99_ms"], new["p99_ms"])
+        mark = ""
+        if p95_change > threshold or rps_change < -threshold:
+            regressions.append(endpoint)
+            mark = "  <-- регрессия"
+        print(f"{endpoint:<30} {old['rps']:>9} {new['rps']:>9} {rps_change:>7.1f} "
+              f"{old['p95_ms']:>9} {new['p95_ms']:>9} {p95_change:>7.1f} {p99_change:>7.1f}{mark}")
+    print("-" * 100)
+    print(f"{'ВСЕГО RPS':<30} {before['rps']:>9} {after['rps']:>9} {change_percent(before['rps'], after['rps']):>7.1f}")
+    print("=" * 100)
+    return regressions
+
+# Эндпоинты со списками для замера CPU (rows - сколько строк создать для замера)
+CPU_ENDPOINTS = ["/menu", "/menu/available", "/orders?limit={rows}", "/customers?limit={rows}", "/customers/1/orders"]
+
+def run_cpu_benchmark(rows, repeats, rounds):
+    """
+    CPU процесса на один запрос к спискам в разных режимах ответа
+    Приложение работает в этом же процессе (TestClient), поэтому замер включает
+    и клиента, и сервер; клиент одинаковый во всех режимах, так что разница - это сервер.
+    Режимы чередуются: замер идет rounds кругов по repeats запросов, в каждом круге
+    режимы начинаются с другого, а результат - медиана по кругам. Иначе на режимы,
+    замеренные позже, влияют прогрев кэшей и рост памяти процесса
+    """
+    os.environ.update({"COFFEE_DB_BACKEND": "sqlite", "COFFEE_SQLITE_PATH": ":memory:",
+                       "COFFEE_DB_MODE": "sync", "COFFEE_ARCHIVE_INTERVAL": "0"})
+    import main
+    from fastapi.testclient import TestClient
+
+    with TestClient(main.app) as client:
+        main.seed_database(main.engine)
+        with main.Session(main.engine) as session:
+            session.add_all([
+                main.MenuItem(name=f"Позиция {i}", category="напиток", price=100 + i % 50) for i in range(rows)
+            ])
+            session.add_all([
+                main.Customer(name=f"Клиент {i}", phone=f"+7900{i:07d}") for i in range(rows)
+            ])
+            session.add_all([
+                main.Order(customer_id=1, total_amount=100 + i % 50, status="COMPLETED", payment_status="PAID")
+                for i in range(rows)
+            ])
+            session.commit()
+        main.menu_catalog.invalidate()
+
+        modes = [
+            ("FastAPI (response_model + json)", False, "identity"),
+            ("быстрый JSON", True, "identity"),
+            ("быстрый JSON + gzip", True, "gzip"),
+        ]
+        if main.brotli is not None:
+            modes.append(("быстрый JSON + brotli", True, "br"))
+
+        def measure(path, fast_json, encoding, count):
+            """CPU на запрос (мс) и размер ответа"""
+            main.FAST_JSON = fast_json
+            headers = {"Accept-Encoding": encoding}
+            gc.collect()
+            started = time.process_time()
+            for _ in range(count):
+                # Тело читается как есть, без распаковки на стороне клиента
+                with client.stream("GET", path, headers=headers) as response:
+                    size = sum(len(chunk) for chunk in response.iter_raw())
+            return (time.process_time() - started) / count * 1000, size
+
+        for template in CPU_ENDPOINTS:
+            for _, fast_json, encoding in modes:
+                measure(template.format(rows=rows), fast_json, encoding, 10)  # Прогрев
+
+        samples = {}
+        for round_no in range(rounds):
+            shift = round_no % len(modes)
+            for template in CPU_ENDPOINTS:
+                for label, fast_json, encoding in modes[shift:] + modes[:shift]:
+                    cpu_ms, size = measure(template.format(rows=rows), fast_json, encoding, repeats)
+                    entry = samples.setdefault(template.split("?")[0], {}).setdefault(label, ([], size))
+                    entry[0].append(cpu_ms)
+        main.FAST_JSON = True
+
+    results = {
+        endpoint: {
+            label: (round(statistics.median(by_mode[label][0]), 3), by_mode[label][1])
+            for label, _, _ in modes
+        }
+        for endpoint, by_mode in samples.items()
+    }
+
+    print("\n" + "=" * 100)
+    print(f"CPU на запрос, мс (медиана, и размер ответа, байт); строк в списках: {rows}, "
+          f"запросов: {rounds} x {repeats} на режим")
+    print("-" * 100)
+    for endpoint, by_mode in results.items():
+        print(endpoint)
+        baseline = by_mode[modes[0][0]][0]
+        for label, (cpu_ms, size) in by_mode.items():
+            print(f"    {label:<34} {cpu_ms:>9} мс  {size:>9} байт  {change_percent(baseline, cpu_ms):>7.1f}%")
+    print("=" * 100)
+    return results
+
+def parse_mix(value):
+    """Сценарии в виде menu=40,search=20,... (не указанные сценарии отключаются)"""
+    mix = {name: 0 for name in DEFAULT_MIX}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in mix:
+            raise argparse.ArgumentTypeError(f"Неизвестный сценарий: {name}. Доступны: {', '.join(DEFAULT_MIX)}")
+        mix[name.strip()] = int(weight or 1)
+    return mix
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование API кофейни")
+    parser.add_argument("--url", default=BASE_URL, help="Адрес сервера")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="Параллельных клиентов")
+    parser.add_argument("-d", "--duration", type=float, default=30, help="Длительность замера, секунд")
+    parser.add_argument("--warmup", type=float, default=3, help="Прогрев перед замером, секунд")
+    parser.add_argument("--mix", type=parse_mix, default=dict(DEFAULT_MIX), help="Доли сценариев: menu=40,search=20,checkout=20,pay=15,detail=5")
+    parser.add_argument("--seed", type=int, default=42, help="Начальное значение генератора случайных чисел")
+    parser.add_argument("--save", help="Сохранить результаты в JSON файл")
+    parser.add_argument("--baseline", help="Сравнить результаты с сохраненным запуском")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Сравнить два сохраненных запуска без нагрузки")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="Порог регрессии, %%")
+    parser.add_argument("--cpu", action="store_true", help="Замерить CPU на запрос к спискам в разных режимах ответа")
+    parser.add_argument("--rows", type=int, default=500, help="Строк в списках для режима --cpu")
+    parser.add_argument("--repeats", type=int, default=50, help="Запросов на эндпоинт в одном круге режима --cpu")
+    parser.add_argument("--rounds", type=int, default=7, help="Кругов замера в режиме --cpu (результат - медиана)")
+    args = parser.parse_args()
+
+    if args.cpu:
+        run_cpu_benchmark(args.rows, args.repeats, args.rounds)
+        return
+
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as f:
+            before = json.load(f)
+        with open(args.compare[1], encoding="utf-8") as f:
+            after = json.load(f)
+        sys.exit(1 if compare_results(before, after, args.threshold) else 0)
+
+    try:
+        requests.get(f"{args.url}/", timeout=5)
+    except requests.exceptions.ConnectionError:
+        print(f"Не удалось подключиться к серверу {args.url}. Запустите его: python main.py")
+        sys.exit(1)
+
+    results = run_benchmark(args.url, args.concurrency, args.duration, args.warmup, args.mix, args.seed)
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            before = json.load(f)
+        if compare_results(before, results, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+# generate_data.py
+"""
+Генератор больших объемов тестовых данных для кофейни
+
+Создает клиентов, заказы и позиции заказов с правдоподобными распределениями:
+утренний и обеденный пики по часам, больше заказов в выходные, постоянные клиенты,
+которые заказывают чаще остальных, корзины в 1-5 позиций с популярными и редкими
+напитками. Данные вставляются пачками (COPY в PostgreSQL, пакетный INSERT в SQLite)
+несколькими процессами параллельно, в конце пересчитываются сводки продаж.
+
+Результат зависит только от --seed и параметров: каждая пачка строится своим
+генератором случайных чисел, поэтому число процессов и порядок их работы на данные
+не влияют, а ID клиентов, заказов и позиций идут подряд.
+
+Примеры:
+  python generate_data.py                                        - 100 тыс. клиентов, 300 тыс. заказов
+  python generate_data.py --customers 1000000 --orders 5000000 --workers 8
+  python generate_data.py --orders 1000000 --end 2026-01-01 --seed 7
+
+База данных та же, что у сервера (COFFEE_DATABASE_URL, COFFEE_DB_BACKEND, coffee_shop.json).
+Для одинаковых данных между запусками генерируйте в пустую базу и передавайте --end
+(по умолчанию заказы заканчиваются сегодняшней полуночью UTC).
+"""
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+os.environ.setdefault("COFFEE_DB_MODE", "sync")
+import main
+from sqlmodel import Session, select, func, text
+
+# Меню, которое создается, если таблица меню пуста: название, категория, цена, популярность
+MENU_TEMPLATE = [
+    ("Капучино", "напиток", 180.0, 30),
+    ("Латте", "напиток", 200.0, 28),
+    ("Американо", "напиток", 150.0, 22),
+    ("Эспрессо", "напиток", 120.0, 12),
+    ("Флэт уайт", "напиток", 210.0, 10),
+    ("Раф", "напиток", 230.0, 9),
+    ("Какао", "напиток", 170.0, 6),
+    ("Матча латте", "напиток", 250.0, 5),
+    ("Чай черный", "напиток", 120.0, 6),
+    ("Чай зеленый", "напиток", 120.0, 4),
+    ("Лимонад", "напиток", 190.0, 3),
+    ("Круассан", "десерт", 150.0, 14),
+    ("Чизкейк", "десерт", 250.0, 8),
+    ("Маффин", "десерт", 140.0, 7),
+    ("Брауни", "десерт", 160.0, 5),
+    ("Тирамису", "десерт", 280.0, 4),
+    ("Эклер", "десерт", 130.0, 4),
+    ("Сэндвич с курицей", "еда", 320.0, 6),
+    ("Панини с ветчиной", "еда", 300.0, 4),
+    ("Салат Цезарь", "еда", 350.0, 3),
+]
+
+FIRST_NAMES = [
+    "Александр", "Алексей", "Анастасия", "Анна", "Артем", "Виктория", "Дарья", "Дмитрий",
+    "Екатерина", "Елена", "Иван", "Илья", "Кирилл", "Мария", "Максим", "Михаил",
+    "Никита", "Ольга", "Павел", "Полина", "Роман", "Светлана", "Сергей", "Татьяна",
+]
+LAST_NAMES = [
+    "Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов", "Михайлов",
+    "Новиков", "Федоров", "Морозов", "Волков", "Алексеев", "Лебедев", "Семенов", "Егоров",
+]
+FEMALE_ENDINGS = ("а", "я")  # Имена на -а/-я получают женскую форму фамилии
+CUSTOMIZATIONS = ["без сахара", "на овсяном молоке", "двойной шот", "с корицей", "погорячее", "без лактозы"]
+
+# Доля заказов по часам суток (кофейня открыта с 7 до 22): утренний и обеденный пики
+HOUR_WEIGHTS = [0, 0, 0, 0, 0, 0, 0, 6, 12, 11, 7, 6, 9, 9, 6, 5, 6, 6, 5, 4, 3, 2, 0, 0]
+WEEKDAY_WEIGHTS = [1.0, 1.0, 1.0, 1.0, 1.1, 1.3, 1.2]  # Пн..Вс: в выходные заказов больше
+BASKET_SIZE_WEIGHTS = [45, 30, 15, 7, 3]               # Позиций в заказе: 1..5
+QUANTITY_WEIGHTS = [85, 12, 3]                         # Количество в позиции: 1..3
+CUSTOMIZATION_SHARE = 0.15                             # Доля позиций с пожеланиями
+EMAIL_SHARE = 0.4                                      # Доля клиентов с email
+RECENT_ORDER_HOURS = 2                                 # Заказы последних часов еще в работе
+PHONE_MULTIPLIER = 7919                                # Взаимно просто с 10^9 - телефоны не повторяются
+
+def batch_rng(seed: int, kind: str, batch_index: int) -> random.Random:
+    """Свой генератор случайных чисел для каждой пачки (не зависит от других пачек)"""
+    return random.Random(f"{seed}:{kind}:{batch_index}")
+
+def customer_rows(spec: dict, batch_index: int, first_id: int, count: int) -> list:
+    """Пачка клиентов: имена, уникальные телефоны, у части - email"""
+    rng = batch_rng(spec["seed"], "customers", batch_index)
+    period_start = spec["start"] - timedelta(days=365)
+    rows = []
+    for customer_id in range(first_id, first_id + count):
+        first_name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES)
+        if first_name.endswith(FEMALE_ENDINGS):
+            last_name += "а"
+        name = f"{first_name} {last_name}"
+        phone = f"+79{customer_id * PHONE_MULTIPLIER % 10 ** 9:09d}"
+        rows.append({
+            "id": customer_id,
+            "name": name,
+            "phone": phone,
+            "email": f"client{customer_id}@example.com" if rng.random() < EMAIL_SHARE else None,
+            "created_at": period_start + timedelta(seconds=rng.random() * 365 * 86400),
+            "phone_normalized": main.normalize_phone(phone),
+            "name_normalized": main.normalize_name(name),
+            "name_last_word": main.last_name_word(main.normalize_name(name)),
+        })
+    return rows
+
+def basket_sizes(spec: dict, batch_index: int, count: int) -> list:
+    """Число позиций в каждом заказе пачки (отдельный генератор - чтобы заранее знать ID позиций)"""
+    rng = batch_rng(spec["seed"], "baskets", batch_index)
+    return rng.choices(range(1, len(BASKET_SIZE_WEIGHTS) + 1), weights=BASKET_SIZE_WEIGHTS, k=count)
+
+def order_time(rng: random.Random, spec: dict) -> datetime:
+    """Время заказа: день с учетом дня недели, час с учетом пиков, минута - равномерно"""
+    day = rng.choices(spec["days"], cum_weights=spec["day_cum_weights"])[0]
+    hour = rng.choices(range(24), weights=HOUR_WEIGHTS)[0]
+    return datetime.combine(day, datetime.min.time()) + timedelta(hours=hour, seconds=rng.random() * 3600)
+
+def order_status(rng: random.Random, created_at: datetime, end: datetime):
+    """Статус, статус оплаты и время завершения: старые заказы почти все завершены"""
+    if end - created_at > timedelta(hours=RECENT_ORDER_HOURS):
+        status = rng.choices(["COMPLETED", "PAID", "CREATED"], weights=[96, 1, 3])[0]
+    else:
+        status = rng.choices(["CREATED", "PAID", "IN_PROGRESS", "COMPLETED"], weights=[20, 30, 20, 30])[0]
+    payment_status = "PENDING" if status == "CREATED" else "PAID"
+    completed_at = created_at + timedelta(minutes=rng.uniform(3, 20)) if status == "COMPLETED" else None
+    return status, payment_status, completed_at
+
+def order_rows(spec: dict, batch_index: int, first_order_id: int, first_item_id: int, count: int):
+    """Пачка заказов и их позиций; сумма заказа - сумма его позиций"""
+    rng = batch_rng(spec["seed"], "orders", batch_index)
+    sizes = basket_sizes(spec, batch_index, count)
+    menu = spec["menu"]
+    customers = spec["customer_count"]
+
+    orders = []
+    items = []
+    item_id = first_item_id
+    for offset, size in enumerate(sizes):
+        order_id = first_order_id + offset
+        created_at = order_time(rng, spec)
+        status, payment_status, completed_at = order_status(rng, created_at, spec["end"])
+        total = 0.0
+        for menu_index in rng.choices(range(len(menu)), cum_weights=spec["menu_cum_weights"], k=size):
+            menu_item_id, price = menu[menu_index]
+            quantity = rng.choices((1, 2, 3), weights=QUANTITY_WEIGHTS)[0]
+            items.append({
+                "id": item_id,
+                "order_id": order_id,
+                "menu_item_id": menu_item_id,
+                "quantity": quantity,
+                "customizations": rng.choice(CUSTOMIZATIONS) if rng.random() < CUSTOMIZATION_SHARE else None,
+                "price": price * quantity,
+            })
+            item_id += 1
+            total += price * quantity
+        orders.append({
+            "id": order_id,
+            # Постоянные клиенты (с меньшими ID) заказывают заметно чаще остальных
+            "customer_id": spec["first_customer_id"] + int(customers * rng.random() ** 2),
+            "status": status,
+            "payment_status": payment_status,
+            "total_amount": total,
+            "created_at": created_at,
+            "completed_at": completed_at,
+            "version": 1,
+        })
+    return orders, items
+
+def init_worker():
+    """Процесс-загрузчик: соединения родителя после fork использовать нельзя"""
+    main.engine.dispose(close=False)
+
+def load_customers(spec: dict, batch_index: int, first_id: int, count: int) -> int:
+    """Строит и вставляет одну пачку клиентов (выполняется в процессе-загрузчике)"""
+    rows = customer_rows(spec, batch_index, first_id, count)
+    with Session(main.engine) as session:
+        main.insert_rows(session, main.Customer.__table__, rows)
+        session.commit()
+    return len(rows)
+
+def load_orders(spec: dict, batch_index: int, first_order_id: int, first_item_id: int, count: int) -> int:
+    """Строит и вставляет пачку заказов вместе с позициями одной транзакцией"""
+    orders, items = order_rows(spec, batch_index, first_order_id, first_item_id, count)
+    with Session(main.engine) as session:
+        main.insert_rows(session, main.Order.__table__, orders)
+        main.insert_rows(session, main.OrderItem.__table__, items)
+        session.commit()
+    return len(items)
+
+def next_id(session: Session, model) -> int:
+    """Первый свободный ID таблицы (новые строки идут после существующих)"""
+    return (session.exec(select(func.max(model.id))).one() or 0) + 1
+
+def ensure_menu(session: Session) -> list:
+    """Позиции меню для заказов: [(id, цена)]; пустое меню заполняется MENU_TEMPLATE"""
+    if not session.exec(select(func.count(main.MenuItem.id))).one():
+        main.insert_rows(session, main.MenuItem.__table__, [
+            {"name": name, "category": category, "price": price, "is_available": True, "created_at": datetime.utcnow()}
+            for name, category, price, _ in MENU_TEMPLATE
+        ])
+        session.commit()
+    return [(menu_item_id, price) for menu_item_id, price in session.exec(
+        select(main.MenuItem.id, main.MenuItem.price).where(main.MenuItem.is_available).order_by(main.MenuItem.id)
+    ).all()]
+
+def menu_weights(menu: list) -> list:
+    """Популярность позиций меню: из MENU_TEMPLATE по порядку, для остальных - убывающая"""
+    weights = [MENU_TEMPLATE[index][3] if index < len(MENU_TEMPLATE) else 2 for index in range(len(menu))]
+    cumulative = []
+    total = 0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    return cumulative
+
+def day_weights(start: date, days: int):
+    """Дни периода и накопленные веса дней (по дню недели)"""
+    day_list = [start + timedelta(days=offset) for offset in range(days)]
+    cumulative = []
+    total = 0.0
+    for day in day_list:
+        total += WEEKDAY_WEIGHTS[day.weekday()]
+        cumulative.append(total)
+    return day_list, cumulative
+
+def reset_sequences(session: Session):
+    """PostgreSQL: счетчики ID после вставки строк с явными ID"""
+    if session.bind.dialect.name != "postgresql":
+        return
+    for model in (main.Customer, main.MenuItem, main.Order, main.OrderItem):
+        table = model.__table__.name
+        session.exec(text(
+            f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), "
+            f"(SELECT COALESCE(MAX(id), 1) FROM \"{table}\"))"
+        ))
+    session.commit()
+
+def run_batches(executor, function, batches, label: str, total: int):
+    """Запускает пачки в процессах-загрузчиках и печатает ход загрузки"""
+    started = time.perf_counter()
+    done = 0
+    futures = [executor.submit(function, *batch) for batch in batches]
+    for future in futures:
+        done += future.result()
+        elapsed = time.perf_counter() - started
+        print(f"\r  {label}: {done}/{total} ({done / elapsed if elapsed else 0:.0f} строк/с)", end="", flush=True)
+    print()
+    return time.perf_counter() - started
+
+def generate(customers: int, orders: int, days: int, end: date, seed: int, workers: int, batch_size: int) -> dict:
+    """Создает данные и возвращает отчет: сколько строк и сколько секунд заняли этапы"""
+    main.prepare_database(main.engine)
+    end_at = datetime.combine(end, datetime.min.time())
+    start = end - timedelta(days=days)
+    days_list, day_cum_weights = day_weights(start, days)
+
+    with Session(main.engine) as session:
+        menu = ensure_menu(session)
+        first_customer_id = next_id(session, main.Customer)
+        first_order_id = next_id(session, main.Order)
+        first_item_id = next_id(session, main.OrderItem)
+
+    spec = {
+        "seed": seed,
+        "start": datetime.combine(start, datetime.min.time()),
+        "end": end_at,
+        "days": days_list,
+        "day_cum_weights": day_cum_weights,
+        "menu": menu,
+        "menu_cum_weights": menu_weights(menu),
+        "first_customer_id": first_customer_id,
+        "customer_count": customers,
+    }
+
+    customer_batches = [
+        (spec, index, first_customer_id + start_offset, min(batch_size, customers - start_offset))
+        for index, start_offset in enumerate(range(0, customers, batch_size))
+    ]
+    # ID позиций идут подряд: сначала узнаем, сколько позиций будет в каждой пачке заказов
+    order_batches = []
+    item_id = first_item_id
+    for index, start_offset in enumerate(range(0, orders, batch_size)):
+        count = min(batch_size, orders - start_offset)
+        order_batches.append((spec, index, first_order_id + start_offset, item_id, count))
+        item_id += sum(basket_sizes(spec, index, count))
+    items = item_id - first_item_id
+
+    print(f"Генерация: {customers} клиентов, {orders} заказов, {items} позиций за {days} дней до {end}, "
+          f"seed={seed}, процессов: {workers}, пачка: {batch_size}")
+    timings = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        timings["customers"] = run_batches(executor, load_customers, customer_batches, "Клиенты", customers)
+        timings["orders"] = run_batches(executor, load_orders, order_batches, "Позиции заказов", items)
+
+    started = time.perf_counter()
+    with Session(main.engine) as session:
+        reset_sequences(session)
+        print("Пересчет сводок продаж...")
+        main.rebuild_sales_rollups(session)
+    with main.engine.connect() as connection:
+        # Свежая статистика для планировщика запросов после массовой загрузки
+        connection.execute(text("ANALYZE"))
+        connection.commit()
+    timings["rollups"] = time.perf_counter() - started
+
+    report = {"customers": customers, "orders": orders, "items": items,
+              "seconds": {name: round(value, 1) for name, value in timings.items()}}
+    print(f"Готово: {report}")
+    return report
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Генератор больших объемов тестовых данных")
+    parser.add_argument("--customers", type=int, default=100_000, help="Сколько клиентов создать")
+    parser.add_argument("--orders", type=int, default=300_000, help="Сколько заказов создать")
+    parser.add_argument("--days", type=int, default=90, help="За сколько дней распределить заказы")
+    parser.add_argument("--end", type=date.fromisoformat, default=datetime.utcnow().date(),
+                        help="День, которым заканчиваются заказы (ГГГГ-ММ-ДД, не включается)")
+    parser.add_argument("--seed", type=int, default=42, help="Начальное значение генератора случайных чисел")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Параллельных процессов загрузки")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="Строк в одной пачке (одна транзакция)")
+    args = parser.parse_args()
+
+    if args.customers < 1 or args.orders < 0 or args.days < 1:
+        parser.error("Нужен хотя бы один клиент и один день")
+    if main.engine.dialect.name == "sqlite":
+        # SQLite принимает только одну пишущую транзакцию за раз - параллельная загрузка не ускорит
+        args.workers = 1
+    generate(args.customers, args.orders, args.days, args.end, args.seed, args.workers, args.batch_size)
+
+if __name__ == "__main__":
+    main_cli()
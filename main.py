@@ -1,15 +1,93 @@
 # Импортируем необходимые библиотеки
-from sqlmodel import SQLModel, Field, Session, select, create_engine
+from sqlmodel import SQLModel, Field, Relationship, Session, select, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
 from typing import Optional, List
-from datetime import datetime
-from fastapi import FastAPI, HTTPException, Depends
+from datetime import datetime, date, timedelta
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 import uvicorn
-import psycopg2
+import asyncio
+import bisect
+import codecs
+import csv
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import selectors
 import sys
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from email.utils import formatdate, parsedate_to_datetime
+from sqlalchemy import event, insert, update, delete, case, exists, func, extract, inspect, text, bindparam, literal, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, StaticPool
+from pydantic import ValidationError
+from starlette.datastructures import Headers, MutableHeaders
 
-# ==================== НАСТРОЙКА БАЗЫ ДАННЫХ POSTGRESQL ====================
-# Здесь указываем параметры для подключения к базе данных
+# Драйвер PostgreSQL нужен только при работе с PostgreSQL
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+# Необязательные ускорители: быстрый JSON (orjson) и сжатие brotli
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# ==================== НАСТРОЙКА БАЗЫ ДАННЫХ ====================
+# База данных выбирается без правки кода - переменными окружения или файлом
+# настроек в формате JSON (путь в COFFEE_CONFIG, по умолчанию coffee_shop.json
+# рядом с main.py). Переменные окружения важнее файла. Пример файла:
+#   {"backend": "sqlite", "sqlite_path": "coffee_shop.db"}
+#   {"backend": "postgresql", "postgres": {"password": "secret", "host": "db"}}
+# Настройки:
+#   COFFEE_DATABASE_URL / "database_url" - готовая строка подключения (важнее остальных)
+#   COFFEE_DB_BACKEND / "backend"        - "postgresql" (по умолчанию) или "sqlite"
+#   COFFEE_SQLITE_PATH / "sqlite_path"   - файл SQLite или ":memory:" (база в памяти процесса)
+#   COFFEE_PG_USER, COFFEE_PG_PASSWORD, COFFEE_PG_HOST, COFFEE_PG_PORT, COFFEE_PG_DATABASE
+#     / раздел "postgres"                - параметры PostgreSQL
+#   COFFEE_REPLICA_URL / "replica_url"   - реплика для чтения (необязательно, см. РЕПЛИКА ДЛЯ ЧТЕНИЯ)
+# С SQLite сервер, тесты и бенчмарки работают без внешнего сервера баз данных.
+
+CONFIG_FILE = os.getenv("COFFEE_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "coffee_shop.json"))
+
+def load_config_file(path: str) -> dict:
+    """Читает файл настроек; если файла нет - настройки по умолчанию"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+FILE_CONFIG = load_config_file(CONFIG_FILE)
+
+def config_value(name: str, env_name: str, default=None):
+    """Значение настройки: переменная окружения, затем файл настроек, затем значение по умолчанию"""
+    return os.getenv(env_name) or FILE_CONFIG.get(name, default)
+
+def config_flag(name: str, env_name: str, default: bool) -> bool:
+    """Логическая настройка: 1, true или yes - включено"""
+    return str(config_value(name, env_name, default)).lower() in ("1", "true", "yes")
+
+# Здесь указываем параметры для подключения к базе данных PostgreSQL
 # Эти настройки можно менять в зависимости от вашей системы
 POSTGRES_CONFIG = {
     "user": "postgres",          # Имя пользователя базы данных
@@ -18,10 +96,69 @@ POSTGRES_CONFIG = {
     "port": "5432",              # Порт PostgreSQL
     "database": "coffee_shop_db" # Имя нашей базы данных
 }
+POSTGRES_CONFIG.update(FILE_CONFIG.get("postgres", {}))
+for key in POSTGRES_CONFIG:
+    POSTGRES_CONFIG[key] = os.getenv(f"COFFEE_PG_{key.upper()}", POSTGRES_CONFIG[key])
+
+DB_BACKEND = config_value("backend", "COFFEE_DB_BACKEND", "postgresql")
+SQLITE_PATH = config_value("sqlite_path", "COFFEE_SQLITE_PATH", "coffee_shop.db")
+
+def build_database_url() -> str:
+    """Строка подключения по настройкам"""
+    url = config_value("database_url", "COFFEE_DATABASE_URL")
+    if url:
+        return url
+    if DB_BACKEND == "sqlite":
+        # sqlite:// без пути - база данных в памяти
+        return "sqlite://" if SQLITE_PATH == ":memory:" else f"sqlite:///{SQLITE_PATH}"
+    if DB_BACKEND != "postgresql":
+        raise ValueError(f"Неизвестная база данных COFFEE_DB_BACKEND={DB_BACKEND}: ожидается postgresql или sqlite")
+    # Формат: postgresql://пользователь:пароль@адрес:порт/база_данных
+    return f"postgresql://{POSTGRES_CONFIG['user']}:{POSTGRES_CONFIG['password']}@{POSTGRES_CONFIG['host']}:{POSTGRES_CONFIG['port']}/{POSTGRES_CONFIG['database']}"
 
 # Создаем строку для подключения к базе данных
-# Формат: postgresql://пользователь:пароль@адрес:порт/база_данных
-DATABASE_URL = f"postgresql://{POSTGRES_CONFIG['user']}:{POSTGRES_CONFIG['password']}@{POSTGRES_CONFIG['host']}:{POSTGRES_CONFIG['port']}/{POSTGRES_CONFIG['database']}"
+DATABASE_URL = build_database_url()
+
+# Строка подключения к реплике для чтения (None - все запросы идут в основную базу)
+REPLICA_URL = config_value("replica_url", "COFFEE_REPLICA_URL")
+
+def is_memory_sqlite(url: str) -> bool:
+    """База данных SQLite в памяти процесса (sqlite:// или sqlite:///:memory:)"""
+    return url.startswith("sqlite") and (url.endswith("://") or ":memory:" in url)
+
+# Режим работы с базой данных (переменная окружения COFFEE_DB_MODE):
+#   "sync"  - обычные эндпоинты, запросы к БД выполняются в пуле потоков (по умолчанию)
+#   "async" - экспериментальный режим: асинхронные эндпоинты и асинхронный драйвер
+#             (asyncpg для PostgreSQL). Чтение не ждет освободившегося потока и отвечает
+#             быстрее, но запись на SQLite идет по одной транзакции, и общая пропускная
+#             способность не выше, чем в режиме sync. Выигрыш на PostgreSQL еще не измерен
+DB_MODE = os.getenv("COFFEE_DB_MODE", "sync")
+if DB_MODE == "async" and is_memory_sqlite(DATABASE_URL):
+    # У асинхронного драйвера было бы свое соединение, а значит - своя пустая база в памяти
+    raise ValueError("База данных SQLite в памяти поддерживается только в режиме COFFEE_DB_MODE=sync")
+
+# Вывод всех SQL запросов в консоль (COFFEE_SQL_ECHO=1) - только для отладки, это очень медленно
+SQL_ECHO = os.getenv("COFFEE_SQL_ECHO", "0") == "1"
+
+# Сколько одинаковых SQL запросов за один HTTP запрос считается проблемой N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("COFFEE_N_PLUS_ONE_THRESHOLD", "5"))
+
+# Источник событий заказов для кухни: "memory" или "postgres" (см. раздел ОЧЕРЕДЬ ЗАКАЗОВ ДЛЯ КУХНИ)
+EVENT_BACKEND = os.getenv("COFFEE_EVENT_BACKEND", "memory")
+
+# Журнал приложения (сообщения во время работы сервера)
+logger = logging.getLogger("coffee_shop")
+
+def to_async_url(url: str) -> str:
+    """
+    Переделывает строку подключения под асинхронный драйвер
+    postgresql://... -> postgresql+asyncpg://..., sqlite://... -> sqlite+aiosqlite://...
+    """
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    return url
 
 # ==================== ОПРЕДЕЛЕНИЕ ТАБЛИЦ В БАЗЕ ДАННЫХ ====================
 
@@ -34,6 +171,11 @@ class Customer(SQLModel, table=True):
     email: Optional[str] = None                                # Email (может быть пустым)
     created_at: datetime = Field(default_factory=datetime.utcnow)  # Дата создания записи
 
+    # Поля для быстрого поиска (заполняются автоматически, в ответах API не показываются)
+    phone_normalized: Optional[str] = Field(default=None, exclude=True)  # Только цифры телефона: 79123456789
+    name_normalized: Optional[str] = Field(default=None, exclude=True)   # Имя в нижнем регистре
+    name_last_word: Optional[str] = Field(default=None, exclude=True)    # Последнее слово имени (обычно фамилия)
+
 # Модель для таблицы "Позиции меню"
 class MenuItem(SQLModel, table=True):
     """Таблица для хранения информации о блюдах и напитках в меню"""
@@ -47,17 +189,29 @@ class MenuItem(SQLModel, table=True):
 # Модель для таблицы "Заказы"
 class Order(SQLModel, table=True):
     """Таблица для хранения информации о заказах"""
+    # SQLite без AUTOINCREMENT выдает ID последнего удаленного или перенесенного в архив заказа
+    # повторно, а ID заказов должны быть уникальны вместе с архивом
+    __table_args__ = {"sqlite_autoincrement": True}
     id: Optional[int] = Field(default=None, primary_key=True)  # Уникальный номер заказа
     customer_id: int = Field(foreign_key="customer.id", index=True)  # ID клиента, сделавшего заказ
-    status: str = Field(default="CREATED", index=True)          # Статус заказа: CREATED, PAID, COMPLETED
+    status: str = Field(default="CREATED", index=True)          # Статус заказа: CREATED, PAID, IN_PROGRESS, COMPLETED
     payment_status: str = Field(default="PENDING", index=True)  # Статус оплаты: PENDING, PAID
     total_amount: float                                         # Общая сумма заказа
     created_at: datetime = Field(default_factory=datetime.utcnow)  # Дата создания заказа
     completed_at: Optional[datetime] = None                     # Дата завершения заказа (если завершен)
+    version: int = 1                                            # Версия заказа, растет при каждом изменении
+
+    # Связь с позициями заказа (order.items)
+    # passive_deletes: при удалении заказа не загружать его позиции только ради удаления
+    items: List["OrderItem"] = Relationship(
+        back_populates="order",
+        sa_relationship_kwargs={"passive_deletes": True}
+    )
 
 # Модель для таблицы "Позиции в заказе"
 class OrderItem(SQLModel, table=True):
     """Таблица для хранения информации о том, что входит в заказ"""
+    __table_args__ = {"sqlite_autoincrement": True}  # ID не выдаются повторно (см. Order)
     id: Optional[int] = Field(default=None, primary_key=True)  # Уникальный номер позиции в заказе
     order_id: int = Field(foreign_key="order.id", index=True)   # ID заказа, к которому относится позиция
     menu_item_id: int = Field(foreign_key="menuitem.id", index=True)  # ID позиции из меню
@@ -65,38 +219,429 @@ class OrderItem(SQLModel, table=True):
     customizations: Optional[str] = None                        # Особые пожелания (например, "без сахара")
     price: float                                                # Цена позиции на момент заказа
 
+    # Связи с заказом и позицией меню (order_item.order, order_item.menu_item)
+    order: Optional[Order] = Relationship(back_populates="items")
+    menu_item: Optional[MenuItem] = Relationship()
+
+# Модели для архива заказов: старые заказы переносятся сюда из рабочих таблиц,
+# чтобы таблицы заказов и их индексы не росли бесконечно. ID заказов и позиций сохраняются,
+# внешних ключей у архива нет - он не мешает работе с рабочими таблицами
+class OrderArchive(SQLModel, table=True):
+    """Архив заказов: те же поля, что и у Order, и время переноса в архив"""
+    __tablename__ = "order_archive"
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})  # ID заказа
+    customer_id: int = Field(index=True)                    # ID клиента
+    status: str                                             # Статус заказа
+    payment_status: str                                     # Статус оплаты
+    total_amount: float                                     # Общая сумма заказа
+    created_at: datetime = Field(index=True)                # Дата создания заказа
+    completed_at: Optional[datetime] = None                 # Дата завершения заказа
+    version: int = 1                                        # Версия заказа на момент переноса
+    archived_at: datetime = Field(default_factory=datetime.utcnow)  # Когда перенесен в архив
+
+class OrderItemArchive(SQLModel, table=True):
+    """Архив позиций заказов: те же поля, что и у OrderItem"""
+    __tablename__ = "orderitem_archive"
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})  # ID позиции
+    order_id: int = Field(index=True)                       # ID заказа в архиве
+    menu_item_id: int = Field(index=True)                   # ID позиции из меню
+    quantity: int = 1                                       # Количество
+    customizations: Optional[str] = None                    # Особые пожелания
+    price: float                                            # Цена позиции на момент заказа
+
+# Модель для таблицы "Продажи по часам" (сводка для отчетов)
+class SalesHourly(SQLModel, table=True):
+    """
+    Сводка продаж за каждый час: выручка, число проданных позиций,
+    оплаченных и завершенных заказов. Обновляется при оплате и завершении заказа
+    """
+    day: date = Field(primary_key=True)                 # День (по времени создания заказа, UTC)
+    hour: int = Field(primary_key=True)                 # Час (0-23)
+    orders_paid: int = 0                                # Оплачено заказов
+    orders_completed: int = 0                           # Завершено заказов
+    revenue: float = 0.0                                # Выручка по оплаченным заказам
+    units: int = 0                                      # Продано штук
+
+# Модель для таблицы "Продажи позиций меню по дням" (сводка для отчетов)
+class SalesItemDaily(SQLModel, table=True):
+    """
+    Сводка продаж каждой позиции меню за день. Обновляется при оплате заказа
+    Категория сохраняется на момент продажи, чтобы отчет по категориям не требовал JOIN
+    """
+    day: date = Field(primary_key=True)                 # День (по времени создания заказа, UTC)
+    menu_item_id: int = Field(primary_key=True)         # ID позиции меню
+    category: str = Field(index=True)                   # Категория позиции
+    units: int = 0                                      # Продано штук
+    revenue: float = 0.0                                # Выручка
+
+# Модель для таблицы "Ключи идемпотентности" (ответы на запросы с заголовком Idempotency-Key)
+class IdempotencyKey(SQLModel, table=True):
+    """
+    Ответ на запрос создания, сохраненный под ключом клиента
+    Повтор запроса с тем же ключом получает этот ответ, запись не выполняется второй раз
+    """
+    __tablename__ = "idempotency_keys"
+    key_hash: str = Field(primary_key=True, max_length=32)  # Хэш эндпоинта и ключа клиента
+    request_hash: str = Field(max_length=32)                # Хэш тела запроса
+    status_code: int                                        # Код ответа
+    response: str                                           # Тело ответа (JSON)
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)  # Для удаления по TTL
+
+# ==================== СВОДКИ ПРОДАЖ ====================
+# Отчеты о продажах читаются из небольших сводных таблиц, а не из заказов.
+# Сводки увеличиваются на вклад заказа в той же транзакции, в которой заказ
+# оплачивается (выручка, штуки) или завершается (число завершенных заказов).
+# Изменения уже оплаченного заказа тоже попадают в сводки в своей транзакции:
+# добавленная или удаленная позиция меняет выручку и штуки, удаленный заказ
+# вычитает свой вклад. Перенос в архив сводки не меняет - пересчет учитывает и архив.
+# Изменение делается через INSERT ... ON CONFLICT DO UPDATE (PostgreSQL и SQLite).
+
+ROLLUP_INSERT_CHUNK = 1000  # Сколько строк сводки вставлять одним запросом при пересчете
+
+def increment_rollup(session: Session, model, key_columns: List[str], rows: List[dict]):
+    """
+    Прибавляет счетчики из rows к строкам сводки (или создает строки)
+    key_columns - первичный ключ сводки, числовые поля rows - прибавляемые значения,
+    остальные поля (например, категория) просто перезаписываются
+    """
+    if not rows:
+        return
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        statement = postgresql.insert(model).values(rows)
+    elif dialect == "sqlite":
+        statement = sqlite.insert(model).values(rows)
+    else:
+        raise RuntimeError(f"Сводки продаж не поддерживают базу данных {dialect}")
+
+    table = model.__table__
+    set_values = {}
+    for column, value in rows[0].items():
+        if column in key_columns:
+            continue
+        if isinstance(value, (int, float)):
+            set_values[column] = table.c[column] + statement.excluded[column]
+        else:
+            set_values[column] = statement.excluded[column]
+    session.exec(statement.on_conflict_do_update(index_elements=key_columns, set_=set_values))
+
+def order_lines_by_item_statement(order_ids: List[int]):
+    """Позиции заказов, сгруппированные по заказу и позиции меню, вместе с категорией"""
+    return (
+        select(OrderItem.order_id, OrderItem.menu_item_id, MenuItem.category,
+               func.sum(OrderItem.quantity), func.sum(OrderItem.price))
+        .join(MenuItem, MenuItem.id == OrderItem.menu_item_id)
+        .where(OrderItem.order_id.in_(order_ids))
+        .group_by(OrderItem.order_id, OrderItem.menu_item_id, MenuItem.category)
+    )
+
+def hourly_rollup_rows(orders: List[Order], orders_paid: int, orders_completed: int) -> dict:
+    """
+    Строки сводки по часам для заказов: {(день, час): строка}, по одной строке на час
+    orders_paid, orders_completed - вклад каждого заказа (-1 - вычесть заказ из сводки)
+    """
+    hourly = {}
+    for order in orders:
+        entry = hourly.setdefault((order.created_at.date(), order.created_at.hour), {
+            "day": order.created_at.date(),
+            "hour": order.created_at.hour,
+            "orders_paid": 0,
+            "orders_completed": 0,
+            "revenue": 0.0,
+            "units": 0
+        })
+        entry["orders_paid"] += orders_paid
+        entry["orders_completed"] += orders_completed
+        entry["revenue"] += order.total_amount * orders_paid
+    return hourly
+
+def record_orders_paid(session: Session, orders: List[Order], sign: int = 1):
+    """
+    Добавляет оплаченные заказы в сводки продаж (вызывается до commit оплаты)
+    sign=-1 - вычитает заказы из сводок (перед удалением оплаченных заказов)
+    Позиции всех заказов читаются одним запросом; строки сводок с одинаковым ключом
+    складываются заранее, потому что один INSERT ... ON CONFLICT не может обновить строку дважды
+    """
+    if not orders:
+        return
+    orders_by_id = {order.id: order for order in orders}
+    lines = session.exec(order_lines_by_item_statement(list(orders_by_id))).all()
+
+    hourly = hourly_rollup_rows(orders, orders_paid=sign, orders_completed=0)
+    items = {}
+    for order_id, menu_item_id, category, units, revenue in lines:
+        order = orders_by_id[order_id]
+        day = order.created_at.date()
+        hourly[(day, order.created_at.hour)]["units"] += units * sign
+        entry = items.setdefault((day, menu_item_id), {
+            "day": day, "menu_item_id": menu_item_id, "category": category, "units": 0, "revenue": 0.0
+        })
+        entry["units"] += units * sign
+        entry["revenue"] += revenue * sign
+
+    increment_rollup(session, SalesHourly, ["day", "hour"], list(hourly.values()))
+    increment_rollup(session, SalesItemDaily, ["day", "menu_item_id"], list(items.values()))
+
+def record_orders_completed(session: Session, orders: List[Order], sign: int = 1):
+    """Добавляет завершенные заказы в сводку по часам (вызывается до commit завершения)"""
+    increment_rollup(session, SalesHourly, ["day", "hour"], list(hourly_rollup_rows(orders, orders_paid=0, orders_completed=sign).values()))
+
+def record_paid_order_change(session: Session, created_at: datetime, revenue: float,
+                             menu_item_id: Optional[int] = None, category: Optional[str] = None,
+                             units: int = 0, line_revenue: float = 0.0):
+    """
+    Изменение уже оплаченного заказа: revenue - изменение суммы заказа,
+    units и line_revenue - штуки и цена добавленной (или, со знаком минус, удаленной) позиции
+    """
+    day = created_at.date()
+    increment_rollup(session, SalesHourly, ["day", "hour"], [{
+        "day": day, "hour": created_at.hour, "orders_paid": 0, "orders_completed": 0, "revenue": revenue, "units": units
+    }])
+    if menu_item_id is not None:
+        increment_rollup(session, SalesItemDaily, ["day", "menu_item_id"], [{
+            "day": day, "menu_item_id": menu_item_id, "category": category, "units": units, "revenue": line_revenue
+        }])
+        if units < 0:
+            prune_empty_rollups(session, [day])
+
+def record_orders_deleted(session: Session, order_ids: List[int]):
+    """Вычитает из сводок вклад оплаченных и завершенных заказов (вызывается до их DELETE)"""
+    orders = session.exec(
+        select(Order).where(Order.id.in_(order_ids), or_(Order.payment_status == "PAID", Order.status == "COMPLETED"))
+    ).all()
+    if not orders:
+        return
+    record_orders_paid(session, [order for order in orders if order.payment_status == "PAID"], sign=-1)
+    record_orders_completed(session, [order for order in orders if order.status == "COMPLETED"], sign=-1)
+    prune_empty_rollups(session, {order.created_at.date() for order in orders})
+
+def prune_empty_rollups(session: Session, days):
+    """
+    Удаляет строки сводок за дни days, от которых после вычитания ничего не осталось,
+    чтобы сводки совпадали с полным пересчетом (в нем пустых строк нет)
+    """
+    session.exec(
+        delete(SalesHourly)
+        .where(SalesHourly.day.in_(days), SalesHourly.orders_paid == 0,
+               SalesHourly.orders_completed == 0, SalesHourly.units == 0)
+        .execution_options(synchronize_session=False)
+    )
+    session.exec(
+        delete(SalesItemDaily)
+        .where(SalesItemDaily.day.in_(days), SalesItemDaily.units == 0)
+        .execution_options(synchronize_session=False)
+    )
+
+def rebuild_sales_rollups(session: Session) -> dict:
+    """
+    Полностью пересчитывает сводки продаж по таблицам заказов (рабочим и архивным)
+    Нужен для заполнения сводок по старым данным; агрегация выполняется в базе данных
+    """
+    session.exec(delete(SalesHourly))
+    session.exec(delete(SalesItemDaily))
+
+    hourly = {}
+    items = {}
+    # Заказы в рабочих таблицах и заказы, перенесенные в архив
+    for orders, order_items in ((Order, OrderItem), (OrderArchive, OrderItemArchive)):
+        order_day = func.date(orders.created_at)
+        order_hour = extract("hour", orders.created_at)
+        paid = case((orders.payment_status == "PAID", 1), else_=0)
+        completed = case((orders.status == "COMPLETED", 1), else_=0)
+
+        # Заказы по часам: оплаченные, завершенные, выручка
+        rows = session.exec(
+            select(order_day, order_hour, func.sum(paid), func.sum(completed), func.sum(orders.total_amount * paid))
+            .where((orders.payment_status == "PAID") | (orders.status == "COMPLETED"))
+            .group_by(order_day, order_hour)
+        ).all()
+        for day, hour, orders_paid, orders_completed, revenue in rows:
+            entry = hourly.setdefault((str(day), int(hour)), {
+                "day": date.fromisoformat(str(day)),
+                "hour": int(hour),
+                "orders_paid": 0,
+                "orders_completed": 0,
+                "revenue": 0.0,
+                "units": 0
+            })
+            entry["orders_paid"] += orders_paid
+            entry["orders_completed"] += orders_completed
+            entry["revenue"] += revenue or 0.0
+
+        # Проданные штуки по часам и продажи позиций по дням (только оплаченные заказы)
+        rows = session.exec(
+            select(order_day, order_hour, order_items.menu_item_id, MenuItem.category,
+                   func.sum(order_items.quantity), func.sum(order_items.price))
+            .join(orders, orders.id == order_items.order_id)
+            .join(MenuItem, MenuItem.id == order_items.menu_item_id)
+            .where(orders.payment_status == "PAID")
+            .group_by(order_day, order_hour, order_items.menu_item_id, MenuItem.category)
+        ).all()
+        for day, hour, menu_item_id, category, units, revenue in rows:
+            hourly[(str(day), int(hour))]["units"] += units
+            entry = items.setdefault((str(day), menu_item_id), {
+                "day": date.fromisoformat(str(day)),
+                "menu_item_id": menu_item_id,
+                "category": category,
+                "units": 0,
+                "revenue": 0.0
+            })
+            entry["units"] += units
+            entry["revenue"] += revenue
+
+    hourly_rows = list(hourly.values())
+    item_rows = list(items.values())
+    for start in range(0, len(hourly_rows), ROLLUP_INSERT_CHUNK):
+        increment_rollup(session, SalesHourly, ["day", "hour"], hourly_rows[start:start + ROLLUP_INSERT_CHUNK])
+    for start in range(0, len(item_rows), ROLLUP_INSERT_CHUNK):
+        increment_rollup(session, SalesItemDaily, ["day", "menu_item_id"], item_rows[start:start + ROLLUP_INSERT_CHUNK])
+    session.commit()
+    return {"hourly_rows": len(hourly_rows), "item_rows": len(item_rows)}
+
+# ==================== ПОИСК КЛИЕНТОВ: ПОДГОТОВКА ====================
+# Для поиска клиента у кассы хранятся нормализованный телефон (только цифры,
+# ведущая 8 заменяется на 7), имя в нижнем регистре и последнее слово имени
+# (фамилия - чтобы искать по ее началу). Они заполняются автоматически
+# при сохранении клиента через ORM.
+# По началу строки ищут обычные индексы (в PostgreSQL - text_pattern_ops).
+# Поиск по части имени и с опечатками - только с триграммным GIN индексом pg_trgm:
+# без него LIKE '%...%' читал бы всю таблицу.
+
+def normalize_phone(phone: Optional[str]) -> str:
+    """Оставляет в телефоне только цифры: +7 (912) 345-67-89 и 89123456789 -> 79123456789"""
+    digits = re.sub(r"\D", "", phone or "")
+    if len(digits) == 11 and digits.startswith("8"):
+        digits = "7" + digits[1:]
+    return digits
+
+def normalize_name(name: Optional[str]) -> str:
+    """Имя для поиска: нижний регистр, одиночные пробелы"""
+    return " ".join((name or "").lower().split())
+
+def last_name_word(normalized_name: str) -> str:
+    """Последнее слово имени для поиска по фамилии; у имени из одного слова - пустая строка"""
+    words = normalized_name.split(" ")
+    return words[-1] if len(words) > 1 else ""
+
+@event.listens_for(Customer, "before_insert")
+@event.listens_for(Customer, "before_update")
+def fill_customer_search_fields(mapper, connection, customer):
+    """Заполняет поля поиска перед каждой вставкой и изменением клиента"""
+    customer.phone_normalized = normalize_phone(customer.phone)
+    customer.name_normalized = normalize_name(customer.name)
+    customer.name_last_word = last_name_word(customer.name_normalized)
+
+SEARCH_BACKFILL_BATCH_SIZE = 5000  # Сколько старых клиентов дополнять полями поиска за одну транзакцию
+
+# Доступно ли расширение pg_trgm (нечеткий поиск по имени); определяется при запуске
+customer_search_trigram = False
+
+def ensure_customer_search_schema(target_engine):
+    """
+    Добавляет колонки и индексы поиска в существующую таблицу клиентов
+    и заполняет поля поиска у старых записей. Повторный запуск ничего не меняет
+    """
+    dialect = target_engine.dialect.name
+    columns = {column["name"] for column in inspect(target_engine).get_columns("customer")}
+
+    with target_engine.begin() as connection:
+        for column in ("phone_normalized", "name_normalized"):
+            if column not in columns:
+                connection.execute(text(f"ALTER TABLE customer ADD COLUMN {column} VARCHAR"))
+
+        if dialect == "postgresql":
+            connection.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_customer_phone_normalized "
+                "ON customer (phone_normalized text_pattern_ops)"
+            ))
+            connection.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_customer_name_normalized "
+                "ON customer (name_normalized text_pattern_ops)"
+            ))
+        else:
+            connection.execute(text("CREATE INDEX IF NOT EXISTS ix_customer_phone_normalized ON customer (phone_normalized)"))
+            connection.execute(text("CREATE INDEX IF NOT EXISTS ix_customer_name_normalized ON customer (name_normalized)"))
+
+    if dialect == "postgresql":
+        # Расширение может быть недоступно (нет прав) - тогда ищем без нечеткого совпадения
+        try:
+            with target_engine.begin() as connection:
+                connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                connection.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_customer_name_normalized_trgm "
+                    "ON customer USING gin (name_normalized gin_trgm_ops)"
+                ))
+        except Exception as e:
+            logger.warning("Нечеткий поиск клиентов недоступен (pg_trgm), ищем только по началу имени и фамилии: %s", e)
+
+    # Заполняем поля поиска у клиентов, созданных до появления этих колонок
+    with Session(target_engine) as session:
+        while True:
+            rows = session.exec(
+                select(Customer.id, Customer.name, Customer.phone)
+                .where(Customer.phone_normalized == None)
+                .limit(SEARCH_BACKFILL_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            session.connection().execute(
+                update(Customer.__table__)
+                .where(Customer.__table__.c.id == bindparam("customer_id"))
+                .values(phone_normalized=bindparam("phone_value"), name_normalized=bindparam("name_value")),
+                [
+                    {"customer_id": customer_id, "phone_value": normalize_phone(phone), "name_value": normalize_name(name)}
+                    for customer_id, name, phone in rows
+                ]
+            )
+            session.commit()
+
+def detect_customer_search_features(target_engine):
+    """Определяет, установлено ли расширение pg_trgm для нечеткого поиска по имени"""
+    global customer_search_trigram
+    if target_engine.dialect.name != "postgresql":
+        customer_search_trigram = False
+        return
+    with target_engine.connect() as connection:
+        installed = connection.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first()
+    customer_search_trigram = installed is not None
+
 # ==================== ПОДГОТОВКА БАЗЫ ДАННЫХ ====================
 
-def setup_postgresql_database():
+def setup_postgresql_database(url):
     """
     Проверяет подключение к PostgreSQL и создает базу данных если она не существует
+    url - параметры подключения движка (engine.url)
     Возвращает True если все успешно, False если есть ошибки
     """
     print("🔍 Проверяю подключение к PostgreSQL...")
+    if psycopg2 is None:
+        print("Драйвер psycopg2 не установлен: pip install psycopg2-binary")
+        return False
+    database = url.database
     
     try:
         # Пробуем подключиться к серверу PostgreSQL
         conn = psycopg2.connect(
-            user=POSTGRES_CONFIG["user"],
-            password=POSTGRES_CONFIG["password"],
-            host=POSTGRES_CONFIG["host"],
-            port=POSTGRES_CONFIG["port"],
+            user=url.username,
+            password=url.password,
+            host=url.host,
+            port=url.port,
             database="postgres"  # Сначала подключаемся к стандартной базе данных
         )
         conn.autocommit = True  # Разрешаем автоматическое сохранение изменений
         cursor = conn.cursor()  # Создаем курсор для выполнения SQL команд
         
         # Проверяем, существует ли уже наша база данных
-        cursor.execute(f"SELECT 1 FROM pg_database WHERE datname = '{POSTGRES_CONFIG['database']}'")
+        cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (database,))
         exists = cursor.fetchone()  # Получаем результат запроса
         
         if not exists:
             # Если базы данных нет - создаем ее
-            print(f"Создаю базу данных '{POSTGRES_CONFIG['database']}'...")
-            cursor.execute(f"CREATE DATABASE {POSTGRES_CONFIG['database']}")
+            print(f"Создаю базу данных '{database}'...")
+            cursor.execute(f'CREATE DATABASE "{database}"')
             print(f"База данных создана")
         else:
-            print(f"База данных '{POSTGRES_CONFIG['database']}' уже существует")
+            print(f"База данных '{database}' уже существует")
         
         # Закрываем соединения
         cursor.close()
@@ -107,134 +652,417 @@ def setup_postgresql_database():
         # Обрабатываем ошибки подключения
         print(f"Ошибка подключения: {e}")
         print("\nВозможные причины:")
-        print(f"1. Неправильный пароль для пользователя '{POSTGRES_CONFIG['user']}'")
-        print(f"2. PostgreSQL не запущен на {POSTGRES_CONFIG['host']}:{POSTGRES_CONFIG['port']}")
-        print(f"3. Пользователь '{POSTGRES_CONFIG['user']}' не существует")
+        print(f"1. Неправильный пароль для пользователя '{url.username}'")
+        print(f"2. PostgreSQL не запущен на {url.host}:{url.port}")
+        print(f"3. Пользователь '{url.username}' не существует")
         return False
     except Exception as e:
         # Обрабатываем любые другие ошибки
         print(f"Ошибка: {e}")
         return False
 
-def init_database():
+def connect_database(target_engine):
     """
-    Инициализирует базу данных: создает таблицы и добавляет тестовые данные
-    Возвращает объект для подключения к базе данных (engine)
+    Проверяет подключение к базе данных
+    Базу данных PostgreSQL создает (через psycopg2) только если подключиться к ней не удалось;
+    для SQLite файл базы данных создается при первом подключении
     """
-    print("\n🔧 Инициализация базы данных...")
-    
-    # Проверяем и создаем базу данных
-    if not setup_postgresql_database():
+    try:
+        with target_engine.connect():
+            return
+    except OperationalError:
+        if target_engine.dialect.name != "postgresql":
+            raise
+
+    if not setup_postgresql_database(target_engine.url):
         print("\nНе могу подключиться к PostgreSQL!")
         print("Проверьте пароль и убедитесь, что PostgreSQL запущен.")
-        sys.exit(1)  # Завершаем программу с ошибкой
-    
+        raise RuntimeError("Нет подключения к PostgreSQL")
+    with target_engine.connect():
+        pass
+
+# ==================== МИГРАЦИИ СХЕМЫ ====================
+# Версия схемы хранится в таблице schema_migrations. При запуске применяются только
+# миграции с номером больше текущей версии, поэтому если схема актуальна, запуск
+# обходится одним запросом вместо create_all и проверок всех таблиц.
+# Новое изменение схемы - новая функция в конце списка MIGRATIONS; старые не меняются.
+
+class SchemaMigration(SQLModel, table=True):
+    __tablename__ = "schema_migrations"
+    version: int = Field(primary_key=True)          # Номер миграции
+    description: str                                # Что делает миграция
+    applied_at: datetime = Field(default_factory=datetime.utcnow)  # Когда применена
+
+def migration_create_tables(target_engine):
+    """Таблицы всех моделей (существующие таблицы не изменяются)"""
+    SQLModel.metadata.create_all(target_engine)
+
+def migration_fill_sales_rollups(target_engine):
+    """Сводки продаж по заказам, созданным до их появления"""
+    with Session(target_engine) as session:
+        rebuild_sales_rollups(session)
+
+def migration_create_archive_tables(target_engine):
+    """Архивные таблицы заказов и позиций"""
+    SQLModel.metadata.create_all(target_engine, tables=[OrderArchive.__table__, OrderItemArchive.__table__])
+
+def migration_create_idempotency_keys(target_engine):
+    """Таблица ключей идемпотентности"""
+    IdempotencyKey.__table__.create(target_engine, checkfirst=True)
+
+def migration_add_order_version(target_engine):
+    """Колонка версии у заказов и архива заказов (для проверки параллельных изменений)"""
+    quote = target_engine.dialect.identifier_preparer.quote
+    inspector = inspect(target_engine)
+    with target_engine.begin() as connection:
+        for table in (Order.__table__.name, OrderArchive.__table__.name):
+            if "version" not in {column["name"] for column in inspector.get_columns(table)}:
+                connection.execute(text(f"ALTER TABLE {quote(table)} ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+
+def migration_sqlite_autoincrement(target_engine):
+    """
+    SQLite: таблицы заказов и позиций с AUTOINCREMENT, чтобы ID не выдавались повторно
+    после архивации. Таблицы пересоздаются (ALTER TABLE не умеет добавить AUTOINCREMENT),
+    а счетчик ID ставится не ниже максимального ID в архиве
+    """
+    if target_engine.dialect.name != "sqlite":
+        return  # В PostgreSQL последовательности не выдают ID повторно
+
+    with target_engine.connect() as connection:
+        # Внешние ключи отключаются вне транзакции; legacy_alter_table - чтобы переименование
+        # таблицы не переписало ссылки на нее в других таблицах
+        connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        connection.exec_driver_sql("PRAGMA legacy_alter_table=ON")
+        connection.commit()
+        try:
+            with connection.begin():
+                for model, archive in ((Order, OrderArchive), (OrderItem, OrderItemArchive)):
+                    table = model.__table__
+                    name = table.name
+                    table_sql = connection.execute(
+                        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": name}
+                    ).scalar()
+                    if "AUTOINCREMENT" not in table_sql.upper():
+                        index_names = connection.execute(
+                            text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :name AND sql IS NOT NULL"),
+                            {"name": name}
+                        ).scalars().all()
+                        for index_name in index_names:
+                            connection.exec_driver_sql(f'DROP INDEX "{index_name}"')
+                        connection.exec_driver_sql(f'ALTER TABLE "{name}" RENAME TO "{name}_old"')
+                        table.create(connection)
+                        columns = ", ".join(f'"{column.name}"' for column in table.columns)
+                        connection.exec_driver_sql(f'INSERT INTO "{name}" ({columns}) SELECT {columns} FROM "{name}_old"')
+                        connection.exec_driver_sql(f'DROP TABLE "{name}_old"')
+
+                    last_id = max(
+                        connection.execute(select(func.max(table.c.id))).scalar() or 0,
+                        connection.execute(select(func.max(archive.__table__.c.id))).scalar() or 0
+                    )
+                    connection.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {"name": name})
+                    connection.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"), {"name": name, "seq": last_id})
+        finally:
+            connection.exec_driver_sql("PRAGMA legacy_alter_table=OFF")
+            connection.exec_driver_sql("PRAGMA foreign_keys=ON")
+            connection.commit()
+
+def migration_add_customer_last_word(target_engine):
+    """Колонка и индекс последнего слова имени клиента (поиск по началу фамилии без pg_trgm)"""
+    columns = {column["name"] for column in inspect(target_engine).get_columns("customer")}
+    with target_engine.begin() as connection:
+        if "name_last_word" not in columns:
+            connection.execute(text("ALTER TABLE customer ADD COLUMN name_last_word VARCHAR"))
+        operator_class = " text_pattern_ops" if target_engine.dialect.name == "postgresql" else ""
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_customer_name_last_word ON customer (name_last_word{operator_class})"
+        ))
+
+    # Заполняем колонку у существующих клиентов
+    with Session(target_engine) as session:
+        while True:
+            rows = session.exec(
+                select(Customer.id, Customer.name)
+                .where(Customer.name_last_word == None)
+                .limit(SEARCH_BACKFILL_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            session.connection().execute(
+                update(Customer.__table__)
+                .where(Customer.__table__.c.id == bindparam("customer_id"))
+                .values(name_last_word=bindparam("word_value")),
+                [{"customer_id": customer_id, "word_value": last_name_word(normalize_name(name))} for customer_id, name in rows]
+            )
+            session.commit()
+
+MIGRATIONS = [
+    (1, "Таблицы клиентов, меню, заказов и сводок продаж", migration_create_tables),
+    (2, "Колонки и индексы поиска клиентов", ensure_customer_search_schema),
+    (3, "Сводки продаж по существующим заказам", migration_fill_sales_rollups),
+    (4, "Архив заказов и позиций заказов", migration_create_archive_tables),
+    (5, "Ключи идемпотентности запросов", migration_create_idempotency_keys),
+    (6, "Версия заказов", migration_add_order_version),
+    (7, "ID заказов и позиций SQLite не выдаются повторно", migration_sqlite_autoincrement),
+    (8, "Поиск клиентов по началу фамилии", migration_add_customer_last_word),
+]
+
+def schema_version(target_engine) -> int:
+    """Текущая версия схемы (0 - миграции еще не применялись)"""
+    with Session(target_engine) as session:
+        return session.exec(select(func.max(SchemaMigration.version))).one() or 0
+
+def migrate_database(target_engine) -> List[int]:
+    """
+    Применяет миграции, которых еще нет в базе данных
+    Возвращает номера примененных миграций (пустой список - схема актуальна)
+    """
+    try:
+        current = schema_version(target_engine)
+    except (OperationalError, ProgrammingError):
+        # Таблицы версий еще нет: новая база данных или база, созданная до миграций
+        SchemaMigration.__table__.create(target_engine, checkfirst=True)
+        current = 0
+
+    applied = []
+    for version, description, apply in MIGRATIONS:
+        if version <= current:
+            continue
+        print(f"Миграция {version}: {description}")
+        apply(target_engine)
+        with Session(target_engine) as session:
+            session.add(SchemaMigration(version=version, description=description))
+            session.commit()
+        applied.append(version)
+    return applied
+
+# ==================== ЗАПУСК: ПОДГОТОВКА БАЗЫ ДАННЫХ ====================
+# Импорт модуля ничего не делает с базой данных: подключение и миграции выполняются
+# в lifespan приложения (или командами seed/import), а время каждого этапа
+# запуска сохраняется в startup_timings и показывается в GET /database/health.
+
+startup_timings = {}  # Время этапов запуска в миллисекундах
+
+@contextmanager
+def startup_phase(name: str):
+    """Засекает время этапа запуска"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+def require_current_schema(target_engine):
+    """
+    Проверка версии схемы без миграций - для воркеров многопроцессного сервера:
+    схему один раз обновляет главный процесс до их запуска
+    """
+    try:
+        current = schema_version(target_engine)
+    except (OperationalError, ProgrammingError):
+        current = 0  # Таблицы версий нет - миграции не применялись
+    latest = MIGRATIONS[-1][0]
+    if current < latest:
+        raise RuntimeError(
+            f"Схема базы данных версии {current}, а нужна {latest}: выполните python main.py migrate"
+        )
+
+def check_replica_schema(target_engine):
+    """
+    Реплика получает миграции от основной базы, сама не мигрирует
+    Если она еще не догнала схему - только предупреждаем: чтение пока может завершаться ошибками
+    """
     try:
-        # Создаем движок для работы с базой данных
-        engine = create_engine(DATABASE_URL, echo=True)  # echo=True включает вывод SQL запросов в консоль
+        require_current_schema(target_engine)
+    except RuntimeError as error:
+        logger.warning("Реплика для чтения: %s", error)
+        print(f"⚠ Реплика для чтения отстает: {error}")
+
+def prepare_database(target_engine, migrate: bool = True):
+    """Подключение к базе данных, миграции схемы и определение возможностей базы"""
+    with startup_phase("connect"):
+        connect_database(target_engine)
+    with startup_phase("migrate"):
+        if migrate:
+            applied = migrate_database(target_engine)
+        else:
+            require_current_schema(target_engine)
+            applied = []
+    with startup_phase("features"):
+        detect_customer_search_features(target_engine)
+    if applied:
+        print(f"Применены миграции: {applied}")
+    else:
+        print("Схема базы данных актуальна")
+
+def seed_database(target_engine) -> bool:
+    """
+    Добавляет тестовые данные в пустую базу данных (команда: python main.py seed)
+    Возвращает True, если данные добавлены
+    """
+    with Session(target_engine) as session:  # Открываем сессию для работы с базой данных
+        # Проверяем, есть ли уже данные в таблице клиентов
+        if session.exec(select(Customer)).first():
+            print("В базе данных уже есть клиенты, тестовые данные не добавлены")
+            return False
+
+        print("Добавляю тестовые данные...")
         
-        # Создаем все таблицы в базе данных
-        SQLModel.metadata.create_all(engine)
-        print("Таблицы созданы успешно")
+        # 1. Добавляем клиентов
+        customers = [
+            Customer(name="Иван Иванов", phone="+79123456789", email="ivan@example.com"),
+            Customer(name="Мария Петрова", phone="+79161234567", email="maria@example.com"),
+            Customer(name="Алексей Сидоров", phone="+79031112233", email="alex@example.com"),
+        ]
         
-        # Добавляем тестовые данные
-        with Session(engine) as session:  # Открываем сессию для работы с базой данных
-            # Проверяем, есть ли уже данные в таблице клиентов
-            if not session.exec(select(Customer)).first():
-                print("Добавляю тестовые данные...")
-                
-                # 1. Добавляем клиентов
-                customers = [
-                    Customer(name="Иван Иванов", phone="+79123456789", email="ivan@example.com"),
-                    Customer(name="Мария Петрова", phone="+79161234567", email="maria@example.com"),
-                    Customer(name="Алексей Сидоров", phone="+79031112233", email="alex@example.com"),
-                ]
-                
-                for customer in customers:
-                    session.add(customer)  # Добавляем клиента в сессию
-                
-                # 2. Добавляем позиции меню
-                menu_items = [
-                    MenuItem(name="Капучино", category="напиток", price=180.0),
-                    MenuItem(name="Латте", category="напиток", price=190.0),
-                    MenuItem(name="Эспрессо", category="напиток", price=120.0),
-                    MenuItem(name="Американо", category="напиток", price=150.0),
-                    MenuItem(name="Круассан", category="десерт", price=120.0),
-                    MenuItem(name="Чизкейк", category="десерт", price=200.0),
-                ]
-                
-                for item in menu_items:
-                    session.add(item)  # Добавляем позицию меню в сессию
-                
-                session.commit()  # Сохраняем все изменения в базе данных
-                
-                # 3. Добавляем заказы (после коммита, чтобы получить ID клиентов и меню)
-                all_customers = session.exec(select(Customer)).all()  # Получаем всех клиентов
-                all_menu_items = session.exec(select(MenuItem)).all()  # Получаем все позиции меню
-                
-                if all_customers and all_menu_items:
-                    # Заказ 1
-                    order1 = Order(
-                        customer_id=all_customers[0].id,
-                        total_amount=360.0,
-                        status="COMPLETED",
-                        payment_status="PAID"
-                    )
-                    session.add(order1)
-                    
-                    # Заказ 2
-                    order2 = Order(
-                        customer_id=all_customers[1].id,
-                        total_amount=310.0,
-                        status="IN_PROGRESS",
-                        payment_status="PAID"
-                    )
-                    session.add(order2)
-                    
-                    session.commit()  # Сохраняем заказы
-                    
-                    # Обновляем объекты заказов из базы данных (получаем их ID)
-                    session.refresh(order1)
-                    session.refresh(order2)
-                    
-                    # Добавляем позиции в заказы
-                    order_item1 = OrderItem(
-                        order_id=order1.id,
-                        menu_item_id=all_menu_items[0].id,
-                        quantity=2,
-                        price=180.0 * 2
-                    )
-                    session.add(order_item1)
-                    
-                    order_item2 = OrderItem(
-                        order_id=order2.id,
-                        menu_item_id=all_menu_items[1].id,
-                        quantity=1,
-                        price=190.0
-                    )
-                    session.add(order_item2)
-                    
-                    order_item3 = OrderItem(
-                        order_id=order2.id,
-                        menu_item_id=all_menu_items[4].id,
-                        quantity=1,
-                        price=120.0
-                    )
-                    session.add(order_item3)
-                    
-                    session.commit()  # Сохраняем позиции заказов
-                    
-                    print("Тестовые данные добавлены:")
-                    print(f"   - Клиентов: {len(customers)}")
-                    print(f"   - Позиций меню: {len(menu_items)}")
-                    print(f"   - Заказов: 2 с позициями")
-            
-        print("База данных готова к работе")
-        return engine  # Возвращаем объект для подключения к базе данных
+        for customer in customers:
+            session.add(customer)  # Добавляем клиента в сессию
         
-    except Exception as e:
-        print(f"Ошибка при инициализации БД: {e}")
-        raise  # Пробрасываем ошибку дальше
+        # 2. Добавляем позиции меню
+        menu_items = [
+            MenuItem(name="Капучино", category="напиток", price=180.0),
+            MenuItem(name="Латте", category="напиток", price=190.0),
+            MenuItem(name="Эспрессо", category="напиток", price=120.0),
+            MenuItem(name="Американо", category="напиток", price=150.0),
+            MenuItem(name="Круассан", category="десерт", price=120.0),
+            MenuItem(name="Чизкейк", category="десерт", price=200.0),
+        ]
+        
+        for item in menu_items:
+            session.add(item)  # Добавляем позицию меню в сессию
+        
+        session.commit()  # Сохраняем все изменения в базе данных
+        
+        # 3. Добавляем заказы (после коммита, чтобы получить ID клиентов и меню)
+        all_customers = session.exec(select(Customer)).all()  # Получаем всех клиентов
+        all_menu_items = session.exec(select(MenuItem)).all()  # Получаем все позиции меню
+        
+        if all_customers and all_menu_items:
+            # Заказ 1
+            order1 = Order(
+                customer_id=all_customers[0].id,
+                total_amount=360.0,
+                status="COMPLETED",
+                payment_status="PAID"
+            )
+            session.add(order1)
+            
+            # Заказ 2
+            order2 = Order(
+                customer_id=all_customers[1].id,
+                total_amount=310.0,
+                status="IN_PROGRESS",
+                payment_status="PAID"
+            )
+            session.add(order2)
+            
+            session.commit()  # Сохраняем заказы
+            
+            # Обновляем объекты заказов из базы данных (получаем их ID)
+            session.refresh(order1)
+            session.refresh(order2)
+            
+            # Добавляем позиции в заказы
+            order_item1 = OrderItem(
+                order_id=order1.id,
+                menu_item_id=all_menu_items[0].id,
+                quantity=2,
+                price=180.0 * 2
+            )
+            session.add(order_item1)
+            
+            order_item2 = OrderItem(
+                order_id=order2.id,
+                menu_item_id=all_menu_items[1].id,
+                quantity=1,
+                price=190.0
+            )
+            session.add(order_item2)
+            
+            order_item3 = OrderItem(
+                order_id=order2.id,
+                menu_item_id=all_menu_items[4].id,
+                quantity=1,
+                price=120.0
+            )
+            session.add(order_item3)
+            
+            session.commit()  # Сохраняем позиции заказов
+            rebuild_sales_rollups(session)  # Заполняем сводки продаж по тестовым заказам
+            
+            print("Тестовые данные добавлены:")
+            print(f"   - Клиентов: {len(customers)}")
+            print(f"   - Позиций меню: {len(menu_items)}")
+            print(f"   - Заказов: 2 с позициями")
+
+        return True
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Запуск и остановка сервера: подготовка базы данных, прогрев кэша меню
+    и запуск архивации по расписанию, затем освобождение соединений
+    """
+    print("=" * 70)
+    print("🚀 ЗАПУСК СИСТЕМЫ КОФЕЙНИ")
+    print("=" * 70)
+    print(f"База данных: {DATABASE_LABEL}")
+    if REPLICA_URL:
+        print(f"Реплика для чтения: {database_label(REPLICA_URL)}")
+    if DB_MODE == "async":
+        print("Режим работы с БД: async (асинхронные эндпоинты, экспериментальный)")
+
+    if SERVER_WORKERS > 1:
+        print(f"Процесс сервера {os.getpid()} (всего процессов: {SERVER_WORKERS})")
+
+    started = time.perf_counter()
+    # Воркеры многопроцессного сервера не мигрируют: это уже сделал главный процесс
+    await run_in_threadpool(prepare_database, engine, not SCHEMA_PREPARED)
+    with startup_phase("menu_cache"):
+        await run_in_threadpool(menu_catalog.all_items)
+    if replica_engine is not None:
+        with startup_phase("replica"):
+            await run_in_threadpool(check_replica_schema, replica_engine)
+    with startup_phase("pool_warmup"):
+        warmed = await run_in_threadpool(warm_pool, engine)
+        if async_engine is not None:
+            warmed += await warm_async_pool(async_engine)
+        if replica_engine is not None:
+            warmed += await run_in_threadpool(warm_pool, replica_engine)
+        if async_replica_engine is not None:
+            warmed += await warm_async_pool(async_replica_engine)
+    startup_timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+
+    phases = ", ".join(f"{name} {ms} мс" for name, ms in startup_timings.items() if name != "total")
+    print(f"База данных готова к работе за {startup_timings['total']} мс ({phases})")
+    if warmed:
+        print(f"Открыто соединений с базой данных заранее: {warmed}")
+
+    # Изменения заказов из других процессов сервера сбрасывают ETag заказов этого процесса
+    if EVENT_BACKEND == "postgres":
+        order_events.start_postgres_listener()
+
+    # Архивация старых заказов по расписанию
+    archive_task = asyncio.create_task(run_archive_job()) if ARCHIVE_INTERVAL_SECONDS > 0 else None
+    purge_task = asyncio.create_task(run_idempotency_purge_job())
+    # Первая проверка базы данных - до приема запросов, чтобы /health/ready сразу знал состояние
+    await check_database_health()
+    health_task = asyncio.create_task(run_health_monitor())
+    yield
+
+    # Сюда сервер попадает, когда начатые запросы завершены (или истек COFFEE_SHUTDOWN_TIMEOUT)
+    health_task.cancel()
+    purge_task.cancel()
+    if archive_task is not None:
+        archive_task.cancel()
+    # База данных в памяти живет в единственном соединении - его не закрываем
+    if not is_memory_sqlite(DATABASE_URL):
+        engine.dispose()
+    if async_engine is not None:
+        await async_engine.dispose()
+    if replica_engine is not None:
+        replica_engine.dispose()
+    if async_replica_engine is not None:
+        await async_replica_engine.dispose()
 
 # ==================== СОЗДАНИЕ FASTAPI ПРИЛОЖЕНИЯ ====================
 
@@ -242,7 +1070,8 @@ def init_database():
 app = FastAPI(
     title="Кофейня API",  # Название API
     version="1.0",        # Версия API
-    description="API для управления кофейней с использованием локального PostgreSQL"  # Описание
+    description="API для управления кофейней с использованием локального PostgreSQL",  # Описание
+    lifespan=lifespan     # Подготовка базы данных при запуске сервера
 )
 
 # ==================== МОДЕЛИ ДЛЯ ВХОДНЫХ ДАННЫХ API ====================
@@ -286,505 +1115,3766 @@ class OrderItemCreate(BaseModel):
     quantity: int = 1             # Количество (по умолчанию 1)
     customizations: Optional[str] = None  # Особые пожелания
 
-# ==================== ИНИЦИАЛИЗАЦИЯ БАЗЫ ДАННЫХ ====================
+# Модель одной строки заказа при оформлении (checkout)
+class CheckoutLine(BaseModel):
+    menu_item_id: int             # ID позиции из меню
+    quantity: int = 1             # Количество (по умолчанию 1)
+    customizations: Optional[str] = None  # Особые пожелания
+
+# Модель для оформления заказа целиком: клиент и все строки заказа
+class CheckoutCreate(BaseModel):
+    customer_id: int              # ID клиента
+    items: List[CheckoutLine]     # Строки заказа (сумма считается на сервере)
 
-print("=" * 70)
-print("🚀 ЗАПУСК СИСТЕМЫ КОФЕЙНИ")
-print("=" * 70)
+# Модель для массового удаления или архивации заказов (хотя бы одно условие обязательно)
+class OrderCleanup(BaseModel):
+    action: str = "archive"                  # "archive" - перенести в архив, "delete" - удалить
+    status: Optional[str] = None             # Только заказы с этим статусом (например, COMPLETED)
+    payment_status: Optional[str] = None     # Только заказы с этим статусом оплаты
+    created_before: Optional[datetime] = None    # Созданные раньше этой даты
+    completed_before: Optional[datetime] = None  # Завершенные раньше этой даты
+    customer_id: Optional[int] = None        # Только заказы этого клиента
+    batch_size: int = 1000                   # Заказов в одной транзакции
+    dry_run: bool = False                    # Только посчитать подходящие заказы
 
-# Инициализируем базу данных при запуске приложения
-engine = init_database()
+# Модель для перевода многих заказов в следующий статус одним запросом
+class OrderTransitionBatch(BaseModel):
+    action: str                                          # "pay", "start" или "complete"
+    order_ids: List[int] = Field(min_length=1, max_length=1000)  # ID заказов (до 1000 за раз)
 
-# ==================== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ====================
+# ==================== ИНИЦИАЛИЗАЦИЯ БАЗЫ ДАННЫХ ====================
 
-def get_session():
+def configure_sqlite_connection(dbapi_connection, connection_record):
     """
-    Функция для получения сессии работы с базой данных
-    Используется в зависимости для каждого эндпоинта API
+    Настройки каждого нового соединения SQLite: проверка внешних ключей (как в PostgreSQL),
+    ожидание блокировки вместо ошибки и журнал WAL, чтобы чтение не ждало запись
     """
-    with Session(engine) as session:
-        yield session  # Возвращаем сессию для использования
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    if not is_memory_sqlite(DATABASE_URL):
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
 
-# ==================== API ЭНДПОИНТЫ (КОНЕЧНЫЕ ТОЧКИ) ====================
+# Размер пулов соединений. Сервер может работать несколькими процессами
+# (python main.py serve --workers N), а число соединений PostgreSQL ограничено, поэтому
+# пулы считаются из общего бюджета COFFEE_DB_MAX_CONNECTIONS на все процессы сервера:
+# бюджет делится поровну между воркерами, доля воркера - между его движками.
+# Половина доли движка держится открытой (pool_size), остальное - запас (max_overflow),
+# так что все процессы вместе никогда не откроют больше соединений, чем в бюджете.
 
-@app.get("/")
-def read_root():
-    """
-    Корневой эндпоинт API
-    Возвращает информацию о доступных эндпоинтах
-    """
-    return {
-        "message": "Добро пожаловать в API кофейни!",
-        "database": "Локальный PostgreSQL",
-        "endpoints": {
-            "customers": "/customers",    # Эндпоинт для работы с клиентами
-            "menu": "/menu",              # Эндпоинт для работы с меню
-            "orders": "/orders",          # Эндпоинт для работы с заказами
-            "docs": "/docs"               # Автоматическая документация API
-        }
-    }
+SERVER_WORKERS = max(int(config_value("workers", "COFFEE_WORKERS", 1)), 1)
+DB_CONNECTION_BUDGET = int(config_value("db_max_connections", "COFFEE_DB_MAX_CONNECTIONS", 40))
+SYNC_POOL_SHARE_IN_ASYNC_MODE = 2  # Соединений синхронного движка в режиме async (кэш меню, фоновые задачи)
+# Схема уже обновлена главным процессом многопроцессного сервера (задает serve())
+SCHEMA_PREPARED = os.getenv("COFFEE_SCHEMA_PREPARED") == "1"
 
-# ==================== КЛИЕНТЫ ====================
+def connection_shares(workers: int = SERVER_WORKERS) -> tuple:
+    """Доли бюджета соединений одного процесса: (синхронный движок, асинхронный движок)"""
+    reserved = 1 if EVENT_BACKEND == "postgres" else 0  # Соединение LISTEN событий заказов - вне пула
+    per_worker = DB_CONNECTION_BUDGET // workers - reserved
+    needed = SYNC_POOL_SHARE_IN_ASYNC_MODE + 1 if DB_MODE == "async" else 1
+    if per_worker < needed:
+        raise ValueError(
+            f"COFFEE_DB_MAX_CONNECTIONS={DB_CONNECTION_BUDGET} мало для {workers} процессов сервера: "
+            f"каждому нужно хотя бы {needed + reserved} соединений"
+        )
+    if DB_MODE == "async":
+        return SYNC_POOL_SHARE_IN_ASYNC_MODE, per_worker - SYNC_POOL_SHARE_IN_ASYNC_MODE
+    return per_worker, 0
 
-@app.get("/customers", response_model=List[Customer])
-def get_customers(session: Session = Depends(get_session)):
-    """
-    Получить список всех клиентов
-    GET запрос на /customers
-    """
-    return session.exec(select(Customer)).all()  # Выполняем SQL запрос и возвращаем всех клиентов
+def pool_options(share: int) -> dict:
+    """Параметры пула движка с долей бюджета share соединений"""
+    pool_size = max(share // 2, 1)
+    return {"pool_size": pool_size, "max_overflow": share - pool_size}
 
-@app.get("/customers/{customer_id}", response_model=Customer)
-def get_customer(customer_id: int, session: Session = Depends(get_session)):
-    """
-    Получить информацию о конкретном клиенте по его ID
-    GET запрос на /customers/{id}
-    """
-    customer = session.get(Customer, customer_id)  # Ищем клиента по ID
-    if not customer:
-        raise HTTPException(status_code=404, detail="Клиент не найден")  # Если клиент не найден - ошибка 404
-    return customer
+# Время ожидания соединения из пула для GET /metrics: пулы движков - подклассы QueuePool,
+# которые засекают каждое получение соединения (вместе с открытием нового, если пул пуст)
 
-@app.post("/customers", response_model=Customer, status_code=201)
-def create_customer(customer: CustomerCreate, session: Session = Depends(get_session)):
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+class Histogram:
+    """Гистограмма в формате Prometheus: число наблюдений по верхним границам корзин и их сумма"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Последняя корзина - больше всех границ (+Inf)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.sum += value
+
+    def snapshot(self) -> tuple:
+        """(число наблюдений по корзинам, сумма)"""
+        with self._lock:
+            return list(self.counts), self.sum
+
+class TimedPoolMixin:
+    """Засекает ожидание соединения и считает отказы по таймауту пула"""
+
+    def __init__(self, *args, max_overflow: int = 10, **kwargs):
+        super().__init__(*args, max_overflow=max_overflow, **kwargs)
+        self.overflow_limit = max_overflow  # Настроенный запас соединений сверх pool_size (-1 - без ограничения)
+        self.wait_time = Histogram(POOL_WAIT_BUCKETS)
+        self.timeouts = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.wait_time.observe(time.perf_counter() - started)
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+def create_database_engine(url: str, pool_share: int):
     """
-    Создать нового клиента
-    POST запрос на /customers с данными клиента в теле запроса
+    Движок базы данных по строке подключения
+    PostgreSQL: пул не больше pool_share соединений (доля бюджета соединений процесса)
+    SQLite: соединения можно передавать между потоками пула FastAPI, а база в памяти
+    живет в одном общем соединении (StaticPool) - иначе у каждого соединения была бы своя пустая база
     """
-    new_customer = Customer(**customer.dict())  # Создаем объект клиента из полученных данных
-    session.add(new_customer)                   # Добавляем клиента в сессию
-    session.commit()                            # Сохраняем изменения в базе данных
-    session.refresh(new_customer)               # Обновляем объект из базы данных (получаем ID)
-    return new_customer
+    if not url.startswith("sqlite"):
+        # echo=True включает вывод SQL запросов в консоль
+        return create_engine(url, echo=SQL_ECHO, poolclass=TimedQueuePool, **pool_options(pool_share))
 
-@app.patch("/customers/{customer_id}", response_model=Customer)
-def update_customer(
-    customer_id: int, 
-    customer_update: CustomerUpdate, 
-    session: Session = Depends(get_session)
-):
+    options = {"connect_args": {"check_same_thread": False}}
+    options["poolclass"] = StaticPool if is_memory_sqlite(url) else TimedQueuePool
+    sqlite_engine = create_engine(url, echo=SQL_ECHO, **options)
+    event.listen(sqlite_engine, "connect", configure_sqlite_connection)
+    return sqlite_engine
+
+def create_async_database_engine(url: str, pool_share: int):
+    """Асинхронный движок для режима COFFEE_DB_MODE=async"""
+    async_url = to_async_url(url)
+    if not async_url.startswith("sqlite"):
+        return create_async_engine(async_url, poolclass=TimedAsyncQueuePool, **pool_options(pool_share))
+    sqlite_engine = create_async_engine(async_url, poolclass=TimedAsyncQueuePool)
+    event.listen(sqlite_engine.sync_engine, "connect", configure_sqlite_connection)
+    return sqlite_engine
+
+def database_label(url: str) -> str:
+    """Название базы данных для ответов API и сообщений"""
+    if is_memory_sqlite(url):
+        return "SQLite (в памяти)"
+    if url.startswith("sqlite"):
+        return "SQLite"
+    return "PostgreSQL"
+
+DATABASE_LABEL = database_label(DATABASE_URL)
+
+# Движок только описывает подключение: соединения открываются при первом запросе,
+# а подготовка базы данных выполняется при запуске сервера (lifespan)
+SYNC_POOL_SHARE, ASYNC_POOL_SHARE = connection_shares()
+engine = create_database_engine(DATABASE_URL, SYNC_POOL_SHARE)
+
+# В асинхронном режиме дополнительно создаем асинхронный движок
+# (синхронный движок остается для кэша меню и служебных задач)
+async_engine = create_async_database_engine(DATABASE_URL, ASYNC_POOL_SHARE) if DB_MODE == "async" else None
+
+def make_read_only(target_engine):
     """
-    Обновить информацию о клиенте
-    PATCH запрос на /customers/{id}
+    Запрещает запись через соединения движка: запрос на изменение, случайно
+    отправленный на реплику, завершится ошибкой, а не разойдется с основной базой
     """
-    customer = session.get(Customer, customer_id)
-    if not customer:
-        raise HTTPException(status_code=404, detail="Клиент не найден")
-    
-    # Обновляем только переданные поля
-    update_data = customer_update.dict(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(customer, field, value)
-    
-    session.add(customer)
-    session.commit()
-    session.refresh(customer)
-    return customer
+    if target_engine.dialect.name == "sqlite":
+        statement = "PRAGMA query_only=ON"
+    else:
+        statement = "SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY"
 
-@app.delete("/customers/{customer_id}")
-def delete_customer(customer_id: int, session: Session = Depends(get_session)):
+    def set_read_only(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(statement)
+        cursor.close()
+        dbapi_connection.commit()  # Иначе настройка PostgreSQL откатится вместе с транзакцией
+
+    event.listen(target_engine, "connect", set_read_only)
+
+# Реплика для чтения: отдельные движки с тем же размером пулов - у реплики свой лимит соединений
+replica_engine = None
+async_replica_engine = None
+if REPLICA_URL:
+    replica_engine = create_database_engine(REPLICA_URL, SYNC_POOL_SHARE)
+    make_read_only(replica_engine)
+    if DB_MODE == "async":
+        async_replica_engine = create_async_database_engine(REPLICA_URL, ASYNC_POOL_SHARE)
+        make_read_only(async_replica_engine.sync_engine)
+
+def persistent_pool_size(target_engine) -> int:
+    """Сколько соединений пул держит открытыми (0 - пул без постоянных соединений, например SQLite в памяти)"""
+    pool = target_engine.pool
+    return pool.size() if isinstance(pool, QueuePool) else 0
+
+def warm_pool(target_engine) -> int:
     """
-    Удалить клиента по ID
-    DELETE запрос на /customers/{id}
-    
-    Внимание: У клиента не должно быть связанных заказов
+    Открывает постоянные соединения пула до приема запросов, чтобы первые запросы
+    после запуска процесса не ждали подключения к базе данных. Возвращает число соединений
     """
-    customer = session.get(Customer, customer_id)
-    if not customer:
-        raise HTTPException(status_code=404, detail="Клиент не найден")
-    
-    # Проверяем, есть ли у клиента заказы
-    customer_orders = session.exec(select(Order).where(Order.customer_id == customer_id)).all()
-    if customer_orders:
-        raise HTTPException(
-            status_code=400, 
-            detail="Нельзя удалить клиента, у которого есть заказы. Сначала удалите заказы."
-        )
+    size = persistent_pool_size(target_engine)
+    connections = []
+    try:
+        # Соединения удерживаются до конца цикла - иначе пул отдавал бы одно и то же
+        for _ in range(size):
+            connection = target_engine.connect()
+            connections.append(connection)
+            connection.exec_driver_sql("SELECT 1")
+    finally:
+        for connection in connections:
+            connection.close()
+    return size
+
+async def warm_async_pool(target_engine) -> int:
+    """То же для асинхронного движка"""
+    size = persistent_pool_size(target_engine.sync_engine)
+    connections = []
+    try:
+        for _ in range(size):
+            connection = await target_engine.connect()
+            connections.append(connection)
+            await connection.exec_driver_sql("SELECT 1")
+    finally:
+        for connection in connections:
+            await connection.close()
+    return size
+
+# ==================== ИНСТРУМЕНТАЦИЯ SQL ====================
+# Вместо echo=True каждый SQL запрос учитывается в статистике текущего HTTP запроса:
+# число запросов, суммарное время в базе данных и самый медленный запрос.
+# Статистика возвращается в заголовках ответа X-DB-* и копится по эндпоинтам
+# (GET /debug/sql-stats). Если один и тот же запрос выполнен N_PLUS_ONE_THRESHOLD
+# и более раз за HTTP запрос - это признак проблемы N+1 (запрос в цикле).
+# У потоковых ответов (stream=true, SSE) SQL запросы выполняются уже после отправки
+# заголовков, поэтому заголовков X-DB-* у них нет, а статистика эндпоинта
+# записывается, когда тело ответа отдано целиком.
+
+class RequestQueryStats:
+    """Статистика SQL запросов одного HTTP запроса"""
+
+    def __init__(self):
+        self.count = 0                 # Сколько SQL запросов выполнено
+        self.total_time = 0.0          # Суммарное время в базе данных (секунды)
+        self.slowest_time = 0.0        # Время самого медленного запроса
+        self.slowest_statement = None  # Текст самого медленного запроса
+        self.statements = Counter()    # Сколько раз выполнялся каждый текст запроса
+
+    def record(self, statement: str, elapsed: float):
+        self.count += 1
+        self.total_time += elapsed
+        self.statements[statement] += 1
+        if elapsed >= self.slowest_time:
+            self.slowest_time = elapsed
+            self.slowest_statement = statement
+
+    def repeated_statements(self):
+        """Запросы, повторенные подозрительно много раз (N+1)"""
+        return [(statement, count) for statement, count in self.statements.items() if count >= N_PLUS_ONE_THRESHOLD]
+
+# Статистика текущего HTTP запроса (None вне HTTP запроса)
+current_query_stats: ContextVar[Optional[RequestQueryStats]] = ContextVar("current_query_stats", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Запоминаем время начала SQL запроса"""
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Учитываем выполненный SQL запрос в статистике текущего HTTP запроса"""
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    stats = current_query_stats.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+
+def instrument_engine(target_engine):
+    """Подключает учет SQL запросов к движку базы данных"""
+    event.listen(target_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(target_engine, "after_cursor_execute", _after_cursor_execute)
+
+class EndpointQueryStats:
+    """Накопленная статистика SQL запросов по эндпоинтам"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def add(self, endpoint: str, stats: RequestQueryStats, n_plus_one: bool):
+        with self._lock:
+            entry = self._endpoints.setdefault(endpoint, {
+                "requests": 0,
+                "queries": 0,
+                "db_time_ms": 0.0,
+                "max_queries": 0,
+                "slowest_ms": 0.0,
+                "slowest_statement": None,
+                "n_plus_one_requests": 0,
+            })
+            entry["requests"] += 1
+            entry["queries"] += stats.count
+            entry["db_time_ms"] += stats.total_time * 1000
+            entry["max_queries"] = max(entry["max_queries"], stats.count)
+            if stats.slowest_time * 1000 > entry["slowest_ms"]:
+                entry["slowest_ms"] = stats.slowest_time * 1000
+                entry["slowest_statement"] = stats.slowest_statement
+            if n_plus_one:
+                entry["n_plus_one_requests"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            result = {}
+            for endpoint, entry in self._endpoints.items():
+                result[endpoint] = {
+                    **entry,
+                    "avg_queries": round(entry["queries"] / entry["requests"], 2),
+                    "avg_db_time_ms": round(entry["db_time_ms"] / entry["requests"], 3),
+                    "db_time_ms": round(entry["db_time_ms"], 3),
+                    "slowest_ms": round(entry["slowest_ms"], 3),
+                }
+            return result
+
+endpoint_query_stats = EndpointQueryStats()
+
+instrument_engine(engine)
+if async_engine is not None:
+    instrument_engine(async_engine.sync_engine)
+if replica_engine is not None:
+    instrument_engine(replica_engine)
+if async_replica_engine is not None:
+    instrument_engine(async_replica_engine.sync_engine)
+
+def is_streaming_response(response: Response) -> bool:
+    """Потоковый ответ: тело без известной длины (ответы 204 и 304 без тела - не потоковые)"""
+    return "content-length" not in response.headers and response.status_code not in (204, 304)
+
+def record_query_stats(endpoint: str, stats: RequestQueryStats) -> list:
+    """Добавляет статистику HTTP запроса к статистике эндпоинта, возвращает запросы N+1"""
+    repeated = stats.repeated_statements()
+    for statement, count in repeated:
+        logger.warning("Возможна проблема N+1 в %s: запрос выполнен %d раз: %s", endpoint, count, statement[:200])
+    endpoint_query_stats.add(endpoint, stats, bool(repeated))
+    return repeated
+
+async def record_stats_after_body(body_iterator, endpoint: str, stats: RequestQueryStats):
+    """Отдает тело потокового ответа и после него записывает статистику SQL запросов"""
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        record_query_stats(endpoint, stats)
+
+@app.middleware("http")
+async def sql_instrumentation_middleware(request: Request, call_next):
+    """
+    Собирает статистику SQL запросов для каждого HTTP запроса
+    и добавляет ее в заголовки ответа
+    """
+    stats = RequestQueryStats()
+    token = current_query_stats.set(stats)
+    try:
+        response = await call_next(request)
+    finally:
+        current_query_stats.reset(token)
+
+    # Шаблон пути эндпоинта (например, /orders/{order_id}), а не конкретный URL
+    route = request.scope.get("route")
+    endpoint = f"{request.method} {route.path if route else request.url.path}"
+
+    if is_streaming_response(response):
+        response.body_iterator = record_stats_after_body(response.body_iterator, endpoint, stats)
+        return response
+
+    repeated = record_query_stats(endpoint, stats)
+    if repeated:
+        response.headers["X-DB-N-Plus-One"] = str(max(count for _, count in repeated))
+    response.headers["X-DB-Query-Count"] = str(stats.count)
+    response.headers["X-DB-Time-Ms"] = f"{stats.total_time * 1000:.3f}"
+    response.headers["X-DB-Slowest-Ms"] = f"{stats.slowest_time * 1000:.3f}"
+    return response
+
+# ==================== БЫСТРЫЕ ОТВЕТЫ И СЖАТИЕ ====================
+# Списки (меню, заказы, клиенты) - самые частые и самые большие ответы. Обычно FastAPI
+# заново проверяет каждую строку по response_model и кодирует JSON модулем json.
+# Строки из базы данных уже проверены моделью, поэтому в быстром режиме
+# (COFFEE_FAST_JSON=1, по умолчанию) списки отдаются готовым ответом FastJSONResponse:
+# без повторной проверки и через orjson, если он установлен.
+# Ответы от COMPRESS_MIN_BYTES байт сжимаются brotli (если установлен пакет brotli
+# и клиент его принимает) или gzip. Потоковые ответы (SSE, stream=true) не сжимаются.
+
+FAST_JSON = config_flag("fast_json", "COFFEE_FAST_JSON", True)
+COMPRESS_MIN_BYTES = int(config_value("compress_min_bytes", "COFFEE_COMPRESS_MIN_BYTES", 1024))  # 0 - не сжимать
+GZIP_LEVEL = 5      # Уровень gzip: дальше почти не меньше, но заметно дольше
+BROTLI_QUALITY = 4  # Качество brotli для ответов на лету
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+# Поля моделей, которые попадают в JSON (без скрытых полей exclude=True), по классам моделей
+json_fields_by_model = {}
+
+def json_fields(model) -> List[str]:
+    fields = json_fields_by_model.get(model)
+    if fields is None:
+        fields = [name for name, field in model.model_fields.items() if not field.exclude]
+        json_fields_by_model[model] = fields
+    return fields
+
+def to_jsonable(value):
+    """
+    Объекты, которые orjson не умеет кодировать сам
+    Строки из базы данных (SQLModel) - словарь значений полей без проверки pydantic
+    """
+    if isinstance(value, SQLModel):
+        # Загруженные значения лежат в __dict__; getattr нужен только для невыгруженных полей
+        data = value.__dict__
+        return {name: data[name] if name in data else getattr(value, name) for name in json_fields(type(value))}
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    raise TypeError(f"Тип {type(value).__name__} нельзя преобразовать в JSON")
+
+def encode_json(content) -> bytes:
+    """JSON в байтах: orjson, если установлен, иначе стандартный модуль json"""
+    if orjson is not None:
+        return orjson.dumps(content, default=to_jsonable, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """JSON ответ, который кодируется encode_json"""
+
+    def render(self, content) -> bytes:
+        return encode_json(content)
+
+def fast_response(content, response: Optional[Response] = None):
+    """
+    Ответ эндпоинта со строками из базы данных
+    В быстром режиме - FastJSONResponse без повторной проверки по response_model
+    (с заголовками, уже выставленными в response), иначе - обычный путь FastAPI
+    """
+    if not FAST_JSON:
+        return content
+    fast = FastJSONResponse(content)
+    if response is not None:
+        copy_response_headers(response, fast)
+    return fast
+
+def copy_response_headers(source: Response, target: Response):
+    """Переносит заголовки, выставленные эндпоинтом в source, в готовый ответ target"""
+    for name, value in source.headers.items():
+        if name not in ("content-length", "content-type"):
+            target.headers[name] = value
+
+class CompressionMiddleware:
+    """
+    Сжимает ответы от minimum_size байт (brotli или gzip - по заголовку Accept-Encoding)
+    Сжимаются только ответы с известной длиной (Content-Length): потоковые ответы
+    должны уходить клиенту сразу, по частям
+    """
+
+    def __init__(self, app, minimum_size: int):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.minimum_size <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        accepted = {part.split(";")[0].strip() for part in Headers(scope=scope).get("accept-encoding", "").split(",")}
+        encoding = "br" if brotli is not None and "br" in accepted else "gzip" if "gzip" in accepted else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        chunks = []
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                compress = (
+                    int(headers.get("content-length", "0")) >= self.minimum_size
+                    and "content-encoding" not in headers
+                    and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+                )
+                if compress:
+                    start_message = message  # Заголовки отправим вместе со сжатым телом
+                else:
+                    await send(message)
+                return
+            if start_message is None:
+                await send(message)
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(chunks)
+            if encoding == "br":
+                body = brotli.compress(body, quality=BROTLI_QUALITY)
+            else:
+                body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+            headers = MutableHeaders(raw=list(start_message["headers"]))
+            headers["content-encoding"] = encoding
+            headers["content-length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send({**start_message, "headers": headers.raw})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESS_MIN_BYTES)
+
+# ==================== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ====================
+
+def get_session():
+    """
+    Функция для получения сессии работы с базой данных
+    Используется в зависимости для каждого эндпоинта API
+    """
+    # expire_on_commit=False: после commit объекты не перечитываются из базы автоматически
+    # (где нужны значения, заполненные базой данных, вызывается session.refresh)
+    with Session(engine, expire_on_commit=False) as session:
+        yield session  # Возвращаем сессию для использования
+
+# SQLite пускает к записи одну транзакцию за раз. Синхронные эндпоинты ограничены пулом
+# потоков, а асинхронные начинают запись все сразу: транзакция, захватившая файл, ждет
+# своей очереди в цикле событий, остальные ждут блокировку дольше busy_timeout
+# и получают "database is locked". Поэтому с SQLite сессии записи асинхронного
+# режима выдаются по одной, остальные запросы ждут в очереди asyncio (чтение не ждет).
+async_sqlite_write_lock = asyncio.Lock() if async_engine is not None and async_engine.dialect.name == "sqlite" else None
+
+async def get_async_session():
+    """
+    Асинхронная версия get_session для эндпоинтов в режиме COFFEE_DB_MODE=async
+    expire_on_commit=False: после commit объекты не нужно перечитывать из базы данных
+    """
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        if async_sqlite_write_lock is None:
+            yield session
+            return
+        async with async_sqlite_write_lock:
+            yield session
+
+# ==================== РЕПЛИКА ДЛЯ ЧТЕНИЯ ====================
+# Если задан COFFEE_REPLICA_URL, безопасные GET эндпоинты (списки и карточки клиентов
+# и заказов, отчеты) получают сессию реплики через get_read_session, и отчеты
+# не конкурируют с оформлением заказов за основную базу. Изменения по-прежнему идут
+# в основную базу (get_session), а соединения реплики открываются только для чтения.
+# Реплика отстает от основной базы, поэтому после своего изменения (POST, PATCH, DELETE)
+# клиент получает cookie и REPLICA_STICKY_SECONDS секунд читает из основной базы -
+# так он сразу видит свой заказ. Заголовок X-DB-Route показывает, откуда прочитан ответ.
+# Локально: две базы SQLite (копия файла основной базы как реплика)
+# или два сервера PostgreSQL с потоковой репликацией.
+
+REPLICA_STICKY_SECONDS = int(config_value("replica_sticky_seconds", "COFFEE_REPLICA_STICKY_SECONDS", 5))
+PRIMARY_READS_COOKIE = "coffee_primary_until"  # До какого времени (unix time) читать из основной базы
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+def reads_primary(request: Request) -> bool:
+    """Клиент недавно изменял данные, и реплика может их еще не содержать"""
+    try:
+        return float(request.cookies.get(PRIMARY_READS_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+def read_engine(request: Request, replica, primary):
+    """Движок для чтения: реплика, если она есть и клиенту не нужны только что записанные данные"""
+    bind = replica if replica is not None and not reads_primary(request) else primary
+    request.state.db_route = "replica" if bind is replica else "primary"
+    return bind
+
+def get_read_session(request: Request):
+    """
+    Сессия для эндпоинтов, которые только читают данные
+    Без реплики - та же основная база, что и в get_session
+    """
+    bind = read_engine(request, replica_engine, engine)
+    with Session(bind, expire_on_commit=False) as session:
+        session.info["replica"] = bind is replica_engine
+        yield session
+
+async def get_async_read_session(request: Request):
+    """Асинхронная версия get_read_session"""
+    bind = read_engine(request, async_replica_engine, async_engine)
+    async with AsyncSession(bind, expire_on_commit=False) as session:
+        session.info["replica"] = bind is async_replica_engine
+        yield session
+
+def validators_version(session) -> Optional[int]:
+    """
+    Версия ETag заказов для order_conditional_response
+    ETag по данным реплики не запоминается (None): реплика могла еще не получить
+    изменение заказа, и сохраненный ETag отвечал бы 304 на устаревшие данные
+    """
+    return None if session.info.get("replica") else order_validators.version
+
+@app.middleware("http")
+async def replica_routing_middleware(request: Request, call_next):
+    """После успешного изменения клиент некоторое время читает из основной базы"""
+    response = await call_next(request)
+    if replica_engine is None:
+        return response
+    if request.method not in SAFE_METHODS and response.status_code < 400:
+        response.set_cookie(
+            PRIMARY_READS_COOKIE, str(int(time.time()) + REPLICA_STICKY_SECONDS),
+            max_age=REPLICA_STICKY_SECONDS, httponly=True, samesite="lax"
+        )
+    route = getattr(request.state, "db_route", None)
+    if route is not None:
+        response.headers["X-DB-Route"] = route
+    return response
+
+# ==================== МЕТРИКИ (PROMETHEUS) ====================
+# GET /metrics отдает метрики процесса в текстовом формате Prometheus: число и время
+# HTTP запросов по шаблонам путей, запросы в работе, состояние пулов соединений
+# и бизнес-счетчики (события заказов после commit, кэш меню, ответы 304).
+# Метрики собираются в памяти процесса: на запрос - несколько сложений под блокировкой,
+# без обращений к базе данных. При запуске с --workers N каждый воркер считает свое,
+# поэтому в ответе есть метка pid (счетчики разных процессов складываются в Prometheus).
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED_ROUTE = "<unmatched>"  # Путь запросов, не попавших ни в один эндпоинт (чтобы не плодить метки)
+
+class AppMetrics:
+    """Счетчики и гистограммы процесса сервера"""
+
+    def __init__(self):
+        self.in_flight = 0       # Меняется только в цикле событий (MetricsMiddleware)
+        self.requests = Counter()  # (метод, путь, код ответа) -> число запросов
+        self.durations = {}      # (метод, путь) -> Histogram времени ответа
+        self.order_events = Counter()  # Тип события заказа -> число (после commit)
+        self._lock = threading.Lock()
+
+    def request_finished(self, method: str, route: str, status: int, seconds: float):
+        key = (method, route)
+        with self._lock:
+            self.requests[(method, route, status)] += 1
+            histogram = self.durations.get(key)
+            if histogram is None:
+                histogram = self.durations[key] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(seconds)
+
+    def count_order_events(self, event_types):
+        if event_types:
+            with self._lock:
+                self.order_events.update(event_types)
+
+app_metrics = AppMetrics()
+
+class MetricsMiddleware:
+    """
+    Считает HTTP запросы: время - до отправки ответа целиком (для потоков - до их закрытия)
+    Внешний слой приложения, поэтому учитывает и время остальных middleware
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500  # Если приложение упало до начала ответа
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        app_metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            app_metrics.in_flight -= 1
+            route = scope.get("route")
+            app_metrics.request_finished(
+                scope["method"], route.path if route else UNMATCHED_ROUTE, status, time.perf_counter() - started
+            )
+
+app.add_middleware(MetricsMiddleware)
+
+def metric_label_value(value) -> str:
+    """Экранирование значения метки: обратная косая черта, кавычка и перевод строки"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def metric_labels(**labels) -> str:
+    """Метки в формате Prometheus: {name="value",...}"""
+    return "{" + ",".join(f'{name}="{metric_label_value(value)}"' for name, value in labels.items()) + "}"
+
+def histogram_lines(name: str, histogram: Histogram, **labels) -> List[str]:
+    """Строки гистограммы: накопленные корзины _bucket, _sum и _count"""
+    counts, total = histogram.snapshot()
+    lines = []
+    cumulative = 0
+    for bound, count in zip(list(histogram.bounds) + ["+Inf"], counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{metric_labels(**labels, le=bound)} {cumulative}")
+    lines.append(f"{name}_sum{metric_labels(**labels)} {total}")
+    lines.append(f"{name}_count{metric_labels(**labels)} {cumulative}")
+    return lines
+
+def database_pools() -> List[tuple]:
+    """Пулы соединений процесса с метками: (название, пул)"""
+    engines = [("primary", engine), ("replica", replica_engine)]
+    if async_engine is not None:
+        engines.append(("primary_async", async_engine.sync_engine))
+    if async_replica_engine is not None:
+        engines.append(("replica_async", async_replica_engine.sync_engine))
+    return [(name, target.pool) for name, target in engines if target is not None and isinstance(target.pool, QueuePool)]
+
+def render_metrics() -> str:
+    """Все метрики процесса в текстовом формате Prometheus"""
+    pid = os.getpid()
+    lines = []
+
+    def metric(name: str, kind: str, help_text: str, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{metric_labels(pid=pid, **labels)} {value}")
+
+    with app_metrics._lock:
+        requests = sorted(app_metrics.requests.items())
+        durations = sorted(app_metrics.durations.items())
+        order_event_counts = sorted(app_metrics.order_events.items())
+
+    metric("coffee_http_requests_total", "counter", "HTTP запросы по методу, шаблону пути и коду ответа", [
+        ({"method": method, "route": route, "status": status}, count)
+        for (method, route, status), count in requests
+    ])
+    metric("coffee_http_requests_in_flight", "gauge", "HTTP запросы в работе", [({}, app_metrics.in_flight)])
+    lines.append("# HELP coffee_http_request_duration_seconds Время ответа на HTTP запрос")
+    lines.append("# TYPE coffee_http_request_duration_seconds histogram")
+    for (method, route), histogram in durations:
+        lines.extend(histogram_lines("coffee_http_request_duration_seconds", histogram, pid=pid, method=method, route=route))
+
+    pools = database_pools()
+    metric("coffee_db_pool_size", "gauge", "Постоянные соединения пула (pool_size)", [
+        ({"pool": name}, pool.size()) for name, pool in pools
+    ])
+    metric("coffee_db_pool_checked_out", "gauge", "Соединения, выданные из пула", [
+        ({"pool": name}, pool.checkedout()) for name, pool in pools
+    ])
+    metric("coffee_db_pool_overflow", "gauge", "Открытые сверх pool_size соединения", [
+        ({"pool": name}, max(pool.overflow(), 0)) for name, pool in pools
+    ])
+    timed_pools = [(name, pool) for name, pool in pools if isinstance(pool, TimedPoolMixin)]
+    metric("coffee_db_pool_timeouts_total", "counter", "Отказы: соединение не освободилось за pool_timeout", [
+        ({"pool": name}, pool.timeouts) for name, pool in timed_pools
+    ])
+    lines.append("# HELP coffee_db_pool_wait_seconds Время получения соединения из пула")
+    lines.append("# TYPE coffee_db_pool_wait_seconds histogram")
+    for name, pool in timed_pools:
+        lines.extend(histogram_lines("coffee_db_pool_wait_seconds", pool.wait_time, pid=pid, pool=name))
+
+    metric("coffee_order_events_total", "counter", "События заказов после commit (order.created, order.paid, ...)", [
+        ({"type": event_type}, count) for event_type, count in order_event_counts
+    ])
+    metric("coffee_menu_cache_hits_total", "counter", "Чтения меню из кэша", [({}, menu_catalog.hits)])
+    metric("coffee_menu_cache_misses_total", "counter", "Чтения меню с загрузкой из базы данных", [({}, menu_catalog.misses)])
+    metric("coffee_order_not_modified_total", "counter", "Ответы 304 по ETag заказов", [({}, order_validators.not_modified)])
+    metric("coffee_kitchen_subscribers", "gauge", "Подключенные экраны кухни", [({}, order_events.stats()["subscribers"])])
+    health = health_monitor.status()
+    metric("coffee_ready", "gauge", "Готовность по последней проверке базы данных (1 - готов)", [({}, int(health["ready"]))])
+    if health["latency_ms"] is not None:
+        metric("coffee_db_ping_seconds", "gauge", "Время SELECT 1 при последней проверке", [({}, health["latency_ms"] / 1000)])
+    return "\n".join(lines) + "\n"
+
+# ==================== КЭШ МЕНЮ ====================
+# Меню меняется несколько раз в день, а читается тысячи раз в час.
+# Поэтому процесс держит копию меню в памяти с индексами по id и по категории,
+# а эндпоинты изменения меню сбрасывают ее (сброс увеличивает версию каталога).
+# TTL ограничивает время, в течение которого процесс может не видеть
+# изменения, сделанные другим процессом (другим воркером сервера).
+
+MENU_CACHE_TTL_SECONDS = 60  # Максимальный возраст копии меню в секундах
+
+class MenuCatalog:
+    """
+    Копия таблицы меню в памяти процесса
+    Объекты MenuItem в каталоге общие для всех запросов, их нельзя изменять
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.version = 0           # Версия каталога, растет при каждом сбросе
+        self._snapshot = None      # Текущая копия меню (словарь с индексами)
+        self._lock = threading.Lock()
+        self._etag = None          # ETag и время изменения последней загруженной копии
+        self._modified_at = None
+        # Статистика работы кэша. Счетчики меняются из разных потоков, поэтому под своей
+        # блокировкой: _lock держится на время загрузки меню из базы, а peek() вызывается
+        # из цикла событий и не должен ждать загрузку
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.invalidations = 0
+
+    def _count(self, hits: int = 0, misses: int = 0, reloads: int = 0, invalidations: int = 0):
+        """Увеличивает счетчики статистики"""
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += misses
+            self.reloads += reloads
+            self.invalidations += invalidations
+
+    def _is_fresh(self, snapshot) -> bool:
+        """Проверяет, что копия меню построена для текущей версии и не устарела"""
+        return (
+            snapshot is not None
+            and snapshot["version"] == self.version
+            and time.monotonic() - snapshot["loaded_at"] < self.ttl_seconds
+        )
+
+    def _load_snapshot(self, version: int):
+        """Загружает меню из базы данных одним запросом и строит индексы"""
+        with Session(engine) as session:
+            items = session.exec(select(MenuItem).order_by(MenuItem.id)).all()
+            session.expunge_all()  # Отвязываем объекты от сессии, чтобы хранить их после ее закрытия
+
+        available = [item for item in items if item.is_available]
+        by_category = {}
+        for item in available:
+            by_category.setdefault(item.category, []).append(item)
+
+        # ETag - отпечаток содержимого меню: у процессов с одинаковым меню он одинаковый.
+        # Last-Modified меняется, только если содержимое при перезагрузке изменилось
+        etag = make_etag(encode_json(items))
+        modified_at = self._modified_at if etag == self._etag else time.time()
+        self._etag, self._modified_at = etag, modified_at
+
+        return {
+            "version": version,
+            "loaded_at": time.monotonic(),
+            "etag": etag,
+            "modified_at": modified_at,
+            "items": items,
+            "available": available,
+            "by_id": {item.id: item for item in items},
+            "by_category": by_category,
+        }
+
+    def _get_snapshot(self):
+        """Возвращает актуальную копию меню, при необходимости перезагружая ее"""
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot):
+            self._count(hits=1)
+            return snapshot
+
+        with self._lock:
+            # Другой поток мог уже перезагрузить меню, пока мы ждали блокировку
+            snapshot = self._snapshot
+            if self._is_fresh(snapshot):
+                self._count(hits=1)
+                return snapshot
+            self._count(misses=1, reloads=1)
+            # Если меню сбросят во время загрузки, версия не совпадет и копия перезагрузится
+            snapshot = self._load_snapshot(self.version)
+            self._snapshot = snapshot
+            return snapshot
+
+    def snapshot(self) -> dict:
+        """
+        Текущая копия меню целиком: списки позиций, индексы, ETag и время изменения
+        Нужна, когда ответ и его ETag должны быть взяты из одной и той же копии
+        """
+        return self._get_snapshot()
+
+    def all_items(self) -> List[MenuItem]:
+        """Все позиции меню"""
+        return self._get_snapshot()["items"]
+
+    def available_items(self) -> List[MenuItem]:
+        """Только доступные позиции меню"""
+        return self._get_snapshot()["available"]
+
+    def by_category(self, category: str) -> List[MenuItem]:
+        """Доступные позиции меню заданной категории"""
+        return self._get_snapshot()["by_category"].get(category, [])
+
+    def get(self, menu_item_id: int) -> Optional[MenuItem]:
+        """
+        Позиция меню по ID
+        Если позиции нет в копии (например, ее только что создал другой процесс),
+        проверяем базу данных и при находке сбрасываем устаревшую копию
+        """
+        menu_item = self._get_snapshot()["by_id"].get(menu_item_id)
+        if menu_item is not None:
+            return menu_item
+
+        self._count(misses=1)
+        with Session(engine) as session:
+            menu_item = session.get(MenuItem, menu_item_id)
+            if menu_item is not None:
+                session.expunge(menu_item)
+        if menu_item is not None:
+            self.invalidate()
+        return menu_item
+
+    def get_many(self, menu_item_ids: List[int]) -> dict:
+        """
+        Несколько позиций меню по ID: словарь {id: MenuItem}
+        Позиции, которых нет в копии меню, читаются из базы данных одним запросом
+        """
+        by_id = self._get_snapshot()["by_id"]
+        found = {menu_item_id: by_id[menu_item_id] for menu_item_id in menu_item_ids if menu_item_id in by_id}
+        missing = set(menu_item_ids) - found.keys()
+        if not missing:
+            return found
+
+        self._count(misses=1)
+        with Session(engine) as session:
+            rows = session.exec(select(MenuItem).where(MenuItem.id.in_(missing))).all()
+            session.expunge_all()
+        if rows:
+            found.update({row.id: row for row in rows})
+            self.invalidate()
+        return found
+
+    def peek(self, menu_item_id: int) -> Optional[MenuItem]:
+        """
+        Позиция меню по ID без обращения к базе данных
+        Возвращает None, если копия меню устарела или позиции в ней нет
+        """
+        snapshot = self._snapshot
+        if not self._is_fresh(snapshot):
+            return None
+        menu_item = snapshot["by_id"].get(menu_item_id)
+        if menu_item is not None:
+            self._count(hits=1)
+        return menu_item
+
+    def invalidate(self):
+        """Сбрасывает копию меню (вызывается после каждого изменения меню)"""
+        with self._lock:
+            self.version += 1
+            self._snapshot = None
+        self._count(invalidations=1)
+
+    def stats(self) -> dict:
+        """Статистика попаданий и промахов кэша"""
+        snapshot = self._snapshot
+        with self._stats_lock:
+            hits, misses, reloads, invalidations = self.hits, self.misses, self.reloads, self.invalidations
+        lookups = hits + misses
+        return {
+            "version": self.version,
+            "etag": snapshot["etag"] if snapshot else None,
+            "ttl_seconds": self.ttl_seconds,
+            "cached_items": len(snapshot["items"]) if snapshot else 0,
+            "age_seconds": round(time.monotonic() - snapshot["loaded_at"], 3) if snapshot else None,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else None,
+            "reloads": reloads,
+            "invalidations": invalidations,
+        }
+
+# Каталог меню этого процесса
+menu_catalog = MenuCatalog(MENU_CACHE_TTL_SECONDS)
+
+# ==================== УСЛОВНЫЕ ЗАПРОСЫ (ETAG) ====================
+# Терминалы постоянно перечитывают меню и открытые заказы, хотя они меняются редко.
+# Ответы меню и заказа несут ETag (отпечаток содержимого) и Last-Modified; если
+# клиент присылает If-None-Match с тем же ETag, сервер отвечает 304 без тела.
+# ETag меню берется из копии меню в памяти (КЭШ МЕНЮ), ETag заказов - из
+# order_validators: ETag уже отданных заказов без самих данных. Оба сбрасываются
+# при каждом изменении (меню - invalidate(), заказы - события заказов после commit),
+# поэтому 304 отдается без обращения к базе данных. Изменения из других процессов
+# заказы видят через PostgreSQL NOTIFY (COFFEE_EVENT_BACKEND=postgres), а в остальных
+# случаях - не позже чем через TTL, как и кэш меню.
+
+ORDER_VALIDATOR_TTL_SECONDS = 60      # Сколько доверять сохраненному ETag заказа
+ORDER_VALIDATOR_MAX_ENTRIES = 10000   # Сколько заказов помнить (самые старые вытесняются)
+
+def make_etag(body: bytes) -> str:
+    """
+    Слабый ETag по содержимому ответа
+    Слабый - потому что одно и то же содержимое уходит и сжатым, и несжатым
+    """
+    return 'W/"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Совпадает ли ETag с одним из ETag заголовка If-None-Match (слабое сравнение)"""
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return etag.removeprefix("W/") in [tag.removeprefix("W/") for tag in tags]
+
+def is_not_modified(request: Request, etag: str, modified_at: float) -> bool:
+    """
+    Не изменился ли ресурс с версии, которая есть у клиента
+    If-None-Match важнее If-Modified-Since (если есть оба, второй не проверяется)
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return int(modified_at) <= since.timestamp()
+    return False
+
+def validator_headers(etag: str, modified_at: float) -> dict:
+    """ETag и Last-Modified; no-cache - клиент может хранить ответ, но должен его перепроверять"""
+    return {
+        "ETag": etag,
+        "Last-Modified": formatdate(modified_at, usegmt=True),
+        "Cache-Control": "no-cache"
+    }
+
+def not_modified_response(etag: str, modified_at: float) -> Response:
+    """Ответ 304 Not Modified: только заголовки, без тела"""
+    return Response(status_code=304, headers=validator_headers(etag, modified_at))
+
+def conditional_response(request: Request, response: Response, content, etag: str, modified_at: float):
+    """Ответ с ETag и Last-Modified или 304, если у клиента уже есть эта версия"""
+    if is_not_modified(request, etag, modified_at):
+        return not_modified_response(etag, modified_at)
+    response.headers.update(validator_headers(etag, modified_at))
+    return fast_response(content, response)
+
+class OrderValidators:
+    """
+    ETag и время изменения уже отданных ответов по заказам
+    Хранятся только ETag (не данные заказов), по ключу (ресурс, ID заказа)
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.version = 0  # Растет при каждом сбросе
+        self._entries = OrderedDict()  # (ресурс, ID заказа) -> (etag, modified_at, stored_at)
+        self._lock = threading.Lock()
+        self.not_modified = 0
+        self.invalidations = 0
+
+    def get(self, resource: str, order_id: int):
+        """(etag, modified_at) или None, если ETag заказа неизвестен или устарел"""
+        entry = self._entries.get((resource, order_id))
+        if entry is None or time.monotonic() - entry[2] >= self.ttl_seconds:
+            return None
+        return entry[0], entry[1]
+
+    def store(self, resource: str, order_id: int, etag: str, version: int) -> float:
+        """
+        Запоминает ETag, вычисленный по данным, прочитанным при версии version
+        Если заказы сбрасывались после чтения, данные могли устареть - ETag не сохраняется
+        Возвращает время изменения (Last-Modified) для ответа
+        """
+        key = (resource, order_id)
+        with self._lock:
+            previous = self._entries.get(key)
+            modified_at = previous[1] if previous is not None and previous[0] == etag else time.time()
+            if version == self.version:
+                self._entries[key] = (etag, modified_at, time.monotonic())
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return modified_at
+
+    def invalidate(self, order_id: int):
+        """Забывает ETag заказа (вызывается после каждого изменения заказа)"""
+        with self._lock:
+            self.version += 1
+            self.invalidations += 1
+            for resource in ORDER_RESOURCES:
+                self._entries.pop((resource, order_id), None)
+
+    def clear(self):
+        """Забывает ETag всех заказов (массовые изменения: очистка, архив, сверка сумм)"""
+        with self._lock:
+            self.version += 1
+            self.invalidations += 1
+            self._entries.clear()
+
+ORDER_RESOURCES = ("order", "order_detail")  # Ответы по заказу, у которых есть ETag
+
+# ETag заказов этого процесса
+order_validators = OrderValidators(ORDER_VALIDATOR_TTL_SECONDS, ORDER_VALIDATOR_MAX_ENTRIES)
+
+def cached_order_not_modified(request: Request, resource: str, order_id: int) -> Optional[Response]:
+    """Ответ 304 по сохраненному ETag заказа (без обращения к базе данных) или None"""
+    validators = order_validators.get(resource, order_id)
+    if validators is None or not is_not_modified(request, *validators):
+        return None
+    order_validators.not_modified += 1
+    return not_modified_response(*validators)
+
+def order_conditional_response(request: Request, response: Response, resource: str, order_id: int, content, version: int):
+    """
+    Ответ по заказу с ETag по его содержимому; ETag запоминается для следующих запросов
+    version - order_validators.version до чтения заказа из базы данных
+    (None - ETag не запоминается, см. validators_version)
+    """
+    body = encode_json(content)
+    etag = make_etag(body)
+    modified_at = order_validators.store(resource, order_id, etag, version)
+    if is_not_modified(request, etag, modified_at):
+        order_validators.not_modified += 1
+        return not_modified_response(etag, modified_at)
+    response.headers.update(validator_headers(etag, modified_at))
+    if not FAST_JSON:
+        return content
+    # Тело уже закодировано для ETag - отдаем его как есть
+    encoded = Response(body, media_type="application/json")
+    copy_response_headers(response, encoded)
+    return encoded
+
+def order_payload(order) -> dict:
+    """Поля заказа для ответа /orders/{id} (рабочего или архивного - одинаково)"""
+    return {name: getattr(order, name) for name in json_fields(Order)}
+
+# ==================== ПОСТРАНИЧНАЯ ВЫДАЧА (KEYSET) ====================
+# Большие таблицы (клиенты, заказы) отдаются страницами: клиент передает
+# limit и курсор after (ID последней полученной записи), а сервер читает
+# только следующую страницу по индексу первичного ключа.
+# ID выдается по порядку вставки, поэтому порядок по id совпадает с порядком по created_at.
+
+DEFAULT_PAGE_SIZE = 100   # Размер страницы по умолчанию
+MAX_PAGE_SIZE = 1000      # Максимальный размер страницы
+STREAM_BATCH_SIZE = 500   # Сколько строк читать с сервера БД за раз в потоковом режиме
+
+def keyset_page_statement(model, limit: int, after: Optional[int]):
+    """
+    Запрос одной страницы записей модели, отсортированных по id
+    Берем на одну запись больше, чтобы узнать, есть ли следующая страница
+    """
+    statement = select(model)
+    if after is not None:
+        statement = statement.where(model.id > after)
+    return statement.order_by(model.id).limit(limit + 1)
+
+def split_keyset_page(rows, limit: int):
+    """
+    Отрезает лишнюю запись от результата keyset_page_statement
+    Возвращает (список записей, курсор следующей страницы или None)
+    """
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1].id
+    return rows, None
+
+def fetch_keyset_page(session: Session, model, limit: int, after: Optional[int]):
+    """
+    Читает одну страницу записей модели, отсортированных по id
+    Возвращает (список записей, курсор следующей страницы или None)
+    """
+    rows = session.exec(keyset_page_statement(model, limit, after)).all()
+    return split_keyset_page(rows, limit)
+
+def set_pagination_headers(request: Request, response: Response, limit: int, next_cursor: Optional[int]):
+    """
+    Добавляет в ответ курсор следующей страницы (X-Next-Cursor и Link)
+    """
+    if next_cursor is None:
+        return
+    next_url = request.url.include_query_params(after=next_cursor, limit=limit)
+    response.headers["X-Next-Cursor"] = str(next_cursor)
+    response.headers["Link"] = f'<{next_url}>; rel="next"'
+
+def stream_statement(model, after: Optional[int], limit: Optional[int]):
+    """
+    Запрос для потоковой выгрузки: строки читаются серверным курсором
+    пачками по STREAM_BATCH_SIZE, поэтому память не растет вместе с размером таблицы
+    """
+    statement = select(model).order_by(model.id)
+    if after is not None:
+        statement = statement.where(model.id > after)
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement.execution_options(stream_results=True, yield_per=STREAM_BATCH_SIZE)
+
+def stream_json_array(model, after: Optional[int], limit: Optional[int], bind):
+    """
+    Потоково отдает записи модели в виде JSON массива
+    bind - движок сессии эндпоинта (основная база или реплика)
+    """
+    # Генератор работает после выхода из эндпоинта, поэтому открывает свою сессию
+    with Session(bind) as session:
+        yield "["
+        separator = ""
+        for row in session.exec(stream_statement(model, after, limit)):
+            yield separator + encode_json(row).decode("utf-8")
+            separator = ","
+        yield "]"
+
+async def stream_json_array_async(model, after: Optional[int], limit: Optional[int], bind):
+    """
+    Асинхронная версия stream_json_array (режим COFFEE_DB_MODE=async)
+    """
+    async with AsyncSession(bind) as session:
+        rows = await session.stream_scalars(stream_statement(model, after, limit))
+        yield "["
+        separator = ""
+        async for row in rows:
+            yield separator + encode_json(row).decode("utf-8")
+            separator = ","
+        yield "]"
+
+# ==================== СОСТАВ ЗАКАЗА ОДНИМ ЗАПРОСОМ ====================
+# Заказ, его позиции и названия позиций меню читаются одним SQL запросом
+# с JOIN по связям Order.items и OrderItem.menu_item (вместо запроса на каждую позицию).
+# Если среди рабочих заказов его нет, тот же запрос выполняется по архивным таблицам.
+
+def order_detail_statement(order_id: int):
+    """
+    Запрос заказа вместе с позициями и названиями из меню
+    LEFT JOIN - чтобы заказ без позиций тоже был найден
+    """
+    return (
+        select(Order, OrderItem, MenuItem.name)
+        .outerjoin(Order.items)
+        .outerjoin(OrderItem.menu_item)
+        .where(Order.id == order_id)
+        .order_by(OrderItem.id)
+    )
+
+def archived_order_detail_statement(order_id: int):
+    """
+    То же для заказа, перенесенного в архив (OrderArchive и OrderItemArchive)
+    Связей у архивных таблиц нет, поэтому JOIN по полям
+    """
+    return (
+        select(OrderArchive, OrderItemArchive, MenuItem.name)
+        .outerjoin(OrderItemArchive, OrderItemArchive.order_id == OrderArchive.id)
+        .outerjoin(MenuItem, MenuItem.id == OrderItemArchive.menu_item_id)
+        .where(OrderArchive.id == order_id)
+        .order_by(OrderItemArchive.id)
+    )
+
+def build_order_detail(rows):
+    """
+    Собирает результат order_detail_statement (или archived_order_detail_statement)
+    в (заказ, список позиций)
+    Если заказ не найден - возвращает (None, [])
+    """
+    if not rows:
+        return None, []
+
+    order = rows[0][0]
+    items = []
+    for _, item, menu_item_name in rows:
+        if item is None or menu_item_name is None:
+            continue  # Заказ без позиций
+        items.append({
+            "id": item.id,
+            "menu_item_name": menu_item_name,
+            "quantity": item.quantity,
+            "price_per_item": item.price / item.quantity if item.quantity > 0 else 0,
+            "total_price": item.price,
+            "customizations": item.customizations
+        })
+    return order, items
+
+def find_order_detail(session: Session, order_id: int):
+    """(заказ, позиции): сначала среди рабочих заказов, затем в архиве (как find_order)"""
+    order, items = build_order_detail(session.exec(order_detail_statement(order_id)).all())
+    if order is None:
+        order, items = build_order_detail(session.exec(archived_order_detail_statement(order_id)).all())
+    return order, items
+
+def order_detail_response(order: Order, items: list) -> dict:
+    """Ответ эндпоинта /orders/{id}/detail: поля заказа и его позиции"""
+    return {
+        "order_id": order.id,
+        "customer_id": order.customer_id,
+        "status": order.status,
+        "payment_status": order.payment_status,
+        "total_amount": order.total_amount,
+        "created_at": order.created_at,
+        "completed_at": order.completed_at,
+        "items": items
+    }
+
+# ==================== СУММА ЗАКАЗА ====================
+# Сумма заказа меняется одним атомарным UPDATE на величину добавленной или
+# удаленной позиции, в той же транзакции, что и сама позиция. Пересчитывать
+# все позиции заказа не нужно, а параллельные добавления не теряют изменения,
+# потому что прибавление выполняется в самой базе данных.
+# Правило осталось прежним: пока у заказа нет позиций, его сумма - та, что указал клиент,
+# с первой позицией сумма становится суммой позиций, а без позиций - нулем.
+# Перед UPDATE строка заказа блокируется (SELECT ... FOR UPDATE): в PostgreSQL (READ COMMITTED)
+# UPDATE, дождавшийся чужой транзакции, проверяет EXISTS по старому снимку и не видит
+# только что добавленную первую позицию - и сумма этой позиции терялась бы.
+# После блокировки UPDATE - новый запрос с новым снимком. SQLite пишет по одной транзакции,
+# ему блокировка не нужна (FOR UPDATE в SQLite не передается).
+
+ORDER_TOTAL_TOLERANCE = 0.005       # Допустимое расхождение суммы (копейки после округления)
+RECONCILE_BATCH_SIZE = 10000        # Сколько заказов проверять за один запрос при сверке
+
+def order_has_items(order_id: int):
+    """Условие EXISTS: у заказа есть хотя бы одна позиция (проверка по индексу)"""
+    return exists().where(OrderItem.order_id == order_id)
+
+def lock_order_statement(order_id: int):
+    """
+    SELECT ... FOR UPDATE строки заказа: изменения суммы заказа выполняются по очереди
+    Возвращает сумму до изменения, статус оплаты и время создания (для сводок продаж)
+    """
+    return (
+        select(Order.total_amount, Order.payment_status, Order.created_at)
+        .where(Order.id == order_id)
+        .with_for_update()
+    )
+
+def add_to_order_total_statement(order_id: int, amount: float):
+    """
+    UPDATE суммы заказа перед вставкой новой позиции, возвращающий новую сумму
+    Если позиций еще нет - сумма становится ценой первой позиции
+    """
+    return (
+        update(Order)
+        .where(Order.id == order_id)
+        .values(
+            total_amount=case((order_has_items(order_id), Order.total_amount + amount), else_=amount),
+            version=Order.version + 1
+        )
+        .returning(Order.total_amount)
+        .execution_options(synchronize_session=False)
+    )
+
+def subtract_from_order_total_statement(order_id: int, amount: float):
+    """
+    UPDATE суммы заказа после удаления позиции, возвращающий новую сумму
+    Если позиций не осталось - сумма становится нулевой
+    """
+    return (
+        update(Order)
+        .where(Order.id == order_id)
+        .values(
+            total_amount=case((order_has_items(order_id), Order.total_amount - amount), else_=0.0),
+            version=Order.version + 1
+        )
+        .returning(Order.total_amount)
+        .execution_options(synchronize_session=False)
+    )
+
+def delete_order_item_statement(order_item_id: int):
+    """DELETE позиции заказа, возвращающий ее заказ, цену, позицию меню и количество (DELETE ... RETURNING)"""
+    return (
+        delete(OrderItem)
+        .where(OrderItem.id == order_item_id)
+        .returning(OrderItem.order_id, OrderItem.price, OrderItem.menu_item_id, OrderItem.quantity)
+        .execution_options(synchronize_session=False)
+    )
+
+def order_total_mismatch_statement(first_id: int, last_id: int):
+    """
+    Заказы с позициями из диапазона ID, у которых сумма не совпадает с суммой позиций
+    Один запрос с GROUP BY вместо чтения позиций каждого заказа
+    """
+    lines_total = func.sum(OrderItem.price)
+    return (
+        select(Order.id, Order.total_amount, lines_total, Order.payment_status, Order.created_at)
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .where(Order.id >= first_id, Order.id <= last_id)
+        .group_by(Order.id, Order.total_amount, Order.payment_status, Order.created_at)
+        .having(func.abs(Order.total_amount - lines_total) > ORDER_TOTAL_TOLERANCE)
+    )
+
+def reconcile_order_totals(session: Session, fix: bool, batch_size: int = RECONCILE_BATCH_SIZE) -> dict:
+    """
+    Сверяет суммы заказов с суммами их позиций пачками по batch_size заказов
+    Если fix=True - исправляет найденные расхождения (каждая пачка в своей транзакции)
+    """
+    max_id = session.exec(select(func.max(Order.id))).one() or 0
+    mismatched = []
+    fixed = 0
+
+    for first_id in range(1, max_id + 1, batch_size):
+        last_id = first_id + batch_size - 1
+        rows = session.exec(order_total_mismatch_statement(first_id, last_id)).all()
+        for order_id, stored_total, lines_total, payment_status, created_at in rows:
+            mismatched.append({
+                "order_id": order_id,
+                "stored_total": stored_total,
+                "items_total": lines_total
+            })
+            if fix:
+                session.exec(
+                    update(Order)
+                    .where(Order.id == order_id)
+                    .values(total_amount=lines_total, version=Order.version + 1)
+                    .execution_options(synchronize_session=False)
+                )
+                if payment_status == "PAID":
+                    # Выручка в сводке считалась по неверной сумме
+                    record_paid_order_change(session, created_at, lines_total - stored_total)
+                fixed += 1
+        if fix and rows:
+            session.commit()
+            order_validators.clear()
+
+    return {
+        "checked_up_to_order_id": max_id,
+        "mismatched": len(mismatched),
+        "fixed": fixed,
+        "orders": mismatched[:100]  # Первые 100 расхождений для просмотра
+    }
+
+# ==================== СТАТУСЫ ЗАКАЗА ====================
+# Заказ проходит статусы CREATED -> PAID -> IN_PROGRESS -> COMPLETED
+# (заказ можно завершить и сразу после оплаты, минуя IN_PROGRESS).
+# Переход - один условный UPDATE ... WHERE status IN (...) RETURNING: если два бариста
+# одновременно завершают один заказ, строку изменит только первый, второй получит 409.
+# Каждое изменение заказа увеличивает его версию; клиент может передать ожидаемую
+# версию (?version=N), и тогда заказ, измененный после того, как клиент его прочитал,
+# тоже вернет 409. Лишние запросы выполняются только на пути ошибки (чтобы объяснить ее).
+
+# Действие: (из каких статусов, в какой статус, событие для кухни, что делает действие)
+ORDER_TRANSITIONS = {
+    "pay": (("CREATED",), "PAID", "order.paid", "оплатить"),
+    "start": (("PAID",), "IN_PROGRESS", "order.started", "начать готовить"),
+    "complete": (("PAID", "IN_PROGRESS"), "COMPLETED", "order.completed", "завершить"),
+}
+
+def order_transition_statement(action: str, order_ids: List[int], expected_version: Optional[int] = None):
+    """UPDATE заказов, которые сейчас в допустимом для действия статусе, возвращающий измененные заказы"""
+    sources, target, _, _ = ORDER_TRANSITIONS[action]
+    conditions = [Order.id.in_(order_ids), Order.status.in_(sources)]
+    if expected_version is not None:
+        conditions.append(Order.version == expected_version)
+
+    values = {"status": target, "version": Order.version + 1}
+    if action == "pay":
+        values["payment_status"] = "PAID"
+    elif action == "complete":
+        values["completed_at"] = datetime.utcnow()
+
+    return (
+        update(Order)
+        .where(*conditions)
+        .values(**values)
+        .returning(Order)
+        .execution_options(synchronize_session=False, populate_existing=True)
+    )
+
+def apply_order_transition(session: Session, action: str, order_ids: List[int], expected_version: Optional[int] = None) -> List[Order]:
+    """
+    Переводит заказы в следующий статус и обновляет сводки продаж и очередь кухни
+    в той же транзакции. Возвращает измененные заказы (commit делает вызывающий)
+    """
+    if action not in ORDER_TRANSITIONS:
+        raise HTTPException(status_code=400, detail=f"Неизвестное действие: {action}. Допустимо: {', '.join(ORDER_TRANSITIONS)}")
+    orders = session.exec(order_transition_statement(action, order_ids, expected_version)).scalars().all()
+
+    if action == "pay":
+        record_orders_paid(session, orders)
+    elif action == "complete":
+        record_orders_completed(session, orders)
+    event_type = ORDER_TRANSITIONS[action][2]
+    for order in orders:
+        queue_order_event(session, order_event(event_type, order.id, **order_state(order)))
+    return orders
+
+def raise_transition_conflict(session: Session, action: str, order_id: int, expected_version: Optional[int]):
+    """Объясняет, почему заказ не перешел в следующий статус: 404 или 409"""
+    order = session.get(Order, order_id)
+    if order is None:
+        if session.get(OrderArchive, order_id) is not None:
+            raise HTTPException(status_code=409, detail="Заказ перенесен в архив и не может быть изменен")
+        raise HTTPException(status_code=404, detail="Заказ не найден")
+    if expected_version is not None and order.version != expected_version:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Заказ изменен другим запросом: версия {order.version}, ожидалась {expected_version}"
+        )
+    raise HTTPException(
+        status_code=409,
+        detail=f"Нельзя {ORDER_TRANSITIONS[action][3]} заказ в статусе {order.status}"
+    )
+
+def transition_order(session: Session, action: str, order_id: int, expected_version: Optional[int]) -> Order:
+    """Переход одного заказа: один UPDATE ... RETURNING и commit; при конфликте - 404/409"""
+    updated = apply_order_transition(session, action, [order_id], expected_version)
+    if not updated:
+        session.rollback()
+        raise_transition_conflict(session, action, order_id, expected_version)
+    session.commit()
+    return updated[0]
+
+def transition_orders(session: Session, batch: OrderTransitionBatch) -> dict:
+    """
+    Переход многих заказов одним UPDATE в одной транзакции
+    Заказы, которые не в подходящем статусе (или не найдены), пропускаются
+    """
+    order_ids = list(dict.fromkeys(batch.order_ids))  # Без повторов, в исходном порядке
+    updated = apply_order_transition(session, batch.action, order_ids)
+    session.commit()
+    return transition_report(batch.action, order_ids, updated)
+
+def transition_report(action: str, order_ids: List[int], updated: List[Order]) -> dict:
+    """Ответ пакетного перехода: какие заказы изменены, какие пропущены"""
+    updated_ids = {order.id for order in updated}
+    return {
+        "action": action,
+        "updated": len(updated_ids),
+        "updated_ids": [order_id for order_id in order_ids if order_id in updated_ids],
+        "skipped_ids": [order_id for order_id in order_ids if order_id not in updated_ids]
+    }
+
+# ==================== ОФОРМЛЕНИЕ ЗАКАЗА (CHECKOUT) ====================
+# Заказ со всеми строками создается одним запросом к API и одной транзакцией:
+# позиции меню проверяются одним обращением к кэшу меню, строки вставляются
+# одним пакетным INSERT, сумма считается на сервере.
+
+def build_checkout_lines(checkout: CheckoutCreate, menu_items: dict):
+    """
+    Проверяет строки заказа и считает их цены
+    menu_items - словарь {id: MenuItem} для всех позиций заказа
+    Возвращает (список OrderItem без order_id, сумма заказа)
+    """
+    if not checkout.items:
+        raise HTTPException(status_code=400, detail="Заказ должен содержать хотя бы одну позицию")
+
+    missing = sorted({line.menu_item_id for line in checkout.items} - menu_items.keys())
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Позиции меню не найдены: {missing}")
+
+    unavailable = sorted({line.menu_item_id for line in checkout.items if not menu_items[line.menu_item_id].is_available})
+    if unavailable:
+        raise HTTPException(status_code=400, detail=f"Позиции меню недоступны: {unavailable}")
+
+    if any(line.quantity < 1 for line in checkout.items):
+        raise HTTPException(status_code=400, detail="Количество должно быть не меньше 1")
+
+    order_items = [
+        OrderItem(
+            menu_item_id=line.menu_item_id,
+            quantity=line.quantity,
+            price=menu_items[line.menu_item_id].price * line.quantity,
+            customizations=line.customizations
+        )
+        for line in checkout.items
+    ]
+    return order_items, sum(order_item.price for order_item in order_items)
+
+def checkout_event(order: Order, order_items: List[OrderItem], menu_items: dict) -> dict:
+    """Событие кухни о новом заказе вместе со всеми строками"""
+    items = [order_line_state(order_item, menu_items[order_item.menu_item_id].name) for order_item in order_items]
+    return order_event("order.created", order.id, **order_state(order), items=items)
+
+def checkout_response(order: Order, order_items: List[OrderItem], menu_items: dict) -> dict:
+    """Ответ на оформление заказа - в том же виде, что и /orders/{id}/detail"""
+    items = [
+        {
+            "id": order_item.id,
+            "menu_item_name": menu_items[order_item.menu_item_id].name,
+            "quantity": order_item.quantity,
+            "price_per_item": order_item.price / order_item.quantity,
+            "total_price": order_item.price,
+            "customizations": order_item.customizations
+        }
+        for order_item in order_items
+    ]
+    return order_detail_response(order, items)
+
+# ==================== ПОВТОРНЫЕ ЗАПРОСЫ (IDEMPOTENCY-KEY) ====================
+# Когда пропадает Wi-Fi, планшет повторяет POST /orders, /order-items или /checkout
+# и создает второй заказ или вторую позицию. Клиент может передать заголовок
+# Idempotency-Key (например, UUID, один на попытку оформления): ответ сохраняется
+# под этим ключом в той же транзакции, что и сама запись, а повтор с тем же ключом
+# получает сохраненный ответ одним чтением по первичному ключу.
+# Если два повтора выполняются одновременно, второй упирается в первичный ключ
+# и после rollback тоже возвращает ответ первого. Ключи хранятся IDEMPOTENCY_TTL_SECONDS
+# и затем удаляются фоновой задачей (просроченный ключ уже не считается повтором).
+
+IDEMPOTENCY_TTL_SECONDS = int(config_value("idempotency_ttl", "COFFEE_IDEMPOTENCY_TTL", 24 * 3600))
+IDEMPOTENCY_PURGE_INTERVAL_SECONDS = 600  # Как часто удалять просроченные ключи
+IDEMPOTENCY_PURGE_BATCH_SIZE = 5000       # Ключей за один DELETE
+
+def idempotency_request(scope: str, key: Optional[str], payload: BaseModel):
+    """
+    (хэш ключа, хэш тела запроса) для запроса с Idempotency-Key или None без него
+    Ключ хэшируется вместе с эндпоинтом: один и тот же ключ в разных эндпоинтах - разные ключи
+    """
+    if not key:
+        return None
+    key_hash = hashlib.blake2b(f"{scope}:{key}".encode("utf-8"), digest_size=16).hexdigest()
+    request_hash = hashlib.blake2b(payload.model_dump_json().encode("utf-8"), digest_size=16).hexdigest()
+    return key_hash, request_hash
+
+def find_idempotent_response(session: Session, idempotency) -> Optional[Response]:
+    """
+    Сохраненный ответ на запрос с тем же ключом или None (в том числе для запроса без ключа)
+    Тот же ключ с другим телом запроса - ошибка клиента (422)
+    """
+    if idempotency is None:
+        return None
+    key_hash, request_hash = idempotency
+    saved = session.get(IdempotencyKey, key_hash)
+    if saved is None:
+        return None
+    if saved.created_at < datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_TTL_SECONDS):
+        # Ключ просрочен, но еще не удален фоновой задачей - запрос выполняется заново
+        session.exec(delete(IdempotencyKey).where(IdempotencyKey.key_hash == key_hash))
+        return None
+    if saved.request_hash != request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key уже использован для другого запроса")
+    return Response(
+        saved.response,
+        status_code=saved.status_code,
+        media_type="application/json",
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+def save_idempotent_response(session: Session, idempotency, status_code: int, content):
+    """Сохраняет ответ под ключом в текущей транзакции (вместе с самой записью)"""
+    key_hash, request_hash = idempotency
+    session.add(IdempotencyKey(
+        key_hash=key_hash,
+        request_hash=request_hash,
+        status_code=status_code,
+        response=encode_json(content).decode("utf-8")
+    ))
+
+def commit_idempotent(session: Session, idempotency, status_code: int, content) -> Optional[Response]:
+    """
+    commit записи вместе с ответом под ключом
+    Если тот же ключ уже сохранил параллельный повтор - откатывает запись
+    и возвращает его ответ; иначе возвращает None
+    """
+    if idempotency is None:
+        session.commit()
+        return None
+    save_idempotent_response(session, idempotency, status_code, content)
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        replayed = find_idempotent_response(session, idempotency)
+        if replayed is None:
+            raise
+        return replayed
+    return None
+
+def purge_idempotency_keys(target_engine) -> int:
+    """Удаляет просроченные ключи пачками по IDEMPOTENCY_PURGE_BATCH_SIZE, возвращает их число"""
+    cutoff = datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+    purged = 0
+    while True:
+        with Session(target_engine) as session:
+            expired = (
+                select(IdempotencyKey.key_hash)
+                .where(IdempotencyKey.created_at < cutoff)
+                .limit(IDEMPOTENCY_PURGE_BATCH_SIZE)
+            )
+            result = session.exec(
+                delete(IdempotencyKey)
+                .where(IdempotencyKey.key_hash.in_(expired))
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+        purged += result.rowcount
+        if result.rowcount < IDEMPOTENCY_PURGE_BATCH_SIZE:
+            return purged
+
+async def run_idempotency_purge_job():
+    """Фоновая задача сервера: удаление просроченных ключей идемпотентности"""
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_PURGE_INTERVAL_SECONDS)
+        try:
+            purged = await run_in_threadpool(purge_idempotency_keys, engine)
+            if purged:
+                logger.info("Удалено просроченных ключей идемпотентности: %s", purged)
+        except Exception:
+            logger.exception("Ошибка удаления ключей идемпотентности")
+
+# ==================== ОЧЕРЕДЬ ЗАКАЗОВ ДЛЯ КУХНИ ====================
+# Вместо опроса GET /orders каждую секунду экраны кухни подписываются на поток
+# событий заказов (SSE: GET /kitchen/stream или WebSocket: /kitchen/ws).
+# Эндпоинты заказов ставят событие в очередь сессии, а после успешного commit
+# оно рассылается подписчикам. Источник событий (COFFEE_EVENT_BACKEND):
+#   "memory"   - события этого процесса (один процесс сервера, по умолчанию)
+#   "postgres" - PostgreSQL NOTIFY/LISTEN: события всех процессов; NOTIFY выполняется
+#                в транзакции заказа и доставляется только после ее commit
+# У каждого подписчика ограниченная очередь: если клиент не успевает читать,
+# очередь сбрасывается, клиент получает событие resync и переподключается
+# (с новым снимком очереди), а сервер не копит события в памяти без предела.
+
+ORDER_EVENTS_CHANNEL = "coffee_order_events"  # Канал PostgreSQL NOTIFY
+SUBSCRIBER_QUEUE_SIZE = 256                   # Событий в очереди одного подписчика
+EVENT_HISTORY_SIZE = 1000                     # Последних событий для продолжения по Last-Event-ID
+KITCHEN_HEARTBEAT_SECONDS = 15                # Как часто отправлять пустое сообщение, чтобы соединение не закрылось
+KITCHEN_SNAPSHOT_LIMIT = 200                  # Сколько активных заказов отдавать при подключении
+KITCHEN_ACTIVE_STATUSES = ("CREATED", "PAID", "IN_PROGRESS")
+
+class EventSubscriber:
+    """Один подписчик (экран кухни): своя очередь в своем цикле событий"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.lagged = False  # Очередь переполнялась - клиенту нужно перечитать снимок
+
+class OrderEventBroker:
+    """Рассылка событий заказов подписчикам этого процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._history = deque(maxlen=EVENT_HISTORY_SIZE)
+        self._next_id = 1
+        self._listener_started = False
+        self.published = 0
+        self.dropped_subscribers = 0
+
+    def subscribe(self) -> EventSubscriber:
+        """Регистрирует подписчика (вызывается из асинхронного эндпоинта)"""
+        if EVENT_BACKEND == "postgres":
+            self.start_postgres_listener()
+        subscriber = EventSubscriber(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: EventSubscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def events_after(self, last_event_id: int):
+        """
+        События после last_event_id из истории
+        None - если история уже не содержит нужных событий (нужен новый снимок)
+        """
+        with self._lock:
+            if not self._history or self._history[0]["id"] > last_event_id + 1:
+                return None
+            return [message for message in self._history if message["id"] > last_event_id]
+
+    def publish(self, message: dict):
+        """
+        Присваивает событию номер и рассылает его всем подписчикам
+        Можно вызывать из любого потока
+        """
+        with self._lock:
+            message = {"id": self._next_id, **message}
+            self._next_id += 1
+            self._history.append(message)
+            subscribers = list(self._subscribers)
+            self.published += 1
+        if "order_id" in message:
+            order_validators.invalidate(message["order_id"])  # В том числе изменения из других процессов
+
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(self._deliver, subscriber, message)
+            except RuntimeError:
+                self.unsubscribe(subscriber)  # Цикл событий подписчика уже закрыт
+
+    def _deliver(self, subscriber: EventSubscriber, message: dict):
+        """Кладет событие в очередь подписчика (выполняется в его цикле событий)"""
+        if subscriber.lagged:
+            return
+        try:
+            subscriber.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Клиент не успевает читать: освобождаем очередь и просим его переподключиться
+            while not subscriber.queue.empty():
+                subscriber.queue.get_nowait()
+            subscriber.queue.put_nowait({"type": "resync"})
+            subscriber.lagged = True
+            self.dropped_subscribers += 1
+
+    def start_postgres_listener(self):
+        """Запускает поток, слушающий PostgreSQL NOTIFY (один на процесс)"""
+        with self._lock:
+            if self._listener_started:
+                return
+            self._listener_started = True
+        threading.Thread(target=self._listen_postgres, name="order-events-listener", daemon=True).start()
+
+    def _listen_postgres(self):
+        """Получает события всех процессов сервера через LISTEN и рассылает их"""
+        while True:
+            try:
+                # Отдельное соединение вне пула: оно занято LISTEN все время работы
+                connection = psycopg2.connect(**engine.url.translate_connect_args(username="user"))
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {ORDER_EVENTS_CHANNEL}")
+                selector = selectors.DefaultSelector()
+                selector.register(connection, selectors.EVENT_READ)
+                while True:
+                    selector.select(timeout=KITCHEN_HEARTBEAT_SECONDS)
+                    connection.poll()
+                    while connection.notifies:
+                        notify = connection.notifies.pop(0)
+                        self.publish(json.loads(notify.payload))
+            except Exception as e:
+                logger.warning("Соединение LISTEN для событий заказов потеряно: %s", e)
+                time.sleep(1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": EVENT_BACKEND,
+                "subscribers": len(self._subscribers),
+                "published": self.published,
+                "dropped_subscribers": self.dropped_subscribers,
+                "last_event_id": self._next_id - 1
+            }
+
+order_events = OrderEventBroker()
+
+def order_event(event_type: str, order_id: int, **data) -> dict:
+    """Событие заказа: тип, ID заказа, время и данные события"""
+    return {"type": event_type, "order_id": order_id, "at": datetime.utcnow().isoformat(), **data}
+
+def order_state(order: Order) -> dict:
+    """Текущее состояние заказа для события"""
+    return {
+        "customer_id": order.customer_id,
+        "status": order.status,
+        "payment_status": order.payment_status,
+        "total_amount": order.total_amount
+    }
+
+def order_line_state(order_item: OrderItem, menu_item_name: str) -> dict:
+    """Строка заказа для события - то, что нужно кухне"""
+    return {
+        "id": order_item.id,
+        "menu_item_name": menu_item_name,
+        "quantity": order_item.quantity,
+        "customizations": order_item.customizations
+    }
+
+def queue_order_event(session: Session, message: dict):
+    """
+    Ставит событие заказа в очередь текущей транзакции
+    Подписчики получат его только после commit; при rollback событие пропадает
+    """
+    session.info.setdefault("changed_order_ids", set()).add(message["order_id"])
+    session.info.setdefault("order_event_types", []).append(message["type"])
+    if EVENT_BACKEND == "postgres":
+        # NOTIFY внутри транзакции доставляется PostgreSQL только после ее commit
+        session.exec(select(func.pg_notify(ORDER_EVENTS_CHANNEL, json.dumps(message, default=str))))
+    else:
+        session.info.setdefault("pending_order_events", []).append(message)
+
+@event.listens_for(Session, "after_commit")
+def publish_pending_order_events(session):
+    """После commit рассылаем события, накопленные в транзакции, и сбрасываем ETag измененных заказов"""
+    for order_id in session.info.pop("changed_order_ids", ()):
+        order_validators.invalidate(order_id)
+    app_metrics.count_order_events(session.info.pop("order_event_types", ()))
+    for pending in session.info.pop("pending_order_events", []):
+        order_events.publish(pending)
+
+@event.listens_for(Session, "after_transaction_end")
+def drop_pending_order_events(session, transaction):
+    """Транзакция завершилась без commit (rollback, закрытие сессии) - события не рассылаются"""
+    if transaction.parent is None:
+        session.info.pop("pending_order_events", None)
+        session.info.pop("changed_order_ids", None)
+        session.info.pop("order_event_types", None)
+
+def load_kitchen_snapshot() -> List[dict]:
+    """
+    Активные (не завершенные) заказы с позициями - то, что кухня видит при подключении
+    Два запроса: заказы и все их позиции с названиями из меню
+    """
+    with Session(engine) as session:
+        orders = session.exec(
+            select(Order)
+            .where(Order.status.in_(KITCHEN_ACTIVE_STATUSES))
+            .order_by(Order.id.desc())
+            .limit(KITCHEN_SNAPSHOT_LIMIT)
+        ).all()
+        if not orders:
+            return []
+        lines = session.exec(
+            select(OrderItem, MenuItem.name)
+            .join(MenuItem, MenuItem.id == OrderItem.menu_item_id)
+            .where(OrderItem.order_id.in_([order.id for order in orders]))
+            .order_by(OrderItem.id)
+        ).all()
+
+    items_by_order = {}
+    for item, menu_item_name in lines:
+        items_by_order.setdefault(item.order_id, []).append(order_line_state(item, menu_item_name))
+    return [
+        {"order_id": order.id, **order_state(order), "items": items_by_order.get(order.id, [])}
+        for order in reversed(orders)
+    ]
+
+async def kitchen_events(last_event_id: Optional[int]):
+    """
+    Общая часть SSE и WebSocket: сначала снимок очереди (или пропущенные события
+    по Last-Event-ID), затем новые события. Возвращает асинхронный генератор
+    пар (имя события, данные); None - время отправить heartbeat
+    """
+    subscriber = order_events.subscribe()
+    try:
+        missed = order_events.events_after(last_event_id) if last_event_id is not None else None
+        if missed is None:
+            yield "snapshot", {"orders": await run_in_threadpool(load_kitchen_snapshot)}
+        else:
+            for message in missed:
+                yield message["type"], message
+
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), timeout=KITCHEN_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield None, None
+                continue
+            yield message["type"], message
+            if message["type"] == "resync":
+                return
+    finally:
+        order_events.unsubscribe(subscriber)
+
+# ==================== УДАЛЕНИЕ И АРХИВ ЗАКАЗОВ ====================
+# Заказы удаляются и переносятся в архив набором строк (DELETE ... WHERE order_id IN (...),
+# INSERT ... SELECT), без загрузки объектов в память. Массовая очистка идет пачками
+# по CLEANUP_BATCH_SIZE заказов, каждая пачка - отдельная короткая транзакция,
+# поэтому блокировки не держатся долго и кассы продолжают работать.
+
+CLEANUP_BATCH_SIZE = 1000      # Заказов в одной транзакции по умолчанию
+CLEANUP_MAX_BATCH_SIZE = 5000  # Больше - слишком длинные списки IN и долгие блокировки
+
+def delete_orders(session: Session, order_ids: List[int]):
+    """Удаляет заказы и их позиции двумя DELETE; возвращает (удалено заказов, удалено позиций)"""
+    items_deleted = session.exec(
+        delete(OrderItem).where(OrderItem.order_id.in_(order_ids)).execution_options(synchronize_session=False)
+    ).rowcount
+    orders_deleted = session.exec(
+        delete(Order).where(Order.id.in_(order_ids)).execution_options(synchronize_session=False)
+    ).rowcount
+    return orders_deleted, items_deleted
+
+def archive_orders(session: Session, order_ids: List[int]):
+    """
+    Переносит заказы и их позиции в архивные таблицы (INSERT ... SELECT и DELETE)
+    Возвращает (перенесено заказов, перенесено позиций)
+    """
+    order_columns = [column.name for column in Order.__table__.columns]
+    item_columns = [column.name for column in OrderItem.__table__.columns]
+    session.exec(
+        insert(OrderArchive).from_select(
+            order_columns + ["archived_at"],
+            select(*Order.__table__.columns, literal(datetime.utcnow())).where(Order.id.in_(order_ids))
+        )
+    )
+    session.exec(
+        insert(OrderItemArchive).from_select(
+            item_columns,
+            select(*OrderItem.__table__.columns).where(OrderItem.order_id.in_(order_ids))
+        )
+    )
+    return delete_orders(session, order_ids)
+
+def customer_has_orders(customer_id: int):
+    """Условие EXISTS: у клиента есть заказы (в рабочей таблице или в архиве)"""
+    return or_(
+        exists().where(Order.customer_id == customer_id),
+        exists().where(OrderArchive.customer_id == customer_id)
+    )
+
+def menu_item_in_orders(menu_item_id: int):
+    """Условие EXISTS: позиция меню есть в заказах (в рабочей таблице или в архиве)"""
+    return or_(
+        exists().where(OrderItem.menu_item_id == menu_item_id),
+        exists().where(OrderItemArchive.menu_item_id == menu_item_id)
+    )
+
+def order_cleanup_conditions(cleanup: OrderCleanup) -> list:
+    """Условия отбора заказов для массовой очистки"""
+    if cleanup.action not in ("archive", "delete"):
+        raise HTTPException(status_code=400, detail="action должен быть archive или delete")
+
+    conditions = []
+    if cleanup.status:
+        conditions.append(Order.status == cleanup.status)
+    if cleanup.payment_status:
+        conditions.append(Order.payment_status == cleanup.payment_status)
+    if cleanup.created_before:
+        conditions.append(Order.created_at < cleanup.created_before)
+    if cleanup.completed_before:
+        conditions.append(Order.completed_at < cleanup.completed_before)
+    if cleanup.customer_id is not None:
+        conditions.append(Order.customer_id == cleanup.customer_id)
+    if not conditions:
+        # Защита от случайной очистки всех заказов
+        raise HTTPException(status_code=400, detail="Укажите хотя бы одно условие отбора заказов")
+    return conditions
+
+def cleanup_orders(target_engine, cleanup: OrderCleanup) -> dict:
+    """
+    Удаляет или переносит в архив заказы, подходящие под условия, пачками
+    Каждая пачка - своя транзакция: выбрать ID, перенести/удалить, commit
+    """
+    conditions = order_cleanup_conditions(cleanup)
+    batch_size = min(max(cleanup.batch_size, 1), CLEANUP_MAX_BATCH_SIZE)
+    report = {"action": cleanup.action, "dry_run": cleanup.dry_run, "orders": 0, "items": 0, "batches": 0}
+
+    if cleanup.dry_run:
+        with Session(target_engine) as session:
+            report["orders"] = session.exec(select(func.count(Order.id)).where(*conditions)).one()
+        return report
+
+    started = time.perf_counter()
+    last_id = 0
+    while True:
+        with Session(target_engine) as session:
+            order_ids = session.exec(
+                select(Order.id).where(*conditions, Order.id > last_id).order_by(Order.id).limit(batch_size)
+            ).all()
+            if not order_ids:
+                break
+            if cleanup.action == "archive":
+                orders, items = archive_orders(session, order_ids)
+            else:
+                record_orders_deleted(session, order_ids)
+                orders, items = delete_orders(session, order_ids)
+            session.commit()
+
+        last_id = order_ids[-1]
+        report["orders"] += orders
+        report["items"] += items
+        report["batches"] += 1
+
+    report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    if report["orders"]:
+        order_validators.clear()  # Заказы удалены или перенесены - их ETag больше не верны
+        logger.info("Очистка заказов (%s): %s заказов, %s позиций", cleanup.action, report["orders"], report["items"])
+    return report
+
+# ==================== АРХИВАЦИЯ ПО РАСПИСАНИЮ ====================
+# Рабочие таблицы заказов хранят только "горячие" заказы: фоновая задача сервера
+# раз в ARCHIVE_INTERVAL_SECONDS переносит в архив завершенные оплаченные заказы
+# старше ARCHIVE_AFTER_DAYS дней. Поэтому таблицы order/orderitem и их индексы
+# (status, payment_status, customer_id) не растут вместе с историей.
+# GET /orders/{id} и GET /customers/{id}/orders ищут и в архиве.
+# Вместо фоновой задачи можно запускать python main.py archive из cron
+# (тогда COFFEE_ARCHIVE_INTERVAL=0 отключает задачу в сервере).
+
+ARCHIVE_AFTER_DAYS = int(config_value("archive_after_days", "COFFEE_ARCHIVE_AFTER_DAYS", 30))
+ARCHIVE_INTERVAL_SECONDS = int(config_value("archive_interval_seconds", "COFFEE_ARCHIVE_INTERVAL", 3600))
+ARCHIVE_LOCK_KEY = 7_200_101  # Ключ advisory-блокировки PostgreSQL: архивирует только один процесс
+
+# Последний запуск архивации (для GET /maintenance/archive)
+archive_job_state = {"last_run": None, "last_result": None, "last_error": None, "next_run": None}
+
+@contextmanager
+def archive_lock(target_engine):
+    """
+    Не дает нескольким процессам сервера архивировать одновременно
+    В PostgreSQL - advisory-блокировка на время архивации; отдает False, если она занята
+    """
+    if target_engine.dialect.name != "postgresql":
+        yield True
+        return
+    with target_engine.connect() as connection:
+        acquired = connection.execute(select(func.pg_try_advisory_lock(ARCHIVE_LOCK_KEY))).scalar()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                connection.execute(select(func.pg_advisory_unlock(ARCHIVE_LOCK_KEY)))
+
+def archive_old_orders(target_engine, older_than_days: int = ARCHIVE_AFTER_DAYS) -> dict:
+    """Переносит в архив завершенные оплаченные заказы старше older_than_days дней"""
+    cleanup = OrderCleanup(
+        action="archive",
+        status="COMPLETED",
+        payment_status="PAID",
+        completed_before=datetime.utcnow() - timedelta(days=older_than_days),
+        batch_size=CLEANUP_BATCH_SIZE
+    )
+    with archive_lock(target_engine) as acquired:
+        if not acquired:
+            return {"skipped": "архивация уже выполняется другим процессом"}
+        report = cleanup_orders(target_engine, cleanup)
+
+    archive_job_state["last_run"] = datetime.utcnow().isoformat()
+    archive_job_state["last_result"] = report
+    return report
+
+async def run_archive_job():
+    """Фоновая задача сервера: архивация по расписанию"""
+    while True:
+        archive_job_state["next_run"] = (datetime.utcnow() + timedelta(seconds=ARCHIVE_INTERVAL_SECONDS)).isoformat()
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+        try:
+            await run_in_threadpool(archive_old_orders, engine)
+            archive_job_state["last_error"] = None
+        except Exception as e:
+            # Ошибка одной архивации не останавливает задачу - попробуем в следующий раз
+            archive_job_state["last_error"] = str(e)
+            logger.exception("Ошибка архивации заказов")
+
+def find_order(session: Session, order_id: int):
+    """Заказ по ID: сначала среди рабочих заказов, затем в архиве"""
+    return session.get(Order, order_id) or session.get(OrderArchive, order_id)
+
+def customer_orders(session: Session, customer_id: int) -> list:
+    """Все заказы клиента: рабочие и архивные (у архивных есть поле archived_at)"""
+    orders = session.exec(select(Order).where(Order.customer_id == customer_id)).all()
+    archived = session.exec(select(OrderArchive).where(OrderArchive.customer_id == customer_id)).all()
+    return sorted([*archived, *orders], key=lambda order: order.id)
+
+# ==================== ЛОГИКА ЭНДПОИНТОВ ====================
+# Тела эндпоинтов, общие для обоих режимов работы с базой данных. Синхронный эндпоинт
+# вызывает функцию со своей сессией, асинхронный (COFFEE_DB_MODE=async) - через
+# AsyncSession.run_sync: те же запросы идут через асинхронный драйвер и не занимают пул потоков.
+# Позиции меню передаются готовыми: в асинхронном режиме кэш меню дочитывается в пуле потоков.
+
+def find_or_404(session: Session, model, record_id: int, detail: str):
+    """Запись по ID или ошибка 404"""
+    record = session.get(model, record_id)
+    if not record:
+        raise HTTPException(status_code=404, detail=detail)
+    return record
+
+def create_record(session: Session, record):
+    """
+    Сохраняет новую запись. ID заполняется при вставке, а с expire_on_commit=False
+    перечитывать запись из базы данных после commit не нужно
+    """
+    session.add(record)
+    session.commit()
+    return record
+
+def update_record(session: Session, model, record_id: int, changes: BaseModel, not_found: str):
+    """Обновляет только переданные поля записи"""
+    record = find_or_404(session, model, record_id, not_found)
+    for field, value in changes.dict(exclude_unset=True).items():
+        setattr(record, field, value)
+    session.add(record)
+    session.commit()
+    return record
+
+def delete_unreferenced(session: Session, model, record_id: int, referenced, not_found: str, in_use: str):
+    """
+    Один DELETE: запись удаляется, только если на нее нет ссылок (referenced - условие EXISTS)
+    Если ничего не удалено - выясняем почему: 404 или 400
+    """
+    result = session.exec(
+        delete(model)
+        .where(model.id == record_id, ~referenced)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        find_or_404(session, model, record_id, not_found)
+        raise HTTPException(status_code=400, detail=in_use)
+    session.commit()
+
+def delete_customer_record(session: Session, customer_id: int) -> dict:
+    """Удаляет клиента, если у него нет заказов (в рабочих таблицах и в архиве)"""
+    delete_unreferenced(
+        session, Customer, customer_id, customer_has_orders(customer_id),
+        not_found="Клиент не найден",
+        in_use="Нельзя удалить клиента, у которого есть заказы. Сначала удалите заказы."
+    )
+    return {"message": f"Клиент {customer_id} успешно удален"}
+
+def create_menu_item_record(session: Session, menu_item: MenuItemCreate) -> MenuItem:
+    new_menu_item = create_record(session, MenuItem(**menu_item.dict()))
+    menu_catalog.invalidate()  # Меню изменилось - сбрасываем кэш
+    return new_menu_item
+
+def update_menu_item_record(session: Session, menu_item_id: int, menu_update: MenuItemUpdate) -> MenuItem:
+    menu_item = update_record(session, MenuItem, menu_item_id, menu_update, "Позиция меню не найдена")
+    menu_catalog.invalidate()
+    return menu_item
+
+def delete_menu_item_record(session: Session, menu_item_id: int) -> dict:
+    """Удаляет позицию меню, если ее нет в заказах"""
+    delete_unreferenced(
+        session, MenuItem, menu_item_id, menu_item_in_orders(menu_item_id),
+        not_found="Позиция меню не найдена",
+        in_use="Нельзя удалить позицию меню, которая есть в заказах. Можно сделать недоступной (is_available=False)."
+    )
+    menu_catalog.invalidate()
+    return {"message": f"Позиция меню {menu_item_id} успешно удалена"}
+
+def keyset_page_response(session: Session, model, request: Request, response: Response, limit: Optional[int], after: Optional[int]):
+    """Страница записей модели с курсором следующей страницы в заголовках"""
+    limit = limit or DEFAULT_PAGE_SIZE
+    rows, next_cursor = fetch_keyset_page(session, model, limit, after)
+    set_pagination_headers(request, response, limit, next_cursor)
+    return fast_response(rows, response)
+
+def read_customer_orders(session: Session, customer_id: int):
+    """Клиент и все его заказы, включая перенесенные в архив"""
+    customer = find_or_404(session, Customer, customer_id, "Клиент не найден")
+    orders = customer_orders(session, customer_id)
+    return fast_response({
+        "customer_id": customer_id,
+        "customer_name": customer.name,
+        "total_orders": len(orders),
+        "orders": orders
+    })
+
+def read_order(session: Session, request: Request, response: Response, order_id: int):
+    """Заказ (рабочий или архивный) с ETag; 304 по сохраненному ETag - без обращения к базе данных"""
+    not_modified = cached_order_not_modified(request, "order", order_id)
+    if not_modified is not None:
+        return not_modified
+
+    version = validators_version(session)
+    order = find_order(session, order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="Заказ не найден")
+    return order_conditional_response(request, response, "order", order_id, order_payload(order), version)
+
+def read_order_items(session: Session, order_id: int) -> dict:
+    """Позиции заказа (рабочего или архивного): заказ, позиции и названия из меню - одним запросом"""
+    order, items = find_order_detail(session, order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="Заказ не найден")
+
+    return {
+        "order_id": order_id,
+        "total_amount": order.total_amount,
+        "items": items
+    }
+
+def read_order_detail(session: Session, request: Request, response: Response, order_id: int):
+    """Заказ (рабочий или архивный) целиком одним запросом, с ETag (как read_order)"""
+    not_modified = cached_order_not_modified(request, "order_detail", order_id)
+    if not_modified is not None:
+        return not_modified
+
+    version = validators_version(session)
+    order, items = find_order_detail(session, order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="Заказ не найден")
+    return order_conditional_response(
+        request, response, "order_detail", order_id, order_detail_response(order, items), version
+    )
+
+def create_order_record(session: Session, order: OrderCreate, idempotency_key: Optional[str]):
+    """Новый заказ и событие order.created; повтор с тем же Idempotency-Key вернет тот же заказ"""
+    idempotency = idempotency_request("orders", idempotency_key, order)
+    replayed = find_idempotent_response(session, idempotency)
+    if replayed is not None:
+        return replayed
+
+    find_or_404(session, Customer, order.customer_id, "Клиент не найден")
+
+    new_order = Order(**order.dict())  # Создаем объект заказа
+    session.add(new_order)             # Добавляем заказ в сессию
+    session.flush()                    # Получаем ID заказа для события кухни
+    queue_order_event(session, order_event("order.created", new_order.id, **order_state(new_order), items=[]))
+    # Сохраняем изменения (и ответ под ключом идемпотентности)
+    return commit_idempotent(session, idempotency, 201, order_payload(new_order)) or new_order
+
+def place_checkout(session: Session, checkout: CheckoutCreate, menu_items: dict, idempotency_key: Optional[str]):
+    """
+    Заказ и все его строки одной транзакцией, сумма считается на сервере
+    menu_items - позиции меню из кэша по ID (menu_catalog.get_many)
+    """
+    idempotency = idempotency_request("checkout", idempotency_key, checkout)
+    replayed = find_idempotent_response(session, idempotency)
+    if replayed is not None:
+        return replayed
+
+    find_or_404(session, Customer, checkout.customer_id, "Клиент не найден")
+    order_items, total_amount = build_checkout_lines(checkout, menu_items)
+
+    new_order = Order(customer_id=checkout.customer_id, total_amount=total_amount)
+    session.add(new_order)
+    session.flush()  # Получаем ID заказа, транзакция еще не завершена
+
+    for order_item in order_items:
+        order_item.order_id = new_order.id
+    session.add_all(order_items)  # Строки вставляются одним пакетным INSERT
+    session.flush()
+    queue_order_event(session, checkout_event(new_order, order_items, menu_items))
+    response = checkout_response(new_order, order_items, menu_items)
+    return commit_idempotent(session, idempotency, 201, response) or response
+
+def delete_order_record(session: Session, order_id: int) -> dict:
+    """Удаляет заказ и его позиции двумя DELETE, без загрузки объектов"""
+    record_orders_deleted(session, [order_id])
+    orders_deleted, items_deleted = delete_orders(session, [order_id])
+    if not orders_deleted:
+        session.rollback()
+        raise HTTPException(status_code=404, detail="Заказ не найден")
+
+    queue_order_event(session, order_event("order.deleted", order_id))
+    session.commit()
+    return {"message": f"Заказ {order_id} успешно удален, удалено {items_deleted} позиций"}
+
+def add_item_to_order(session: Session, item: OrderItemCreate, menu_item: Optional[MenuItem], idempotency_key: Optional[str]):
+    """
+    Новая позиция заказа и новая сумма заказа в одной транзакции
+    menu_item - позиция меню из кэша (None, если ее нет)
+    """
+    idempotency = idempotency_request("order-items", idempotency_key, item)
+    replayed = find_idempotent_response(session, idempotency)
+    if replayed is not None:
+        return replayed
+
+    if not menu_item or not menu_item.is_available:
+        # Сначала сообщаем об отсутствии заказа, как и раньше
+        find_or_404(session, Order, item.order_id, "Заказ не найден")
+        if not menu_item:
+            raise HTTPException(status_code=404, detail="Позиция меню не найдена")
+        raise HTTPException(status_code=400, detail="Позиция меню недоступна")
+
+    # Рассчитываем цену позиции (цена из меню × количество)
+    price = menu_item.price * item.quantity
+
+    # Блокируем заказ и увеличиваем его сумму; если заказа нет - ни одна строка не изменится
+    locked = session.exec(lock_order_statement(item.order_id)).first()
+    updated = session.exec(add_to_order_total_statement(item.order_id, price)).first()
+    if updated is None:
+        session.rollback()
+        raise HTTPException(status_code=404, detail="Заказ не найден")
+
+    # Создаем новую позицию в заказе
+    new_order_item = OrderItem(
+        order_id=item.order_id,
+        menu_item_id=item.menu_item_id,
+        quantity=item.quantity,
+        price=price,
+        customizations=item.customizations
+    )
+    session.add(new_order_item)
+    session.flush()
+    if locked.payment_status == "PAID":
+        record_paid_order_change(
+            session, locked.created_at, updated[0] - locked.total_amount,
+            menu_item.id, menu_item.category, item.quantity, price
+        )
+    queue_order_event(session, order_event(
+        "order.item_added", item.order_id,
+        total_amount=updated[0], item=order_line_state(new_order_item, menu_item.name)
+    ))
+    # Одна транзакция: сумма заказа, новая позиция и ответ под ключом идемпотентности
+    return commit_idempotent(session, idempotency, 201, new_order_item) or new_order_item
+
+def remove_item_from_order(session: Session, order_item_id: int) -> dict:
+    """Удаляет позицию и уменьшает сумму заказа в одной транзакции"""
+    # Удаляем позицию и сразу получаем ее заказ и цену
+    deleted = session.exec(delete_order_item_statement(order_item_id)).first()
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Позиция заказа не найдена")
+
+    order_id, price, menu_item_id, quantity = deleted
+    locked = session.exec(lock_order_statement(order_id)).one()
+    new_total = session.exec(subtract_from_order_total_statement(order_id, price)).first()
+    if locked.payment_status == "PAID":
+        category = session.exec(select(MenuItem.category).where(MenuItem.id == menu_item_id)).one()
+        record_paid_order_change(
+            session, locked.created_at, new_total[0] - locked.total_amount,
+            menu_item_id, category, -quantity, -price
+        )
+    queue_order_event(session, order_event(
+        "order.item_removed", order_id, total_amount=new_total[0], item_id=order_item_id
+    ))
+    session.commit()
+    return {"message": f"Позиция заказа {order_item_id} удалена, заказ обновлен"}
+
+# ==================== API ЭНДПОИНТЫ (КОНЕЧНЫЕ ТОЧКИ) ====================
+
+@app.get("/")
+def read_root():
+    """
+    Корневой эндпоинт API
+    Возвращает информацию о доступных эндпоинтах
+    """
+    return {
+        "message": "Добро пожаловать в API кофейни!",
+        "database": DATABASE_LABEL,
+        "endpoints": {
+            "customers": "/customers",    # Эндпоинт для работы с клиентами
+            "menu": "/menu",              # Эндпоинт для работы с меню
+            "orders": "/orders",          # Эндпоинт для работы с заказами
+            "checkout": "/checkout",      # Оформление заказа целиком
+            "kitchen": "/kitchen/stream", # Поток заказов для кухни (SSE)
+            "docs": "/docs"               # Автоматическая документация API
+        }
+    }
+
+# ==================== КЛИЕНТЫ ====================
+
+@app.get("/customers", response_model=List[Customer])
+def get_customers(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = Query(None, description="ID последнего клиента с предыдущей страницы"),
+    stream: bool = Query(False, description="Отдать всех клиентов потоком (JSON массив)"),
+    session: Session = Depends(get_read_session)
+):
+    """
+    Получить список клиентов постранично
+    GET запрос на /customers?limit=100&after=<курсор>
+    Курсор следующей страницы возвращается в заголовке X-Next-Cursor
+    С параметром stream=true все клиенты отдаются одним потоковым JSON массивом
+    """
+    if stream:
+        return StreamingResponse(stream_json_array(Customer, after, limit, session.bind), media_type="application/json")
+    return keyset_page_response(session, Customer, request, response, limit, after)
+
+SEARCH_DEFAULT_LIMIT = 10   # Сколько клиентов возвращать по умолчанию
+SEARCH_MAX_LIMIT = 50       # Максимум результатов поиска
+
+def escape_like(value: str) -> str:
+    """Экранирует спецсимволы LIKE (%, _ и \\)"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def prefix_condition(column, prefix: str, dialect: str):
+    """
+    Условие "начинается с prefix", которое использует обычный индекс
+    SQLite применяет индекс для GLOB, PostgreSQL - для LIKE с индексом text_pattern_ops
+    """
+    if dialect == "sqlite":
+        escaped = re.sub(r"([*?\[])", r"[\1]", prefix)
+        return column.op("GLOB")(escaped + "*")
+    return column.like(escape_like(prefix) + "%", escape="\\")
+
+def customer_search_statement(query: str, limit: int, dialect: str):
+    """
+    Запрос поиска клиентов, отсортированных по релевантности
+    Если в строке поиска в основном цифры - ищем по началу телефона,
+    иначе - по имени: сначала совпадения с начала имени, потом с начала фамилии.
+    В PostgreSQL с pg_trgm - еще по части имени и похожие имена (опечатки)
+    """
+    digits = normalize_phone(query)
+    if len(digits) >= 3 and len(digits) * 2 >= len(query.replace(" ", "")):
+        # Номер могут набрать через 8 или без кода страны: 8912... и 912... ищем и как 7912...
+        prefixes = {digits}
+        if digits.startswith("8"):
+            prefixes.add("7" + digits[1:])
+        elif not digits.startswith("7"):
+            prefixes.add("7" + digits)
+        exact = Customer.phone_normalized.in_(prefixes)
+        return (
+            select(Customer)
+            .where(or_(*(prefix_condition(Customer.phone_normalized, prefix, dialect) for prefix in prefixes)))
+            .order_by(case((exact, 0), else_=1), Customer.phone_normalized, Customer.id)
+            .limit(limit)
+        )
+
+    name = normalize_name(query)
+    starts_with = prefix_condition(Customer.name_normalized, name, dialect)
+    if dialect == "postgresql" and customer_search_trigram:
+        # LIKE '%...%' и похожесть проверяются по триграммному индексу
+        contains = Customer.name_normalized.like("%" + escape_like(name) + "%", escape="\\")
+        similar = Customer.name_normalized.op("%")(name)
+        similarity = func.similarity(Customer.name_normalized, name)
+        return (
+            select(Customer)
+            .where(or_(contains, similar))
+            .order_by(case((starts_with, 0), (contains, 1), else_=2), similarity.desc(), Customer.id)
+            .limit(limit)
+        )
+
+    # Без pg_trgm - только условия, которые ищутся по индексам: начало имени или начало фамилии
+    last_word_starts_with = prefix_condition(Customer.name_last_word, name, dialect)
+    return (
+        select(Customer)
+        .where(or_(starts_with, last_word_starts_with))
+        .order_by(case((starts_with, 0), else_=1), Customer.name_normalized, Customer.id)
+        .limit(limit)
+    )
+
+@app.get("/customers/search", response_model=List[Customer])
+def search_customers(
+    q: str = Query(..., min_length=2, description="Начало телефона, имени или фамилии"),
+    limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+    session: Session = Depends(get_read_session)
+):
+    """
+    Найти клиента по телефону или имени (для кассы)
+    GET запрос на /customers/search?q=+7912 или /customers/search?q=иван
+    Результаты отсортированы по релевантности, поиск идет по индексам
+    """
+    dialect = session.get_bind().dialect.name
+    return session.exec(customer_search_statement(q.strip(), limit, dialect)).all()
+
+@app.get("/customers/{customer_id}", response_model=Customer)
+def get_customer(customer_id: int, session: Session = Depends(get_read_session)):
+    """
+    Получить информацию о конкретном клиенте по его ID
+    GET запрос на /customers/{id}
+    """
+    return find_or_404(session, Customer, customer_id, "Клиент не найден")
+
+@app.post("/customers", response_model=Customer, status_code=201)
+def create_customer(customer: CustomerCreate, session: Session = Depends(get_session)):
+    """
+    Создать нового клиента
+    POST запрос на /customers с данными клиента в теле запроса
+    """
+    return create_record(session, Customer(**customer.dict()))
+
+@app.patch("/customers/{customer_id}", response_model=Customer)
+def update_customer(
+    customer_id: int, 
+    customer_update: CustomerUpdate, 
+    session: Session = Depends(get_session)
+):
+    """
+    Обновить информацию о клиенте
+    PATCH запрос на /customers/{id}
+    """
+    return update_record(session, Customer, customer_id, customer_update, "Клиент не найден")
+
+@app.delete("/customers/{customer_id}")
+def delete_customer(customer_id: int, session: Session = Depends(get_session)):
+    """
+    Удалить клиента по ID
+    DELETE запрос на /customers/{id}
+    
+    Внимание: У клиента не должно быть связанных заказов
+    """
+    return delete_customer_record(session, customer_id)
+
+# ==================== МЕНЮ ====================
+
+@app.get("/menu", response_model=List[MenuItem])
+def get_menu(request: Request, response: Response):
+    """
+    Получить все позиции меню
+    GET запрос на /menu
+    Ответ берется из кэша меню; с If-None-Match неизмененное меню отдается как 304
+    """
+    snapshot = menu_catalog.snapshot()
+    return conditional_response(request, response, snapshot["items"], snapshot["etag"], snapshot["modified_at"])
+
+@app.get("/menu/available", response_model=List[MenuItem])
+def get_available_menu(request: Request, response: Response):
+    """
+    Получить только доступные позиции меню
+    GET запрос на /menu/available
+    Ответ берется из кэша меню; с If-None-Match неизмененное меню отдается как 304
+    """
+    snapshot = menu_catalog.snapshot()
+    return conditional_response(request, response, snapshot["available"], snapshot["etag"], snapshot["modified_at"])
+
+@app.get("/menu/cache/stats")
+def get_menu_cache_stats():
+    """
+    Статистика кэша меню (попадания, промахи, версия)
+    GET запрос на /menu/cache/stats
+    """
+    return menu_catalog.stats()
+
+@app.get("/menu/{category}", response_model=List[MenuItem])
+def get_menu_by_category(category: str, request: Request, response: Response):
+    """
+    Получить позиции меню по категории
+    GET запрос на /menu/{категория}
+    Ответ берется из кэша меню; с If-None-Match неизмененное меню отдается как 304
+    """
+    snapshot = menu_catalog.snapshot()
+    items = snapshot["by_category"].get(category, [])
+    return conditional_response(request, response, items, snapshot["etag"], snapshot["modified_at"])
+
+@app.get("/menu/item/{menu_item_id}", response_model=MenuItem)
+def get_menu_item(menu_item_id: int):
+    """
+    Получить информацию о конкретной позиции меню по ID
+    GET запрос на /menu/item/{id}
+    """
+    menu_item = menu_catalog.get(menu_item_id)
+    if not menu_item:
+        raise HTTPException(status_code=404, detail="Позиция меню не найдена")
+    return menu_item
+
+@app.post("/menu", response_model=MenuItem, status_code=201)
+def create_menu_item(menu_item: MenuItemCreate, session: Session = Depends(get_session)):
+    """
+    Создать новую позицию в меню
+    POST запрос на /menu с данными позиции в теле запроса
+    """
+    return create_menu_item_record(session, menu_item)
+
+@app.patch("/menu/{menu_item_id}", response_model=MenuItem)
+def update_menu_item(
+    menu_item_id: int, 
+    menu_update: MenuItemUpdate, 
+    session: Session = Depends(get_session)
+):
+    """
+    Обновить позицию меню
+    PATCH запрос на /menu/{id}
+    """
+    return update_menu_item_record(session, menu_item_id, menu_update)
+
+@app.delete("/menu/{menu_item_id}")
+def delete_menu_item(menu_item_id: int, session: Session = Depends(get_session)):
+    """
+    Удалить позицию меню по ID
+    DELETE запрос на /menu/{id}
     
-    session.delete(customer)
-    session.commit()
-    return {"message": f"Клиент {customer_id} успешно удален"}
+    Внимание: Позиция не должна быть в заказах
+    """
+    return delete_menu_item_record(session, menu_item_id)
+
+# ==================== ЗАКАЗЫ ====================
+
+@app.get("/orders", response_model=List[Order])
+def get_orders(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = Query(None, description="ID последнего заказа с предыдущей страницы"),
+    stream: bool = Query(False, description="Отдать все заказы потоком (JSON массив)"),
+    session: Session = Depends(get_read_session)
+):
+    """
+    Получить заказы постранично
+    GET запрос на /orders?limit=100&after=<курсор>
+    Курсор следующей страницы возвращается в заголовке X-Next-Cursor
+    С параметром stream=true все заказы отдаются одним потоковым JSON массивом
+    """
+    if stream:
+        return StreamingResponse(stream_json_array(Order, after, limit, session.bind), media_type="application/json")
+    return keyset_page_response(session, Order, request, response, limit, after)
+
+@app.get("/orders/{order_id}", response_model=Order)
+def get_order(order_id: int, request: Request, response: Response, session: Session = Depends(get_read_session)):
+    """
+    Получить информацию о конкретном заказе по его ID
+    GET запрос на /orders/{id}
+    Старые заказы ищутся и в архиве
+    С If-None-Match неизмененный заказ отдается как 304 без обращения к базе данных
+    """
+    return read_order(session, request, response, order_id)
+
+@app.post("/orders", response_model=Order, status_code=201)
+def create_order(
+    order: OrderCreate,
+    session: Session = Depends(get_session),
+    idempotency_key: Optional[str] = Header(None, max_length=255, description="Ключ для безопасного повтора запроса")
+):
+    """
+    Создать новый заказ
+    POST запрос на /orders с данными заказа в теле запроса
+    С заголовком Idempotency-Key повтор запроса вернет уже созданный заказ
+    """
+    return create_order_record(session, order, idempotency_key)
+
+@app.post("/checkout", status_code=201)
+def checkout(
+    checkout: CheckoutCreate,
+    session: Session = Depends(get_session),
+    idempotency_key: Optional[str] = Header(None, max_length=255, description="Ключ для безопасного повтора запроса")
+):
+    """
+    Оформить заказ целиком: клиент и все строки заказа
+    POST запрос на /checkout
+    Сумма считается на сервере, заказ и строки сохраняются одной транзакцией
+    С заголовком Idempotency-Key повтор запроса вернет уже оформленный заказ
+    """
+    # Все позиции меню - одним обращением к кэшу меню
+    menu_items = menu_catalog.get_many([line.menu_item_id for line in checkout.items])
+    return place_checkout(session, checkout, menu_items, idempotency_key)
+
+@app.patch("/orders/{order_id}/pay", response_model=Order)
+def pay_order(
+    order_id: int,
+    version: Optional[int] = Query(None, description="Ожидаемая версия заказа (409, если заказ уже изменен)"),
+    session: Session = Depends(get_session)
+):
+    """
+    Оплатить заказ (статусы заказа и оплаты - PAID)
+    PATCH запрос на /orders/{id}/pay
+    Один UPDATE ... RETURNING; 409 - заказ уже оплачен или изменен другим запросом
+    """
+    return transition_order(session, "pay", order_id, version)
+
+@app.patch("/orders/{order_id}/start", response_model=Order)
+def start_order(
+    order_id: int,
+    version: Optional[int] = Query(None, description="Ожидаемая версия заказа (409, если заказ уже изменен)"),
+    session: Session = Depends(get_session)
+):
+    """
+    Начать готовить оплаченный заказ (статус IN_PROGRESS)
+    PATCH запрос на /orders/{id}/start
+    """
+    return transition_order(session, "start", order_id, version)
+
+@app.patch("/orders/{order_id}/complete", response_model=Order)
+def complete_order(
+    order_id: int,
+    version: Optional[int] = Query(None, description="Ожидаемая версия заказа (409, если заказ уже изменен)"),
+    session: Session = Depends(get_session)
+):
+    """
+    Завершить заказ (установить статус COMPLETED)
+    PATCH запрос на /orders/{id}/complete
+    Если два бариста завершают заказ одновременно, второй получит 409
+    """
+    return transition_order(session, "complete", order_id, version)
+
+@app.post("/orders/transitions")
+def transition_orders_endpoint(batch: OrderTransitionBatch, session: Session = Depends(get_session)):
+    """
+    Перевести много заказов в следующий статус одним запросом (например, закрыть смену)
+    POST запрос на /orders/transitions
+    Пример: {"action": "complete", "order_ids": [1, 2, 3]}
+    Заказы не в подходящем статусе пропускаются и перечисляются в skipped_ids
+    """
+    return transition_orders(session, batch)
+
+@app.delete("/orders/{order_id}")
+def delete_order(order_id: int, session: Session = Depends(get_session)):
+    """
+    Удалить заказ по ID
+    DELETE запрос на /orders/{id}
+    
+    Внимание: Удалятся все позиции этого заказа
+    """
+    return delete_order_record(session, order_id)
+
+# ==================== ПОЗИЦИИ В ЗАКАЗЕ ====================
+
+@app.post("/order-items", response_model=OrderItem, status_code=201)
+def add_order_item(
+    item: OrderItemCreate,
+    session: Session = Depends(get_session),
+    idempotency_key: Optional[str] = Header(None, max_length=255, description="Ключ для безопасного повтора запроса")
+):
+    """
+    Добавить позицию в существующий заказ
+    POST запрос на /order-items с данными позиции в теле запроса
+    Позиция и новая сумма заказа сохраняются в одной транзакции
+    С заголовком Idempotency-Key повтор запроса не добавит позицию второй раз
+    """
+    menu_item = menu_catalog.get(item.menu_item_id)  # Позиция меню берется из кэша
+    return add_item_to_order(session, item, menu_item, idempotency_key)
+
+@app.delete("/order-items/{order_item_id}")
+def delete_order_item(order_item_id: int, session: Session = Depends(get_session)):
+    """
+    Удалить позицию из заказа
+    DELETE запрос на /order-items/{id}
+    Удаление позиции и уменьшение суммы заказа выполняются в одной транзакции
+    """
+    return remove_item_from_order(session, order_item_id)
+
+# ==================== ДОПОЛНИТЕЛЬНЫЕ ЭНДПОИНТЫ ====================
+
+@app.get("/orders/{order_id}/items")
+def get_order_items(order_id: int, session: Session = Depends(get_read_session)):
+    """
+    Получить все позиции конкретного заказа
+    GET запрос на /orders/{id}/items
+    Заказ, позиции и названия из меню читаются одним запросом
+    """
+    return read_order_items(session, order_id)
+
+@app.get("/orders/{order_id}/detail")
+def get_order_detail(order_id: int, request: Request, response: Response, session: Session = Depends(get_read_session)):
+    """
+    Получить заказ целиком: поля заказа и все его позиции с названиями из меню
+    GET запрос на /orders/{id}/detail
+    Все данные читаются одним запросом; с If-None-Match неизмененный заказ отдается как 304
+    """
+    return read_order_detail(session, request, response, order_id)
+
+@app.get("/customers/{customer_id}/orders")
+def get_customer_orders(customer_id: int, session: Session = Depends(get_read_session)):
+    """
+    Получить все заказы конкретного клиента
+    GET запрос на /customers/{id}/orders
+    Заказы, перенесенные в архив, тоже возвращаются (у них есть поле archived_at)
+    """
+    return read_customer_orders(session, customer_id)
+
+@app.get("/maintenance/order-totals")
+def check_order_totals(session: Session = Depends(get_session)):
+    """
+    Проверить, что суммы заказов совпадают с суммами их позиций
+    GET запрос на /maintenance/order-totals
+    """
+    return reconcile_order_totals(session, fix=False)
+
+@app.post("/maintenance/order-totals")
+def fix_order_totals(session: Session = Depends(get_session)):
+    """
+    Исправить суммы заказов, которые не совпадают с суммами их позиций
+    POST запрос на /maintenance/order-totals
+    """
+    return reconcile_order_totals(session, fix=True)
+
+@app.post("/maintenance/orders/cleanup")
+def cleanup_orders_endpoint(cleanup: OrderCleanup):
+    """
+    Массово удалить или перенести в архив заказы по условию
+    POST запрос на /maintenance/orders/cleanup
+    Пример: {"action": "archive", "status": "COMPLETED", "completed_before": "2024-01-01T00:00:00"}
+    Заказы обрабатываются пачками по batch_size, каждая пачка - отдельная транзакция
+    """
+    return cleanup_orders(engine, cleanup)
+
+@app.get("/maintenance/archive")
+def get_archive_status(session: Session = Depends(get_session)):
+    """
+    Состояние архива заказов и последней архивации
+    GET запрос на /maintenance/archive
+    """
+    return {
+        "archive_after_days": ARCHIVE_AFTER_DAYS,
+        "interval_seconds": ARCHIVE_INTERVAL_SECONDS,
+        "hot_orders": session.exec(select(func.count(Order.id))).one(),
+        "archived_orders": session.exec(select(func.count(OrderArchive.id))).one(),
+        **archive_job_state
+    }
+
+@app.post("/maintenance/archive")
+def run_archive(older_than_days: int = Query(ARCHIVE_AFTER_DAYS, ge=0)):
+    """
+    Перенести в архив завершенные оплаченные заказы старше older_than_days дней сейчас
+    POST запрос на /maintenance/archive?older_than_days=30
+    """
+    return archive_old_orders(engine, older_than_days)
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Метрики процесса в формате Prometheus
+    GET запрос на /metrics
+    """
+    # async: снимок собирается в цикле событий, где меняются счетчики запросов
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/debug/sql-stats")
+def get_sql_stats():
+    """
+    Статистика SQL запросов по эндпоинтам: число запросов, время в БД,
+    самый медленный запрос и число HTTP запросов с признаками N+1
+    GET запрос на /debug/sql-stats
+    """
+    return endpoint_query_stats.snapshot()
+
+# ==================== ПРОВЕРКИ СОСТОЯНИЯ (LIVENESS / READINESS) ====================
+# Оркестратор опрашивает сервер часто, поэтому пробы не обращаются к базе данных:
+#   GET /health/live  - процесс жив и цикл событий отвечает (база данных не проверяется)
+#   GET /health/ready - готов ли процесс принимать запросы, по последней проверке базы
+# Базу данных раз в HEALTH_CHECK_INTERVAL_SECONDS проверяет фоновая задача:
+# время SELECT 1 и заполненность пулов соединений. Одна неудачная проверка только
+# отмечает деградацию - процесс считается неготовым после HEALTH_FAILURE_THRESHOLD
+# неудач подряд, при превышении порогов или если проверки давно не выполнялись.
+# Пороги со значением 0 отключены.
+
+HEALTH_CHECK_INTERVAL_SECONDS = float(config_value("health_interval_seconds", "COFFEE_HEALTH_INTERVAL", 5))
+HEALTH_CHECK_TIMEOUT_SECONDS = float(config_value("health_timeout_seconds", "COFFEE_HEALTH_TIMEOUT", 2))
+HEALTH_FAILURE_THRESHOLD = int(config_value("health_failure_threshold", "COFFEE_HEALTH_FAILURES", 3))
+HEALTH_LATENCY_DEGRADED_MS = float(config_value("health_latency_degraded_ms", "COFFEE_HEALTH_LATENCY_DEGRADED_MS", 100))
+HEALTH_LATENCY_UNREADY_MS = float(config_value("health_latency_unready_ms", "COFFEE_HEALTH_LATENCY_UNREADY_MS", 1000))
+HEALTH_POOL_DEGRADED = float(config_value("health_pool_degraded", "COFFEE_HEALTH_POOL_DEGRADED", 0.8))  # Доля занятых соединений
+HEALTH_POOL_UNREADY = float(config_value("health_pool_unready", "COFFEE_HEALTH_POOL_UNREADY", 0))
+# Результат старше этого - фоновая проверка зависла, доверять ему нельзя
+HEALTH_STALE_SECONDS = 3 * HEALTH_CHECK_INTERVAL_SECONDS + HEALTH_CHECK_TIMEOUT_SECONDS
+
+started_at = time.monotonic()  # Для uptime в /health/live
+
+def pool_saturation() -> float:
+    """Наибольшая доля занятых соединений среди пулов процесса (1.0 - новые запросы ждут соединения)"""
+    saturation = 0.0
+    for _, pool in database_pools():
+        overflow_limit = getattr(pool, "overflow_limit", -1)  # Есть только у пулов TimedPoolMixin
+        if overflow_limit < 0:
+            continue  # Пул без ограничения запаса не заполняется
+        capacity = pool.size() + overflow_limit
+        if capacity:
+            saturation = max(saturation, pool.checkedout() / capacity)
+    return saturation
+
+def ping_database(target_engine) -> float:
+    """Время выполнения SELECT 1 в секундах (без ожидания соединения из пула)"""
+    with target_engine.connect() as connection:
+        started = time.perf_counter()
+        connection.exec_driver_sql("SELECT 1")
+        return time.perf_counter() - started
+
+async def ping_async_database(target_engine) -> float:
+    """То же для асинхронного движка"""
+    async with target_engine.connect() as connection:
+        started = time.perf_counter()
+        await connection.exec_driver_sql("SELECT 1")
+        return time.perf_counter() - started
+
+class HealthMonitor:
+    """Результат последней проверки базы данных и число неудач подряд"""
+
+    def __init__(self):
+        self.checked_at = None        # time.monotonic() последней проверки
+        self.checked_at_utc = None    # То же для ответа API
+        self.latency_ms = None        # Время SELECT 1 последней удачной проверки
+        self.saturation = 0.0         # Заполненность пулов при последней проверке
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.checks = 0
+        self.failures = 0
+
+    def record(self, latency: Optional[float], saturation: float, error: Optional[str] = None):
+        """Запоминает результат проверки (error - текст ошибки, если проверка не удалась)"""
+        self.checked_at = time.monotonic()
+        self.checked_at_utc = datetime.utcnow().isoformat()
+        self.saturation = saturation
+        self.checks += 1
+        if error is None:
+            self.latency_ms = round(latency * 1000, 3)
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+            self.failures += 1
+            self.last_error = error
+
+    def status(self) -> dict:
+        """Готовность по последней проверке: ready, status (ok, degraded, unavailable) и причины"""
+        unready, degraded = [], []
+        if self.checked_at is None:
+            unready.append("база данных еще не проверялась")
+        elif time.monotonic() - self.checked_at > HEALTH_STALE_SECONDS:
+            unready.append("проверка базы данных давно не выполнялась")
+
+        if self.consecutive_failures >= HEALTH_FAILURE_THRESHOLD:
+            unready.append(f"база данных недоступна: {self.last_error}")
+        elif self.consecutive_failures:
+            degraded.append(f"неудачных проверок подряд: {self.consecutive_failures}: {self.last_error}")
+
+        if self.latency_ms is not None and not self.consecutive_failures:
+            if HEALTH_LATENCY_UNREADY_MS and self.latency_ms >= HEALTH_LATENCY_UNREADY_MS:
+                unready.append(f"время ответа базы данных {self.latency_ms} мс")
+            elif HEALTH_LATENCY_DEGRADED_MS and self.latency_ms >= HEALTH_LATENCY_DEGRADED_MS:
+                degraded.append(f"время ответа базы данных {self.latency_ms} мс")
+
+        if HEALTH_POOL_UNREADY and self.saturation >= HEALTH_POOL_UNREADY:
+            unready.append(f"пул соединений занят на {self.saturation:.0%}")
+        elif HEALTH_POOL_DEGRADED and self.saturation >= HEALTH_POOL_DEGRADED:
+            degraded.append(f"пул соединений занят на {self.saturation:.0%}")
+
+        return {
+            "ready": not unready,
+            "status": "unavailable" if unready else "degraded" if degraded else "ok",
+            "reasons": unready + degraded,
+            "database": DATABASE_LABEL,
+            "latency_ms": self.latency_ms,
+            "pool_saturation": round(self.saturation, 3),
+            "consecutive_failures": self.consecutive_failures,
+            "checked_at": self.checked_at_utc,
+            "checks": self.checks,
+            "failures": self.failures,
+        }
+
+health_monitor = HealthMonitor()
+
+async def check_database_health():
+    """
+    Одна проверка базы данных. В отдельном потоке (asyncio.to_thread), а не в пуле потоков
+    эндпоинтов: зависшая проверка не занимает потоки запросов, а таймаут срабатывает сразу
+    """
+    saturation = pool_saturation()
+    try:
+        if async_engine is not None:
+            ping = ping_async_database(async_engine)
+        else:
+            ping = asyncio.to_thread(ping_database, engine)
+        latency = await asyncio.wait_for(ping, HEALTH_CHECK_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        health_monitor.record(None, saturation, f"нет ответа за {HEALTH_CHECK_TIMEOUT_SECONDS} с")
+    except Exception as error:
+        message = str(error).splitlines()[0] if str(error) else ""  # Без SQL и ссылок SQLAlchemy
+        health_monitor.record(None, saturation, f"{type(error).__name__}: {message}")
+    else:
+        health_monitor.record(latency, saturation)
+
+async def run_health_monitor():
+    """Фоновая задача сервера: проверка базы данных раз в HEALTH_CHECK_INTERVAL_SECONDS"""
+    while True:
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL_SECONDS)
+        was_ready = health_monitor.status()["ready"]
+        await check_database_health()
+        status = health_monitor.status()
+        if status["ready"] != was_ready:
+            logger.warning("Готовность сервера: %s (%s)", status["status"], "; ".join(status["reasons"]) or "ok")
+
+@app.get("/health/live")
+async def health_live():
+    """
+    Проверка, что процесс сервера жив (liveness): база данных не проверяется
+    GET запрос на /health/live
+    """
+    return {"status": "alive", "pid": os.getpid(), "uptime_seconds": round(time.monotonic() - started_at, 1)}
+
+@app.get("/health/ready")
+async def health_ready():
+    """
+    Готов ли процесс принимать запросы (readiness) - по результату последней фоновой проверки
+    GET запрос на /health/ready
+    200 - готов (status ok или degraded), 503 - не готов; причины - в поле reasons
+    """
+    status = health_monitor.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/database/health")
+def database_health(session: Session = Depends(get_session)):
+    """
+    Проверка состояния базы данных
+    GET запрос на /database/health
+    Возвращает информацию о состоянии подключения к базе данных
+    """
+    try:
+        # Пробуем выполнить простой запрос к базе данных
+        session.exec(select(1))  # Простой запрос: "выбрать 1"
+        return {
+            "status": "healthy",        # Статус: работает
+            "database": DATABASE_LABEL, # Тип базы данных
+            "connection": "success",    # Подключение: успешно
+            "schema_version": schema_version(engine),  # Последняя примененная миграция
+            "startup_ms": startup_timings,             # Время этапов запуска сервера
+            "timestamp": datetime.utcnow().isoformat()  # Время проверки
+        }
+    except Exception as e:
+        # Если произошла ошибка - возвращаем ошибку 500
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+# ==================== КУХНЯ ====================
+
+def format_sse(event_name: Optional[str], data) -> str:
+    """Сообщение Server-Sent Events; без имени события - комментарий-heartbeat"""
+    if event_name is None:
+        return ": ping\n\n"
+    message = f"event: {event_name}\n"
+    if isinstance(data, dict) and "id" in data:
+        message += f"id: {data['id']}\n"
+    return message + f"data: {json.dumps(data, default=str, ensure_ascii=False)}\n\n"
+
+@app.get("/kitchen/stream")
+async def kitchen_stream(request: Request, last_event_id: Optional[int] = Query(None)):
+    """
+    Поток событий заказов для экранов кухни (Server-Sent Events)
+    GET запрос на /kitchen/stream
+    Сначала приходит снимок активных заказов (event: snapshot), затем события
+    order.created, order.item_added, order.item_removed, order.paid, order.completed.
+    После переподключения браузер передает заголовок Last-Event-ID и получает
+    пропущенные события; event: resync означает, что нужно переподключиться за новым снимком
+    """
+    header_event_id = request.headers.get("last-event-id")
+    if last_event_id is None and header_event_id and header_event_id.isdigit():
+        last_event_id = int(header_event_id)
+
+    async def stream():
+        events = kitchen_events(last_event_id)
+        try:
+            async for event_name, data in events:
+                if await request.is_disconnected():
+                    break
+                yield format_sse(event_name, data)
+        finally:
+            await events.aclose()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/kitchen/ws")
+async def kitchen_websocket(websocket: WebSocket, last_event_id: Optional[int] = None):
+    """
+    Тот же поток событий заказов через WebSocket
+    Каждое сообщение - JSON: {"event": имя, "data": данные}; heartbeat - {"event": "ping"}
+    """
+    await websocket.accept()
+    events = kitchen_events(last_event_id)
+    try:
+        async for event_name, data in events:
+            await websocket.send_text(json.dumps({"event": event_name or "ping", "data": data}, default=str, ensure_ascii=False))
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await events.aclose()
+
+@app.get("/kitchen/stats")
+def kitchen_stats():
+    """
+    Состояние рассылки событий заказов
+    GET запрос на /kitchen/stats
+    """
+    return order_events.stats()
+
+# ==================== ОТЧЕТЫ О ПРОДАЖАХ ====================
+
+@app.get("/analytics/sales")
+def get_sales_report(
+    group_by: str = Query("day", description="day, hour, category или item"),
+    date_from: Optional[date] = Query(None, description="Начальная дата (включительно)"),
+    date_to: Optional[date] = Query(None, description="Конечная дата (включительно)"),
+    session: Session = Depends(get_read_session)
+):
+    """
+    Отчет о продажах: выручка и проданные штуки по дням, часам дня, категориям или позициям меню
+    GET запрос на /analytics/sales?group_by=day&date_from=2024-01-01&date_to=2024-12-31
+    Отчет читается из сводных таблиц, поэтому не зависит от числа заказов
+    """
+    if group_by in ("day", "hour"):
+        key = SalesHourly.day if group_by == "day" else SalesHourly.hour
+        statement = select(
+            key,
+            func.sum(SalesHourly.revenue),
+            func.sum(SalesHourly.units),
+            func.sum(SalesHourly.orders_paid),
+            func.sum(SalesHourly.orders_completed)
+        )
+        if date_from:
+            statement = statement.where(SalesHourly.day >= date_from)
+        if date_to:
+            statement = statement.where(SalesHourly.day <= date_to)
+        rows = session.exec(statement.group_by(key).order_by(key)).all()
+        return [
+            {group_by: value, "revenue": revenue, "units": units, "orders_paid": paid, "orders_completed": completed}
+            for value, revenue, units, paid, completed in rows
+        ]
+
+    if group_by in ("category", "item"):
+        key = SalesItemDaily.category if group_by == "category" else SalesItemDaily.menu_item_id
+        statement = select(key, func.sum(SalesItemDaily.revenue), func.sum(SalesItemDaily.units))
+        if date_from:
+            statement = statement.where(SalesItemDaily.day >= date_from)
+        if date_to:
+            statement = statement.where(SalesItemDaily.day <= date_to)
+        rows = session.exec(statement.group_by(key).order_by(func.sum(SalesItemDaily.revenue).desc())).all()
+        if group_by == "category":
+            return [{"category": category, "revenue": revenue, "units": units} for category, revenue, units in rows]
+
+        # Названия позиций берем из кэша меню, без JOIN
+        menu_items = menu_catalog.get_many([menu_item_id for menu_item_id, _, _ in rows])
+        return [
+            {
+                "menu_item_id": menu_item_id,
+                "menu_item_name": menu_items[menu_item_id].name if menu_item_id in menu_items else None,
+                "revenue": revenue,
+                "units": units
+            }
+            for menu_item_id, revenue, units in rows
+        ]
+
+    raise HTTPException(status_code=400, detail="group_by должен быть day, hour, category или item")
+
+@app.post("/analytics/rebuild")
+def rebuild_sales_report(session: Session = Depends(get_session)):
+    """
+    Пересчитать сводки продаж по всем заказам (например, после загрузки старых данных)
+    POST запрос на /analytics/rebuild
+    """
+    return rebuild_sales_rollups(session)
+
+# ==================== МАССОВЫЙ ИМПОРТ ====================
+
+# Клиенты и позиции меню загружаются из CSV (первая строка - заголовок) или
+# NDJSON (один JSON объект на строку). Данные читаются потоком, проверяются
+# моделями CustomerCreate / MenuItemCreate и вставляются пачками:
+# в PostgreSQL - командой COPY, в других базах - пакетным INSERT (executemany).
+# Ошибочные строки попадают в отчет и не мешают загрузке остальных.
+
+IMPORT_BATCH_SIZE = 1000      # Сколько записей вставлять за одну транзакцию
+IMPORT_MAX_REPORTED_ERRORS = 1000  # Сколько ошибок показывать в отчете
+
+# Что можно импортировать: таблица и модель для проверки данных
+IMPORT_KINDS = {
+    "customers": (Customer, CustomerCreate),
+    "menu": (MenuItem, MenuItemCreate),
+}
+
+class ImportParser:
+    """
+    Разбирает входные данные построчно и выдает записи (номер записи, словарь)
+    Если запись не разбирается - вместо словаря возвращается текст ошибки
+    """
+
+    def __init__(self, data_format: str):
+        if data_format not in ("csv", "ndjson"):
+            raise HTTPException(status_code=400, detail="Формат должен быть csv или ndjson")
+        self.data_format = data_format
+        self.header = None       # Заголовок CSV
+        self.pending = ""        # Незаконченная запись CSV (перевод строки внутри кавычек)
+        self.row_number = 0      # Номер последней записи с данными
+
+    def feed(self, line: str):
+        """Принимает одну строку входных данных, возвращает запись или None"""
+        line = line.rstrip("\r")
+        if self.data_format == "ndjson":
+            if not line.strip():
+                return None
+            self.row_number += 1
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                return self.row_number, f"Некорректный JSON: {e}"
+            if not isinstance(data, dict):
+                return self.row_number, "Ожидался JSON объект"
+            return self.row_number, data
+
+        # CSV: запись закончена, когда число кавычек в ней четное
+        self.pending = f"{self.pending}\n{line}" if self.pending else line
+        if self.pending.count('"') % 2:
+            return None
+        text, self.pending = self.pending, ""
+        if not text.strip():
+            return None
+        values = next(csv.reader([text]))
+        if self.header is None:
+            self.header = [name.strip() for name in values]
+            return None
+        self.row_number += 1
+        if len(values) != len(self.header):
+            return self.row_number, f"Ожидалось {len(self.header)} значений, получено {len(values)}"
+        # Пустые ячейки считаем незаполненными - тогда подставятся значения по умолчанию
+        return self.row_number, {name: value for name, value in zip(self.header, values) if value != ""}
+
+    def finish(self):
+        """Возвращает ошибку, если данные оборвались внутри кавычек"""
+        if self.pending:
+            self.row_number += 1
+            return self.row_number, "Незакрытые кавычки в конце файла"
+        return None
+
+def new_import_report(kind: str, data_format: str) -> dict:
+    """Отчет об импорте, который заполняется по мере загрузки пачек"""
+    return {
+        "kind": kind,
+        "format": data_format,
+        "method": "copy" if engine.dialect.name == "postgresql" else "executemany",
+        "received": 0,
+        "imported": 0,
+        "failed": 0,
+        "errors": []
+    }
+
+def add_import_error(report: dict, row_number: int, error: str):
+    report["failed"] += 1
+    if len(report["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+        report["errors"].append({"row": row_number, "error": error})
+
+def format_validation_error(error: ValidationError) -> str:
+    """Короткое описание ошибки проверки данных: поле и причина"""
+    return "; ".join(
+        f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}"
+        for item in error.errors()
+    )
+
+def copy_csv_value(value) -> str:
+    """
+    Значение для COPY ... (FORMAT csv): NULL - пустое поле без кавычек, остальное - в кавычках
+    csv.writer пишет None и пустую строку одинаково, и COPY превращал "" в NULL
+    """
+    if value is None:
+        return ""
+    return '"' + str(value).replace('"', '""') + '"'
+
+def copy_rows(session: Session, table, rows: List[dict]):
+    """Вставляет строки командой PostgreSQL COPY в текущей транзакции сессии"""
+    columns = list(rows[0].keys())
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(",".join(copy_csv_value(row[column]) for column in columns) + "\n")
+    buffer.seek(0)
+
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY "{table.name}" ({column_list}) FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+def insert_rows(session: Session, table, rows: List[dict]):
+    """Вставляет пачку строк: COPY для PostgreSQL, executemany для остальных баз"""
+    if session.bind.dialect.name == "postgresql":
+        copy_rows(session, table, rows)
+    else:
+        session.connection().execute(insert(table), rows)
+
+def load_import_batch(kind: str, records: list, report: dict):
+    """
+    Проверяет и сохраняет одну пачку записей в отдельной транзакции
+    Если пачка целиком не вставилась - вставляет строки по одной,
+    чтобы найти ошибочные и сохранить остальные
+    """
+    model, create_model = IMPORT_KINDS[kind]
+    table = model.__table__
+    now = datetime.utcnow()
+
+    rows = []
+    row_numbers = []
+    for row_number, data in records:
+        report["received"] += 1
+        if isinstance(data, str):
+            add_import_error(report, row_number, data)
+            continue
+        try:
+            validated = create_model(**data)
+        except ValidationError as e:
+            add_import_error(report, row_number, format_validation_error(e))
+            continue
+        row = {**validated.model_dump(), "created_at": now}
+        if kind == "customers":
+            # Поля поиска при массовой вставке заполняем сами (события ORM не срабатывают)
+            row["phone_normalized"] = normalize_phone(row["phone"])
+            row["name_normalized"] = normalize_name(row["name"])
+            row["name_last_word"] = last_name_word(row["name_normalized"])
+        rows.append(row)
+        row_numbers.append(row_number)
+
+    if not rows:
+        return
+
+    with Session(engine) as session:
+        try:
+            insert_rows(session, table, rows)
+            session.commit()
+            report["imported"] += len(rows)
+            return
+        except Exception:
+            session.rollback()
 
-# ==================== МЕНЮ ====================
+        # Пачка не вставилась - ищем ошибочные строки, каждая строка в своей точке сохранения
+        for row_number, row in zip(row_numbers, rows):
+            try:
+                with session.begin_nested():
+                    session.connection().execute(insert(table), [row])
+                report["imported"] += 1
+            except Exception as e:
+                add_import_error(report, row_number, f"Ошибка базы данных: {e}".splitlines()[0])
+        session.commit()
 
-@app.get("/menu", response_model=List[MenuItem])
-def get_menu(session: Session = Depends(get_session)):
+def finish_import(kind: str, report: dict) -> dict:
+    """Действия после импорта: новое меню нужно перечитать в кэш"""
+    if kind == "menu" and report["imported"]:
+        menu_catalog.invalidate()
+    return report
+
+def detect_import_format(content_type: str, data_format: Optional[str]) -> str:
+    """Формат данных: явно указанный или по заголовку Content-Type"""
+    if data_format:
+        return data_format
+    if "json" in (content_type or ""):
+        return "ndjson"
+    return "csv"
+
+async def iter_request_lines(request: Request):
+    """Построчно читает тело HTTP запроса, не загружая его в память целиком"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in request.stream():
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+async def import_from_request(request: Request, kind: str, data_format: Optional[str], batch_size: int) -> dict:
     """
-    Получить все позиции меню
-    GET запрос на /menu
+    Импорт из тела HTTP запроса: строки разбираются по мере поступления,
+    каждая пачка сохраняется в пуле потоков, не блокируя сервер
     """
-    return session.exec(select(MenuItem)).all()
+    data_format = detect_import_format(request.headers.get("content-type"), data_format)
+    parser = ImportParser(data_format)
+    report = new_import_report(kind, data_format)
 
-@app.get("/menu/available", response_model=List[MenuItem])
-def get_available_menu(session: Session = Depends(get_session)):
+    batch = []
+    async for line in iter_request_lines(request):
+        record = parser.feed(line)
+        if record is not None:
+            batch.append(record)
+        if len(batch) >= batch_size:
+            await run_in_threadpool(load_import_batch, kind, batch, report)
+            batch = []
+
+    record = parser.finish()
+    if record is not None:
+        batch.append(record)
+    if batch:
+        await run_in_threadpool(load_import_batch, kind, batch, report)
+    return finish_import(kind, report)
+
+def import_file(kind: str, path: str, data_format: Optional[str] = None, batch_size: int = IMPORT_BATCH_SIZE) -> dict:
     """
-    Получить только доступные позиции меню
-    GET запрос на /menu/available
+    Импорт из файла (используется командой python main.py import)
+    Формат определяется по расширению файла, если не указан явно
     """
-    return session.exec(select(MenuItem).where(MenuItem.is_available == True)).all()
+    if not data_format:
+        data_format = "ndjson" if path.endswith((".ndjson", ".jsonl", ".json")) else "csv"
+    parser = ImportParser(data_format)
+    report = new_import_report(kind, data_format)
 
-@app.get("/menu/{category}", response_model=List[MenuItem])
-def get_menu_by_category(category: str, session: Session = Depends(get_session)):
+    batch = []
+    with open(path, encoding="utf-8-sig", newline="") as file:
+        for line in file:
+            record = parser.feed(line.rstrip("\n"))
+            if record is not None:
+                batch.append(record)
+            if len(batch) >= batch_size:
+                load_import_batch(kind, batch, report)
+                batch = []
+
+    record = parser.finish()
+    if record is not None:
+        batch.append(record)
+    if batch:
+        load_import_batch(kind, batch, report)
+    return finish_import(kind, report)
+
+@app.post("/import/customers")
+async def import_customers(
+    request: Request,
+    format: Optional[str] = Query(None, description="csv или ndjson (по умолчанию - по Content-Type)"),
+    batch_size: int = Query(IMPORT_BATCH_SIZE, ge=1, le=50000)
+):
     """
-    Получить позиции меню по категории
-    GET запрос на /menu/{категория}
+    Массовый импорт клиентов из CSV или NDJSON в теле запроса
+    POST запрос на /import/customers
+    Колонки / поля: name, phone, email
     """
-    return session.exec(
-        select(MenuItem).where(
-            MenuItem.category == category,
-            MenuItem.is_available == True
-        )
-    ).all()
+    return await import_from_request(request, "customers", format, batch_size)
 
-@app.get("/menu/item/{menu_item_id}", response_model=MenuItem)
-def get_menu_item(menu_item_id: int, session: Session = Depends(get_session)):
+@app.post("/import/menu")
+async def import_menu(
+    request: Request,
+    format: Optional[str] = Query(None, description="csv или ndjson (по умолчанию - по Content-Type)"),
+    batch_size: int = Query(IMPORT_BATCH_SIZE, ge=1, le=50000)
+):
     """
-    Получить информацию о конкретной позиции меню по ID
-    GET запрос на /menu/item/{id}
+    Массовый импорт позиций меню из CSV или NDJSON в теле запроса
+    POST запрос на /import/menu
+    Колонки / поля: name, category, price, is_available
     """
-    menu_item = session.get(MenuItem, menu_item_id)
-    if not menu_item:
-        raise HTTPException(status_code=404, detail="Позиция меню не найдена")
+    return await import_from_request(request, "menu", format, batch_size)
+
+# ==================== АСИНХРОННЫЕ ЭНДПОИНТЫ ====================
+# Версии эндпоинтов для экспериментального режима COFFEE_DB_MODE=async.
+# Они работают через асинхронный движок и не занимают пул потоков,
+# поэтому число одновременных запросов ограничено базой данных, а не потоками.
+# Логика запросов общая с синхронными эндпоинтами (раздел ЛОГИКА ЭНДПОИНТОВ):
+# session.run_sync вызывает ее с синхронной сессией поверх асинхронного драйвера,
+# так что здесь остаются только обертки с теми же путями и ответами.
+
+async_router = APIRouter()
+
+async def get_menu_item_async(menu_item_id: int) -> Optional[MenuItem]:
+    """
+    Позиция меню из кэша; если копия меню устарела - перезагружаем ее в пуле потоков
+    """
+    menu_item = menu_catalog.peek(menu_item_id)
+    if menu_item is None:
+        menu_item = await run_in_threadpool(menu_catalog.get, menu_item_id)
     return menu_item
 
-@app.post("/menu", response_model=MenuItem, status_code=201)
-def create_menu_item(menu_item: MenuItemCreate, session: Session = Depends(get_session)):
+async def get_menu_items_async(menu_item_ids: List[int]) -> dict:
+    """
+    Несколько позиций меню из кэша; если каких-то нет - дочитываем их в пуле потоков
+    """
+    found = {menu_item_id: menu_catalog.peek(menu_item_id) for menu_item_id in menu_item_ids}
+    if all(menu_item is not None for menu_item in found.values()):
+        return found
+    return await run_in_threadpool(menu_catalog.get_many, menu_item_ids)
+
+# ---------- Клиенты ----------
+
+@async_router.get("/customers", response_model=List[Customer])
+async def get_customers_async(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = Query(None, description="ID последнего клиента с предыдущей страницы"),
+    stream: bool = Query(False, description="Отдать всех клиентов потоком (JSON массив)"),
+    session: AsyncSession = Depends(get_async_read_session)
+):
+    """
+    Получить список клиентов постранично
+    GET запрос на /customers?limit=100&after=<курсор>
+    """
+    if stream:
+        return StreamingResponse(stream_json_array_async(Customer, after, limit, session.bind), media_type="application/json")
+    return await session.run_sync(keyset_page_response, Customer, request, response, limit, after)
+
+@async_router.get("/customers/{customer_id}", response_model=Customer)
+async def get_customer_async(customer_id: int, session: AsyncSession = Depends(get_async_read_session)):
+    """
+    Получить информацию о конкретном клиенте по его ID
+    GET запрос на /customers/{id}
+    """
+    return await session.run_sync(find_or_404, Customer, customer_id, "Клиент не найден")
+
+@async_router.post("/customers", response_model=Customer, status_code=201)
+async def create_customer_async(customer: CustomerCreate, session: AsyncSession = Depends(get_async_session)):
+    """
+    Создать нового клиента
+    POST запрос на /customers
+    """
+    return await session.run_sync(create_record, Customer(**customer.dict()))
+
+@async_router.patch("/customers/{customer_id}", response_model=Customer)
+async def update_customer_async(
+    customer_id: int,
+    customer_update: CustomerUpdate,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    Обновить информацию о клиенте
+    PATCH запрос на /customers/{id}
+    """
+    return await session.run_sync(update_record, Customer, customer_id, customer_update, "Клиент не найден")
+
+@async_router.delete("/customers/{customer_id}")
+async def delete_customer_async(customer_id: int, session: AsyncSession = Depends(get_async_session)):
+    """
+    Удалить клиента по ID
+    DELETE запрос на /customers/{id}
+    """
+    return await session.run_sync(delete_customer_record, customer_id)
+
+@async_router.get("/customers/{customer_id}/orders")
+async def get_customer_orders_async(customer_id: int, session: AsyncSession = Depends(get_async_read_session)):
+    """
+    Получить все заказы конкретного клиента
+    GET запрос на /customers/{id}/orders
+    """
+    return await session.run_sync(read_customer_orders, customer_id)
+
+# ---------- Меню (изменение) ----------
+# Чтение меню идет из кэша и не обращается к базе данных, поэтому асинхронные версии не нужны
+
+@async_router.post("/menu", response_model=MenuItem, status_code=201)
+async def create_menu_item_async(menu_item: MenuItemCreate, session: AsyncSession = Depends(get_async_session)):
     """
     Создать новую позицию в меню
-    POST запрос на /menu с данными позиции в теле запроса
+    POST запрос на /menu
     """
-    new_menu_item = MenuItem(**menu_item.dict())
-    session.add(new_menu_item)
-    session.commit()
-    session.refresh(new_menu_item)
-    return new_menu_item
+    return await session.run_sync(create_menu_item_record, menu_item)
 
-@app.patch("/menu/{menu_item_id}", response_model=MenuItem)
-def update_menu_item(
-    menu_item_id: int, 
-    menu_update: MenuItemUpdate, 
-    session: Session = Depends(get_session)
+@async_router.patch("/menu/{menu_item_id}", response_model=MenuItem)
+async def update_menu_item_async(
+    menu_item_id: int,
+    menu_update: MenuItemUpdate,
+    session: AsyncSession = Depends(get_async_session)
 ):
     """
     Обновить позицию меню
     PATCH запрос на /menu/{id}
     """
-    menu_item = session.get(MenuItem, menu_item_id)
-    if not menu_item:
-        raise HTTPException(status_code=404, detail="Позиция меню не найдена")
-    
-    # Обновляем только переданные поля
-    update_data = menu_update.dict(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(menu_item, field, value)
-    
-    session.add(menu_item)
-    session.commit()
-    session.refresh(menu_item)
-    return menu_item
+    return await session.run_sync(update_menu_item_record, menu_item_id, menu_update)
 
-@app.delete("/menu/{menu_item_id}")
-def delete_menu_item(menu_item_id: int, session: Session = Depends(get_session)):
+@async_router.delete("/menu/{menu_item_id}")
+async def delete_menu_item_async(menu_item_id: int, session: AsyncSession = Depends(get_async_session)):
     """
     Удалить позицию меню по ID
     DELETE запрос на /menu/{id}
-    
-    Внимание: Позиция не должна быть в заказах
     """
-    menu_item = session.get(MenuItem, menu_item_id)
-    if not menu_item:
-        raise HTTPException(status_code=404, detail="Позиция меню не найдена")
-    
-    # Проверяем, используется ли позиция в заказах
-    order_items = session.exec(select(OrderItem).where(OrderItem.menu_item_id == menu_item_id)).all()
-    if order_items:
-        raise HTTPException(
-            status_code=400, 
-            detail="Нельзя удалить позицию меню, которая есть в заказах. Можно сделать недоступной (is_available=False)."
-        )
-    
-    session.delete(menu_item)
-    session.commit()
-    return {"message": f"Позиция меню {menu_item_id} успешно удалена"}
+    return await session.run_sync(delete_menu_item_record, menu_item_id)
 
-# ==================== ЗАКАЗЫ ====================
+# ---------- Заказы ----------
 
-@app.get("/orders", response_model=List[Order])
-def get_orders(session: Session = Depends(get_session)):
+@async_router.get("/orders", response_model=List[Order])
+async def get_orders_async(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = Query(None, description="ID последнего заказа с предыдущей страницы"),
+    stream: bool = Query(False, description="Отдать все заказы потоком (JSON массив)"),
+    session: AsyncSession = Depends(get_async_read_session)
+):
     """
-    Получить все заказы
-    GET запрос на /orders
+    Получить заказы постранично
+    GET запрос на /orders?limit=100&after=<курсор>
     """
-    return session.exec(select(Order)).all()
+    if stream:
+        return StreamingResponse(stream_json_array_async(Order, after, limit, session.bind), media_type="application/json")
+    return await session.run_sync(keyset_page_response, Order, request, response, limit, after)
 
-@app.get("/orders/{order_id}", response_model=Order)
-def get_order(order_id: int, session: Session = Depends(get_session)):
+@async_router.get("/orders/{order_id}", response_model=Order)
+async def get_order_async(
+    order_id: int, request: Request, response: Response, session: AsyncSession = Depends(get_async_read_session)
+):
     """
     Получить информацию о конкретном заказе по его ID
     GET запрос на /orders/{id}
     """
-    order = session.get(Order, order_id)
-    if not order:
-        raise HTTPException(status_code=404, detail="Заказ не найден")
-    return order
+    return await session.run_sync(read_order, request, response, order_id)
 
-@app.post("/orders", response_model=Order, status_code=201)
-def create_order(order: OrderCreate, session: Session = Depends(get_session)):
+@async_router.post("/orders", response_model=Order, status_code=201)
+async def create_order_async(
+    order: OrderCreate,
+    session: AsyncSession = Depends(get_async_session),
+    idempotency_key: Optional[str] = Header(None, max_length=255, description="Ключ для безопасного повтора запроса")
+):
     """
     Создать новый заказ
-    POST запрос на /orders с данными заказа в теле запроса
+    POST запрос на /orders
     """
-    # Проверяем существование клиента
-    customer = session.get(Customer, order.customer_id)
-    if not customer:
-        raise HTTPException(status_code=404, detail="Клиент не найден")
-    
-    new_order = Order(**order.dict())  # Создаем объект заказа
-    session.add(new_order)             # Добавляем заказ в сессию
-    session.commit()                   # Сохраняем изменения
-    session.refresh(new_order)         # Обновляем объект из базы данных
-    return new_order
+    return await session.run_sync(create_order_record, order, idempotency_key)
 
-@app.patch("/orders/{order_id}/complete", response_model=Order)
-def complete_order(order_id: int, session: Session = Depends(get_session)):
+@async_router.post("/checkout", status_code=201)
+async def checkout_async(
+    checkout: CheckoutCreate,
+    session: AsyncSession = Depends(get_async_session),
+    idempotency_key: Optional[str] = Header(None, max_length=255, description="Ключ для безопасного повтора запроса")
+):
+    """
+    Оформить заказ целиком: клиент и все строки заказа
+    POST запрос на /checkout
+    """
+    menu_items = await get_menu_items_async([line.menu_item_id for line in checkout.items])
+    return await session.run_sync(place_checkout, checkout, menu_items, idempotency_key)
+
+@async_router.patch("/orders/{order_id}/pay", response_model=Order)
+async def pay_order_async(
+    order_id: int,
+    version: Optional[int] = Query(None, description="Ожидаемая версия заказа (409, если заказ уже изменен)"),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    Оплатить заказ (статусы заказа и оплаты - PAID)
+    PATCH запрос на /orders/{id}/pay
+    """
+    return await session.run_sync(transition_order, "pay", order_id, version)
+
+@async_router.patch("/orders/{order_id}/start", response_model=Order)
+async def start_order_async(
+    order_id: int,
+    version: Optional[int] = Query(None, description="Ожидаемая версия заказа (409, если заказ уже изменен)"),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    Начать готовить оплаченный заказ (статус IN_PROGRESS)
+    PATCH запрос на /orders/{id}/start
+    """
+    return await session.run_sync(transition_order, "start", order_id, version)
+
+@async_router.patch("/orders/{order_id}/complete", response_model=Order)
+async def complete_order_async(
+    order_id: int,
+    version: Optional[int] = Query(None, description="Ожидаемая версия заказа (409, если заказ уже изменен)"),
+    session: AsyncSession = Depends(get_async_session)
+):
     """
     Завершить заказ (установить статус COMPLETED)
     PATCH запрос на /orders/{id}/complete
     """
-    order = session.get(Order, order_id)
-    if not order:
-        raise HTTPException(status_code=404, detail="Заказ не найден")
-    
-    if order.status == "COMPLETED":
-        raise HTTPException(status_code=400, detail="Заказ уже завершен")
-    
-    order.status = "COMPLETED"
-    order.completed_at = datetime.utcnow()
-    
-    session.add(order)
-    session.commit()
-    session.refresh(order)
-    return order
+    return await session.run_sync(transition_order, "complete", order_id, version)
 
-@app.patch("/orders/{order_id}/pay", response_model=Order)
-def pay_order(order_id: int, session: Session = Depends(get_session)):
+@async_router.post("/orders/transitions")
+async def transition_orders_async(batch: OrderTransitionBatch, session: AsyncSession = Depends(get_async_session)):
     """
-    Оплатить заказ (установить статус оплаты PAID)
-    PATCH запрос на /orders/{id}/pay
+    Перевести много заказов в следующий статус одним запросом
+    POST запрос на /orders/transitions
     """
-    order = session.get(Order, order_id)
-    if not order:
-        raise HTTPException(status_code=404, detail="Заказ не найден")
-    
-    if order.payment_status == "PAID":
-        raise HTTPException(status_code=400, detail="Заказ уже оплачен")
-    
-    order.payment_status = "PAID"
-    order.status = "PAID"  # Также обновляем статус заказа
-    
-    session.add(order)
-    session.commit()
-    session.refresh(order)
-    return order
+    return await session.run_sync(transition_orders, batch)
 
-@app.delete("/orders/{order_id}")
-def delete_order(order_id: int, session: Session = Depends(get_session)):
+@async_router.delete("/orders/{order_id}")
+async def delete_order_async(order_id: int, session: AsyncSession = Depends(get_async_session)):
     """
-    Удалить заказ по ID
+    Удалить заказ по ID вместе со всеми его позициями
     DELETE запрос на /orders/{id}
-    
-    Внимание: Удалятся все позиции этого заказа
     """
-    order = session.get(Order, order_id)
-    if not order:
-        raise HTTPException(status_code=404, detail="Заказ не найден")
-    
-    # Сначала удаляем все позиции заказа
-    order_items = session.exec(select(OrderItem).where(OrderItem.order_id == order_id)).all()
-    for item in order_items:
-        session.delete(item)
-    
-    # Затем удаляем сам заказ
-    session.delete(order)
-    session.commit()
-    return {"message": f"Заказ {order_id} успешно удален, удалено {len(order_items)} позиций"}
+    return await session.run_sync(delete_order_record, order_id)
 
-# ==================== ПОЗИЦИИ В ЗАКАЗЕ ====================
+# ---------- Позиции в заказе ----------
 
-@app.post("/order-items", response_model=OrderItem, status_code=201)
-def add_order_item(item: OrderItemCreate, session: Session = Depends(get_session)):
+@async_router.post("/order-items", response_model=OrderItem, status_code=201)
+async def add_order_item_async(
+    item: OrderItemCreate,
+    session: AsyncSession = Depends(get_async_session),
+    idempotency_key: Optional[str] = Header(None, max_length=255, description="Ключ для безопасного повтора запроса")
+):
     """
     Добавить позицию в существующий заказ
-    POST запрос на /order-items с данными позиции в теле запроса
+    POST запрос на /order-items
     """
-    # Проверяем существование заказа
-    order = session.get(Order, item.order_id)
-    menu_item = session.get(MenuItem, item.menu_item_id)
-    
-    if not order:
-        raise HTTPException(status_code=404, detail="Заказ не найден")
-    if not menu_item:
-        raise HTTPException(status_code=404, detail="Позиция меню не найдена")
-    
-    # Проверяем, доступна ли позиция меню
-    if not menu_item.is_available:
-        raise HTTPException(status_code=400, detail="Позиция меню недоступна")
-    
-    # Рассчитываем цену позиции (цена из меню × количество)
-    price = menu_item.price * item.quantity
-    
-    # Создаем новую позицию в заказе
-    new_order_item = OrderItem(
-        order_id=item.order_id,
-        menu_item_id=item.menu_item_id,
-        quantity=item.quantity,
-        price=price,
-        customizations=item.customizations
-    )
-    
-    session.add(new_order_item)        # Добавляем позицию в сессию
-    session.commit()                   # Сохраняем изменения
-    session.refresh(new_order_item)    # Обновляем объект из базы данных
-    
-    # Обновляем общую сумму заказа
-    # Получаем все позиции этого заказа
-    order_items = session.exec(select(OrderItem).where(OrderItem.order_id == item.order_id)).all()
-    # Суммируем цены всех позиций
-    order.total_amount = sum(item.price for item in order_items)
-    session.add(order)                 # Добавляем обновленный заказ в сессию
-    session.commit()                   # Сохраняем изменения
-    session.refresh(order)             # Обновляем заказ из базы данных
-    
-    # Еще раз обновляем позицию заказа
-    session.refresh(new_order_item)
-    
-    return new_order_item
+    menu_item = await get_menu_item_async(item.menu_item_id)
+    return await session.run_sync(add_item_to_order, item, menu_item, idempotency_key)
 
-@app.delete("/order-items/{order_item_id}")
-def delete_order_item(order_item_id: int, session: Session = Depends(get_session)):
+@async_router.delete("/order-items/{order_item_id}")
+async def delete_order_item_async(order_item_id: int, session: AsyncSession = Depends(get_async_session)):
     """
     Удалить позицию из заказа
     DELETE запрос на /order-items/{id}
     """
-    order_item = session.get(OrderItem, order_item_id)
-    if not order_item:
-        raise HTTPException(status_code=404, detail="Позиция заказа не найдена")
-    
-    # Сохраняем информацию для обновления суммы заказа
-    order_id = order_item.order_id
-    
-    # Удаляем позицию
-    session.delete(order_item)
-    session.commit()
-    
-    # Обновляем общую сумму заказа
-    order = session.get(Order, order_id)
-    order_items = session.exec(select(OrderItem).where(OrderItem.order_id == order_id)).all()
-    
-    if order_items:
-        order.total_amount = sum(item.price for item in order_items)
-    else:
-        order.total_amount = 0.0
-    
-    session.add(order)
-    session.commit()
-    
-    return {"message": f"Позиция заказа {order_item_id} удалена, заказ обновлен"}
-
-# ==================== ДОПОЛНИТЕЛЬНЫЕ ЭНДПОИНТЫ ====================
+    return await session.run_sync(remove_item_from_order, order_item_id)
 
-@app.get("/orders/{order_id}/items")
-def get_order_items(order_id: int, session: Session = Depends(get_session)):
+@async_router.get("/orders/{order_id}/items")
+async def get_order_items_async(order_id: int, session: AsyncSession = Depends(get_async_read_session)):
     """
     Получить все позиции конкретного заказа
     GET запрос на /orders/{id}/items
     """
-    # Проверяем существование заказа
-    order = session.get(Order, order_id)
-    if not order:
-        raise HTTPException(status_code=404, detail="Заказ не найден")
-    
-    # Получаем все позиции этого заказа
-    order_items = session.exec(select(OrderItem).where(OrderItem.order_id == order_id)).all()
-    
-    # Для каждой позиции получаем информацию о меню
-    result = []
-    for item in order_items:
-        menu_item = session.get(MenuItem, item.menu_item_id)
-        if menu_item:
-            result.append({
-                "id": item.id,
-                "menu_item_name": menu_item.name,
-                "quantity": item.quantity,
-                "price_per_item": item.price / item.quantity if item.quantity > 0 else 0,
-                "total_price": item.price,
-                "customizations": item.customizations
-            })
-    
-    return {
-        "order_id": order_id,
-        "total_amount": order.total_amount,
-        "items": result
-    }
+    return await session.run_sync(read_order_items, order_id)
 
-@app.get("/customers/{customer_id}/orders")
-def get_customer_orders(customer_id: int, session: Session = Depends(get_session)):
+@async_router.get("/orders/{order_id}/detail")
+async def get_order_detail_async(
+    order_id: int, request: Request, response: Response, session: AsyncSession = Depends(get_async_read_session)
+):
     """
-    Получить все заказы конкретного клиента
-    GET запрос на /customers/{id}/orders
+    Получить заказ целиком: поля заказа и все его позиции с названиями из меню
+    GET запрос на /orders/{id}/detail
     """
-    # Проверяем существование клиента
-    customer = session.get(Customer, customer_id)
-    if not customer:
-        raise HTTPException(status_code=404, detail="Клиент не найден")
-    
-    # Получаем все заказы клиента
-    orders = session.exec(select(Order).where(Order.customer_id == customer_id)).all()
-    
-    return {
-        "customer_id": customer_id,
-        "customer_name": customer.name,
-        "total_orders": len(orders),
-        "orders": orders
-    }
+    return await session.run_sync(read_order_detail, request, response, order_id)
 
-@app.get("/database/health")
-def database_health(session: Session = Depends(get_session)):
+def use_async_routes():
     """
-    Проверка состояния базы данных
-    GET запрос на /database/health
-    Возвращает информацию о состоянии подключения к базе данных
+    Заменяет синхронные эндпоинты их асинхронными версиями из async_router
+    Вызывается при запуске в режиме COFFEE_DB_MODE=async
     """
-    try:
-        # Пробуем выполнить простой запрос к базе данных
-        session.exec(select(1))  # Простой запрос: "выбрать 1"
-        return {
-            "status": "healthy",        # Статус: работает
-            "database": "PostgreSQL",   # Тип базы данных
-            "connection": "success",    # Подключение: успешно
-            "timestamp": datetime.utcnow().isoformat()  # Время проверки
-        }
-    except Exception as e:
-        # Если произошла ошибка - возвращаем ошибку 500
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    async_keys = {(route.path, method) for route in async_router.routes for method in route.methods}
+    app.router.routes = [
+        route for route in app.router.routes
+        if not (isinstance(route, APIRoute) and any((route.path, method) in async_keys for method in route.methods))
+    ]
+    app.include_router(async_router)
+
+if DB_MODE == "async":
+    use_async_routes()
 
 # ==================== ЗАПУСК СЕРВЕРА ====================
+# python main.py serve --workers N запускает N процессов сервера (воркеров uvicorn).
+# Схему базы данных один раз обновляет главный процесс, воркеры только проверяют ее версию,
+# пул соединений каждого воркера - его доля бюджета COFFEE_DB_MAX_CONNECTIONS и прогревается
+# до приема запросов. При остановке (Ctrl+C, SIGTERM) сервер перестает принимать соединения
+# и ждет завершения начатых запросов не дольше COFFEE_SHUTDOWN_TIMEOUT секунд.
 
-if __name__ == "__main__":
+SHUTDOWN_TIMEOUT_SECONDS = int(config_value("shutdown_timeout", "COFFEE_SHUTDOWN_TIMEOUT", 30))
+
+def serve(host: str = "0.0.0.0", port: int = 8000, workers: int = SERVER_WORKERS):
     """
-    Точка входа в программу
-    Этот код выполняется при запуске файла напрямую
+    Запускает веб-сервер и выводит подсказку по эндпоинтам
     """
+    if workers > 1:
+        if is_memory_sqlite(DATABASE_URL):
+            raise SystemExit("База данных SQLite в памяти не может быть общей для нескольких процессов: используйте файл или PostgreSQL")
+        connection_shares(workers)  # Ошибка, если бюджета соединений не хватит на всех воркеров
+
     print("\n" + "=" * 70)
     print("FASTAPI СЕРВЕР ЗАПУЩЕН!")
     print("=" * 70)
-    print("Полная документация API: http://localhost:8000/docs")
+    print(f"Полная документация API: http://localhost:{port}/docs")
     print("\nОСНОВНЫЕ ЭНДПОИНТЫ:")
     print("  КЛИЕНТЫ:")
-    print("    • Получить всех клиентов: GET /customers")
+    print("    • Получить клиентов: GET /customers?limit=100&after=<курсор>")
     print("    • Создать клиента: POST /customers")
     print("    • Обновить клиента: PATCH /customers/{id}")
     print("    • Удалить клиента: DELETE /customers/{id}")
+    print("    • Импорт клиентов (CSV/NDJSON): POST /import/customers")
+    print("    • Найти клиента по телефону или имени: GET /customers/search?q=...")
     
     print("\n  МЕНЮ:")
     print("    • Получить всё меню: GET /menu")
@@ -793,20 +4883,42 @@ if __name__ == "__main__":
     print("    • Создать позицию: POST /menu")
     print("    • Обновить позицию: PATCH /menu/{id}")
     print("    • Удалить позицию: DELETE /menu/{id}")
+    print("    • Статистика кэша меню: GET /menu/cache/stats")
+    print("    • Импорт меню (CSV/NDJSON): POST /import/menu")
     
     print("\n  ЗАКАЗЫ:")
-    print("    • Получить все заказы: GET /orders")
+    print("    • Получить заказы: GET /orders?limit=100&after=<курсор>")
+    print("    • Выгрузить все заказы потоком: GET /orders?stream=true")
     print("    • Создать заказ: POST /orders")
-    print("    • Завершить заказ: PATCH /orders/{id}/complete")
+    print("    • Оформить заказ со всеми позициями: POST /checkout")
     print("    • Оплатить заказ: PATCH /orders/{id}/pay")
+    print("    • Начать готовить заказ: PATCH /orders/{id}/start")
+    print("    • Завершить заказ: PATCH /orders/{id}/complete")
+    print("    • Перевести много заказов в следующий статус: POST /orders/transitions")
     print("    • Удалить заказ: DELETE /orders/{id}")
     print("    • Добавить позицию: POST /order-items")
     print("    • Удалить позицию: DELETE /order-items/{id}")
     
+    print("\n  КУХНЯ:")
+    print("    • Поток заказов (Server-Sent Events): GET /kitchen/stream")
+    print("    • Поток заказов (WebSocket): /kitchen/ws")
+    print("    • Состояние рассылки событий: GET /kitchen/stats")
+    
+    print("\n  ОТЧЕТЫ:")
+    print("    • Продажи: GET /analytics/sales?group_by=day|hour|category|item")
+    print("    • Пересчитать сводки: POST /analytics/rebuild")
+
     print("\n  ДОПОЛНИТЕЛЬНО:")
     print("    • Получить позиции заказа: GET /orders/{id}/items")
+    print("    • Получить заказ целиком: GET /orders/{id}/detail")
     print("    • Получить заказы клиента: GET /customers/{id}/orders")
     print("    • Проверить БД: GET /database/health")
+    print("    • Пробы для оркестратора: GET /health/live, GET /health/ready")
+    print("    • Статистика SQL запросов: GET /debug/sql-stats")
+    print("    • Метрики для Prometheus: GET /metrics")
+    print("    • Сверить суммы заказов: GET /maintenance/order-totals (исправить: POST)")
+    print("    • Удалить или архивировать заказы по условию: POST /maintenance/orders/cleanup")
+    print("    • Архив заказов: GET /maintenance/archive (архивировать сейчас: POST)")
     
     print("\nПРИМЕРЫ ТЕСТИРОВАНИЯ:")
     print("  1. Получить всех клиентов:")
@@ -828,4 +4940,71 @@ if __name__ == "__main__":
     # Запускаем веб-сервер
     # host="0.0.0.0" - слушаем все сетевые интерфейсы
     # port=8000 - используем порт 8000
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
+    if workers == 1:
+        uvicorn.run(app, host=host, port=port, log_level="info", timeout_graceful_shutdown=SHUTDOWN_TIMEOUT_SECONDS)
+        return
+
+    # Миграции - один раз до запуска воркеров, иначе они выполняли бы их наперегонки
+    prepare_database(engine)
+    engine.dispose()  # Соединения главного процесса воркерам не нужны
+    if EVENT_BACKEND != "postgres":
+        print("⚠ Каждый воркер рассылает кухне только свои события заказов: "
+              "для общего потока задайте COFFEE_EVENT_BACKEND=postgres")
+
+    # Воркеры импортируют этот модуль заново и узнают свои настройки из окружения.
+    # Приложение указывается по имени текущего модуля: при запуске python main.py воркер
+    # получает его как __main__, а импорт под именем main определил бы таблицы второй раз
+    os.environ["COFFEE_WORKERS"] = str(workers)
+    os.environ["COFFEE_SCHEMA_PREPARED"] = "1"
+    print(f"Запуск {workers} процессов сервера, соединений с базой данных на процесс: "
+          f"{sum(connection_shares(workers))} из {DB_CONNECTION_BUDGET}")
+    uvicorn.run(
+        f"{__name__}:app", host=host, port=port, workers=workers, log_level="info",
+        timeout_graceful_shutdown=SHUTDOWN_TIMEOUT_SECONDS,
+    )
+
+if __name__ == "__main__":
+    """
+    Точка входа в программу
+    Этот код выполняется при запуске файла напрямую:
+      python main.py                               - запустить веб-сервер
+      python main.py serve --workers 4             - запустить сервер в 4 процессах
+      python main.py migrate                       - применить миграции схемы
+      python main.py seed                          - добавить тестовые данные
+      python main.py archive                       - перенести старые заказы в архив
+      python main.py import customers clients.csv  - массовый импорт из файла
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Информационная система кофейни")
+    commands = parser.add_subparsers(dest="command")
+    serve_parser = commands.add_parser("serve", help="Запустить веб-сервер (по умолчанию)")
+    serve_parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="Число процессов сервера")
+    serve_parser.add_argument("--host", default="0.0.0.0", help="Адрес для входящих соединений")
+    serve_parser.add_argument("--port", type=int, default=8000, help="Порт")
+    commands.add_parser("migrate", help="Применить миграции схемы базы данных")
+    commands.add_parser("seed", help="Добавить тестовые данные в пустую базу данных")
+    archive_parser = commands.add_parser("archive", help="Перенести старые завершенные заказы в архив")
+    archive_parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS, help="Возраст заказов в днях")
+
+    import_parser = commands.add_parser("import", help="Массовый импорт клиентов или меню из CSV/NDJSON файла")
+    import_parser.add_argument("kind", choices=sorted(IMPORT_KINDS), help="Что импортировать")
+    import_parser.add_argument("path", help="Путь к файлу")
+    import_parser.add_argument("--format", choices=["csv", "ndjson"], help="Формат файла (по умолчанию - по расширению)")
+    import_parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="Записей в одной транзакции")
+
+    args = parser.parse_args()
+
+    if args.command in ("migrate", "seed", "import", "archive"):
+        prepare_database(engine)
+        print(f"Этапы подготовки (мс): {startup_timings}")
+
+    if args.command == "seed":
+        seed_database(engine)
+    elif args.command == "archive":
+        print(json.dumps(archive_old_orders(engine, args.older_than_days), ensure_ascii=False, indent=2))
+    elif args.command == "import":
+        report = import_file(args.kind, args.path, args.format, args.batch_size)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    elif args.command != "migrate":
+        serve(getattr(args, "host", "0.0.0.0"), getattr(args, "port", 8000), getattr(args, "workers", SERVER_WORKERS))
@@ -0,0 +1,70 @@
+"""
+Общие настройки автоматических тестов API (pytest)
+
+Тесты работают через fastapi.testclient.TestClient с временной базой SQLite,
+внешний сервер баз данных не нужен. Режим эндпоинтов - из COFFEE_DB_MODE
+(по умолчанию sync; асинхронный режим прогоняет test_async_mode.py).
+COFFEE_TEST_DATABASE_URL - запустить тесты на другой базе (например, PostgreSQL).
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DIR = tempfile.mkdtemp(prefix="coffee-tests-")
+
+# Настройки задаются до импорта main: он читает их при импорте
+os.environ["COFFEE_DATABASE_URL"] = os.getenv(
+    "COFFEE_TEST_DATABASE_URL", f"sqlite:///{os.path.join(TEST_DIR, 'coffee_test.db')}"
+)
+os.environ["COFFEE_CONFIG"] = os.path.join(TEST_DIR, "coffee_shop.json")  # Файла нет - настройки по умолчанию
+os.environ["COFFEE_ARCHIVE_INTERVAL"] = "0"  # Архивация по расписанию не должна мешать тестам
+os.environ["COFFEE_HEALTH_INTERVAL"] = "3600"  # Фоновая проверка базы не должна менять результат тестов проб
+sys.path.insert(0, ROOT_DIR)
+
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+@pytest.fixture(scope="session")
+def client():
+    """Клиент API; запуск и остановка приложения (lifespan) - один раз на все тесты"""
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+@pytest.fixture(scope="session")
+def menu(client):
+    """Позиции меню для тестов: {название: позиция}"""
+    items = [
+        {"name": "Тест эспрессо", "category": "test-coffee", "price": 120.0},
+        {"name": "Тест латте", "category": "test-coffee", "price": 180.0},
+        {"name": "Тест чизкейк", "category": "test-dessert", "price": 250.0},
+        {"name": "Тест сезонный", "category": "test-coffee", "price": 300.0, "is_available": False},
+    ]
+    created = {}
+    for item in items:
+        response = client.post("/menu", json=item)
+        assert response.status_code == 201, response.text
+        created[item["name"]] = response.json()
+    return created
+
+@pytest.fixture
+def customer(client):
+    """Новый клиент для каждого теста - заказы тестов не пересекаются"""
+    response = client.post("/customers", json={"name": "Тестовый Клиент", "phone": f"+7900{uuid.uuid4().int % 10**7:07d}"})
+    assert response.status_code == 201, response.text
+    return response.json()
+
+@pytest.fixture
+def checkout(client, customer, menu):
+    """Оформляет заказ клиента customer; lines - [(название позиции, количество), ...]"""
+    def make_order(lines=(("Тест эспрессо", 1),), headers=None):
+        response = client.post("/checkout", headers=headers, json={
+            "customer_id": customer["id"],
+            "items": [{"menu_item_id": menu[name]["id"], "quantity": quantity} for name, quantity in lines],
+        })
+        assert response.status_code == 201, response.text
+        return response.json()
+    return make_order
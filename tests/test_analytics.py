@@ -0,0 +1,105 @@
+"""Тесты сводок продаж: сводки меняются вместе с заказами и совпадают с полным пересчетом"""
+import pytest
+from sqlalchemy import update
+from sqlmodel import Session
+
+import main
+
+COUNTERS = ("revenue", "units", "orders_paid", "orders_completed")
+
+def sales(client) -> dict:
+    """Итоги отчета по дням и продажи каждой позиции меню: {счетчик: значение, menu_item_id: (штуки, выручка)}"""
+    days = client.get("/analytics/sales", params={"group_by": "day"}).json()
+    totals = {counter: sum(row[counter] for row in days) for counter in COUNTERS}
+    for row in client.get("/analytics/sales", params={"group_by": "item"}).json():
+        totals[row["menu_item_id"]] = (row["units"], row["revenue"])
+    return totals
+
+def sales_change(client, before: dict) -> dict:
+    """Что изменилось в отчете с момента before (позиции меню - только изменившиеся)"""
+    after = sales(client)
+    change = {counter: pytest.approx(after[counter] - before[counter]) for counter in COUNTERS}
+    for key in set(after) | set(before):
+        if key not in COUNTERS and after.get(key, (0, 0.0)) != before.get(key, (0, 0.0)):
+            units, revenue = after.get(key, (0, 0.0))
+            old_units, old_revenue = before.get(key, (0, 0.0))
+            change[key] = (units - old_units, pytest.approx(revenue - old_revenue))
+    return change
+
+def assert_matches_rebuild(client):
+    """Сводки, измененные по ходу работы, равны сводкам, пересчитанным с нуля"""
+    reports = {"day": "day", "item": "menu_item_id"}  # Отчет: ключ его строк
+    incremental = {group_by: client.get("/analytics/sales", params={"group_by": group_by}).json() for group_by in reports}
+    assert client.post("/analytics/rebuild").status_code == 200
+    for group_by, key in reports.items():
+        rebuilt = client.get("/analytics/sales", params={"group_by": group_by}).json()
+        assert sorted(row[key] for row in incremental[group_by]) == sorted(row[key] for row in rebuilt)
+        rebuilt = {row[key]: row for row in rebuilt}
+        for row in incremental[group_by]:
+            assert row == {
+                name: pytest.approx(value) if isinstance(value, float) else value
+                for name, value in rebuilt[row[key]].items()
+            }
+
+def test_rollups_follow_changes_of_paid_order(client, checkout, menu):
+    espresso, latte = menu["Тест эспрессо"]["id"], menu["Тест латте"]["id"]
+    before = sales(client)
+
+    order_id = checkout([("Тест эспрессо", 2)])["order_id"]
+    assert sales_change(client, before) == {counter: 0 for counter in COUNTERS}  # Не оплачен - в сводках его нет
+
+    assert client.patch(f"/orders/{order_id}/pay").status_code == 200
+    assert sales_change(client, before) == {
+        "revenue": 240, "units": 2, "orders_paid": 1, "orders_completed": 0, espresso: (2, 240)
+    }
+
+    line = client.post("/order-items", json={"order_id": order_id, "menu_item_id": latte, "quantity": 5}).json()
+    assert client.get(f"/orders/{order_id}").json()["total_amount"] == pytest.approx(240 + 5 * 180)
+    assert sales_change(client, before) == {
+        "revenue": 240 + 900, "units": 7, "orders_paid": 1, "orders_completed": 0, espresso: (2, 240), latte: (5, 900)
+    }
+
+    assert client.delete(f"/order-items/{line['id']}").status_code == 200
+    assert sales_change(client, before) == {
+        "revenue": 240, "units": 2, "orders_paid": 1, "orders_completed": 0, espresso: (2, 240)
+    }
+
+    assert client.patch(f"/orders/{order_id}/complete").status_code == 200
+    assert sales_change(client, before)["orders_completed"] == 1
+
+    assert client.delete(f"/orders/{order_id}").status_code == 200
+    assert sales_change(client, before) == {counter: 0 for counter in COUNTERS}
+    assert_matches_rebuild(client)
+
+def test_rollups_follow_cleanup_delete_and_archive(client, customer, checkout):
+    before = sales(client)
+    archived, deleted = checkout([("Тест латте", 1)])["order_id"], checkout([("Тест латте", 2)])["order_id"]
+    for action in ("pay", "complete"):
+        assert client.patch(f"/orders/{archived}/{action}").status_code == 200
+    assert client.patch(f"/orders/{deleted}/pay").status_code == 200
+    assert sales_change(client, before)["revenue"] == 3 * 180
+
+    # Архивный заказ остается в сводках, удаленный - исчезает из них
+    cleanup = {"customer_id": customer["id"]}
+    client.post("/maintenance/orders/cleanup", json={**cleanup, "action": "archive", "status": "COMPLETED"})
+    client.post("/maintenance/orders/cleanup", json={**cleanup, "action": "delete", "payment_status": "PAID"})
+    assert client.get(f"/orders/{deleted}").status_code == 404
+    change = sales_change(client, before)
+    assert {counter: change[counter] for counter in COUNTERS} == {
+        "revenue": 180, "units": 1, "orders_paid": 1, "orders_completed": 1
+    }
+    assert_matches_rebuild(client)
+
+def test_reconciled_total_of_paid_order_updates_revenue(client, checkout):
+    order_id = checkout([("Тест латте", 1)])["order_id"]
+    with Session(main.engine) as session:
+        # Неверная сумма (как старая ошибка подсчета) попадает в сводки при оплате
+        session.exec(update(main.Order).where(main.Order.id == order_id).values(total_amount=1.0))
+        session.commit()
+    before = sales(client)
+    assert client.patch(f"/orders/{order_id}/pay").status_code == 200
+    assert sales_change(client, before)["revenue"] == 1.0
+
+    client.post("/maintenance/order-totals")
+    assert sales_change(client, before)["revenue"] == 180
+    assert_matches_rebuild(client)
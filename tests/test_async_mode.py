@@ -0,0 +1,23 @@
+"""
+Те же тесты в режиме COFFEE_DB_MODE=async: у каждого эндпоинта есть асинхронная версия,
+а модуль main нельзя импортировать дважды в одном процессе, поэтому тесты
+запускаются еще раз в отдельном процессе pytest
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+import main
+
+@pytest.mark.skipif(main.DB_MODE == "async", reason="уже запущены в асинхронном режиме")
+def test_suite_passes_in_async_mode():
+    tests_dir = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, "COFFEE_DB_MODE": "async"}
+    env.pop("COFFEE_DATABASE_URL", None)  # Своя временная база данных (conftest выберет ее заново)
+    result = subprocess.run(
+        [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", tests_dir],
+        env=env, capture_output=True, text=True, timeout=600
+    )
+    assert result.returncode == 0, result.stdout[-5000:] + result.stderr[-2000:]
@@ -0,0 +1,58 @@
+"""Тесты поиска клиентов по началу телефона, имени и фамилии"""
+import random
+
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql
+from sqlmodel import Session
+
+import main
+
+def unique_word() -> str:
+    """Случайное слово из букв (в тестах имена не должны совпадать с именами других тестов)"""
+    return "".join(random.choice("бвгджзклмнпрстфхцчшщ") for _ in range(8))
+
+def create_customer(client, name: str, phone: str = None) -> dict:
+    phone = phone or f"+7900{random.randrange(10**7):07d}"
+    response = client.post("/customers", json={"name": name, "phone": phone})
+    assert response.status_code == 201, response.text
+    return response.json()
+
+def search(client, q: str) -> list:
+    response = client.get("/customers/search", params={"q": q})
+    assert response.status_code == 200, response.text
+    return [customer["id"] for customer in response.json()]
+
+def test_search_by_phone_prefix_in_any_format(client):
+    digits = f"{random.randrange(10**7):07d}"
+    customer = create_customer(client, "Телефон Тестовый", f"+7 (955) {digits[:3]}-{digits[3:5]}-{digits[5:]}")
+    for q in (f"+7955{digits[:4]}", f"8955{digits[:4]}", f"955{digits[:4]}", f"+7 955 {digits}"):
+        assert search(client, q)[:1] == [customer["id"]], q
+    assert "phone_normalized" not in client.get(f"/customers/{customer['id']}").json()
+
+def test_search_by_name_and_surname_start(client):
+    word = unique_word()
+    by_surname = create_customer(client, f"Анна {word.capitalize()}ова")
+    by_name = create_customer(client, f"{word.capitalize()} Петров")
+
+    # Совпадения с начала имени выше совпадений с начала фамилии
+    assert search(client, word[:4]) == [by_name["id"], by_surname["id"]]
+    assert search(client, f"{word.upper()}ОВА") == [by_surname["id"]]
+    # Без pg_trgm часть слова не ищется: такой поиск не использует индексы
+    assert search(client, word[2:6]) == []
+
+def test_name_search_uses_only_prefix_conditions_without_trigrams(monkeypatch):
+    monkeypatch.setattr(main, "customer_search_trigram", False)
+    statement = main.customer_search_statement("иван", 10, "postgresql")
+    patterns = [value for value in statement.compile(dialect=postgresql.dialect()).params.values() if isinstance(value, str)]
+    assert "иван%" in patterns
+    assert not [pattern for pattern in patterns if pattern.startswith("%")]  # LIKE '%...' прочитал бы всю таблицу
+
+def test_last_word_migration_fills_existing_customers(client):
+    customer = create_customer(client, f"Ольга Сергеевна {unique_word()}")
+    with Session(main.engine) as session:
+        # Клиент, сохраненный до появления колонки
+        session.exec(update(main.Customer).where(main.Customer.id == customer["id"]).values(name_last_word=None))
+        session.commit()
+    main.migration_add_customer_last_word(main.engine)
+    with Session(main.engine) as session:
+        assert session.get(main.Customer, customer["id"]).name_last_word == main.normalize_name(customer["name"]).split()[-1]
@@ -0,0 +1,44 @@
+"""Тесты генератора тестовых данных: одинаковый seed - одинаковые данные"""
+import os
+import sqlite3
+import subprocess
+import sys
+
+from conftest import ROOT_DIR, TEST_DIR
+
+TABLES = {
+    "customer": "id, name, phone, email, created_at",
+    "\"order\"": "id, customer_id, status, payment_status, total_amount, created_at, completed_at",
+    "orderitem": "id, order_id, menu_item_id, quantity, customizations, price",
+}
+
+def generate(name: str, seed: int) -> dict:
+    """Запускает generate_data.py в новую базу SQLite и возвращает ее строки по таблицам"""
+    path = os.path.join(TEST_DIR, f"generated-{name}.db")
+    if os.path.exists(path):
+        os.remove(path)
+    env = {**os.environ, "COFFEE_DATABASE_URL": f"sqlite:///{path}"}
+    subprocess.run(
+        [sys.executable, "generate_data.py", "--customers", "40", "--orders", "150", "--days", "10",
+         "--end", "2025-03-01", "--seed", str(seed), "--batch-size", "64"],
+        cwd=ROOT_DIR, env=env, check=True, capture_output=True, timeout=300
+    )
+    with sqlite3.connect(path) as connection:
+        return {
+            table: connection.execute(f"SELECT {columns} FROM {table} ORDER BY id").fetchall()
+            for table, columns in TABLES.items()
+        }
+
+def test_same_seed_gives_same_data():
+    first = generate("first", seed=7)
+    assert first == generate("second", seed=7)
+    assert [len(first[table]) for table in TABLES] == [40, 150, len(first["orderitem"])]
+    assert first["orderitem"] != generate("other", seed=8)["orderitem"]
+
+    # Сумма заказа - сумма его позиций, все заказы внутри периода
+    totals = {}
+    for _, order_id, _, _, _, price in first["orderitem"]:
+        totals[order_id] = totals.get(order_id, 0.0) + price
+    for order_id, _, _, _, total, created_at, _ in first["\"order\""]:
+        assert total == totals[order_id]
+        assert "2025-02-19" <= created_at < "2025-03-01"
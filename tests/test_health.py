@@ -0,0 +1,54 @@
+"""Тесты проб liveness/readiness и заполненности пулов соединений"""
+import sqlite3
+
+import main
+
+def test_live_does_not_depend_on_database(client, monkeypatch):
+    monkeypatch.setattr(main, "health_monitor", main.HealthMonitor())  # База данных еще не проверялась
+    live = client.get("/health/live")
+    assert live.status_code == 200
+    assert live.json()["status"] == "alive"
+    assert client.get("/health/ready").status_code == 503
+
+def test_ready_after_startup_check(client):
+    ready = client.get("/health/ready")
+    assert ready.status_code == 200, ready.text
+    assert ready.json()["ready"] is True
+
+def test_ready_turns_unready_only_after_threshold_failures(client, monkeypatch):
+    monitor = main.HealthMonitor()
+    monkeypatch.setattr(main, "health_monitor", monitor)
+    monitor.record(0.001, 0.0)
+    for failure in range(1, main.HEALTH_FAILURE_THRESHOLD):
+        monitor.record(None, 0.0, "OperationalError: нет соединения")
+        body = client.get("/health/ready").json()
+        assert (body["ready"], body["status"], body["consecutive_failures"]) == (True, "degraded", failure)
+
+    monitor.record(None, 0.0, "OperationalError: нет соединения")
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert "база данных недоступна" in response.json()["reasons"][0]
+
+    monitor.record(0.001, 0.0)  # Одна удачная проверка возвращает готовность
+    assert client.get("/health/ready").status_code == 200
+
+def test_pool_saturation_counts_overflow_capacity(monkeypatch):
+    pool = main.TimedQueuePool(lambda: sqlite3.connect(":memory:"), pool_size=1, max_overflow=1)
+    monkeypatch.setattr(main, "database_pools", lambda: [("test", pool)])
+    assert main.pool_saturation() == 0.0
+
+    first = pool.connect()
+    assert main.pool_saturation() == 0.5
+    second = pool.connect()
+    assert main.pool_saturation() == 1.0
+    first.close()
+    second.close()
+    pool.dispose()
+
+def test_pool_saturation_ignores_unlimited_overflow(monkeypatch):
+    pool = main.TimedQueuePool(lambda: sqlite3.connect(":memory:"), pool_size=1, max_overflow=-1)
+    monkeypatch.setattr(main, "database_pools", lambda: [("test", pool)])
+    connection = pool.connect()
+    assert main.pool_saturation() == 0.0
+    connection.close()
+    pool.dispose()
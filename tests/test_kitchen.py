@@ -0,0 +1,78 @@
+"""Тесты очереди заказов для кухни: снимок, события, продолжение по Last-Event-ID, resync"""
+import asyncio
+
+import main
+
+def receive_event(websocket, event_name: str) -> dict:
+    """Следующее событие event_name из WebSocket (события других типов пропускаются)"""
+    while True:
+        message = websocket.receive_json()
+        assert message["event"] != "ping", f"событие {event_name} не пришло"
+        if message["event"] == event_name:
+            return message["data"]
+
+def test_websocket_sends_snapshot_then_order_events(client, checkout):
+    waiting = checkout()["order_id"]
+    with client.websocket_connect("/kitchen/ws") as websocket:
+        snapshot = websocket.receive_json()
+        assert snapshot["event"] == "snapshot"
+        orders = {order["order_id"]: order for order in snapshot["data"]["orders"]}
+        assert orders[waiting]["status"] == "CREATED"
+        assert [item["menu_item_name"] for item in orders[waiting]["items"]] == ["Тест эспрессо"]
+
+        order_id = checkout([("Тест латте", 2)])["order_id"]
+        created = receive_event(websocket, "order.created")
+        assert created["order_id"] == order_id
+        assert created["items"][0]["quantity"] == 2
+
+        client.patch(f"/orders/{order_id}/pay")
+        paid = receive_event(websocket, "order.paid")
+        assert (paid["order_id"], paid["status"]) == (order_id, "PAID")
+        assert paid["id"] > created["id"]
+
+def test_reconnect_with_last_event_id_replays_missed_events(client, checkout):
+    order_id = checkout()["order_id"]
+    last_event_id = client.get("/kitchen/stats").json()["last_event_id"]
+
+    # Пока экран отключен, заказ оплатили и завершили
+    for action in ("pay", "complete"):
+        client.patch(f"/orders/{order_id}/{action}")
+
+    with client.websocket_connect(f"/kitchen/ws?last_event_id={last_event_id}") as websocket:
+        missed = [websocket.receive_json() for _ in range(2)]
+    assert [(message["event"], message["data"]["order_id"]) for message in missed] == [
+        ("order.paid", order_id), ("order.completed", order_id)
+    ]
+
+def test_rolled_back_changes_are_not_published(client, customer, menu):
+    before = client.get("/kitchen/stats").json()["last_event_id"]
+    response = client.post("/order-items", json={"order_id": 10**9, "menu_item_id": menu["Тест эспрессо"]["id"]})
+    assert response.status_code == 404
+    assert client.get("/kitchen/stats").json()["last_event_id"] == before
+
+def test_history_too_short_requires_snapshot(monkeypatch):
+    monkeypatch.setattr(main, "EVENT_HISTORY_SIZE", 3)
+    broker = main.OrderEventBroker()
+    for order_id in range(5):
+        broker.publish({"type": "order.created", "order_id": order_id})
+    assert broker.events_after(1) is None  # События 2 и 3 уже вытеснены из истории
+    assert [message["id"] for message in broker.events_after(3)] == [4, 5]
+
+def test_slow_subscriber_gets_resync(monkeypatch):
+    monkeypatch.setattr(main, "SUBSCRIBER_QUEUE_SIZE", 2)
+    loop = asyncio.new_event_loop()
+    try:
+        broker = main.OrderEventBroker()
+        subscriber = main.EventSubscriber(loop)
+        for event_id in range(1, 5):
+            broker._deliver(subscriber, {"id": event_id, "type": "order.created"})
+        assert subscriber.lagged
+        assert [subscriber.queue.get_nowait() for _ in range(subscriber.queue.qsize())] == [{"type": "resync"}]
+        assert broker.dropped_subscribers == 1
+    finally:
+        loop.close()
+
+def test_sse_message_format():
+    assert main.format_sse(None, None) == ": ping\n\n"
+    message = main.format_sse("order.paid", {"id": 7, "order_id": 3})
+    assert message == 'event: order.paid\nid: 7\ndata: {"id": 7, "order_id": 3}\n\n'
@@ -0,0 +1,66 @@
+"""Тесты постраничной выдачи по курсору (keyset) и потоковой выгрузки списков"""
+import pytest
+
+@pytest.fixture(scope="module")
+def many_orders(client, menu):
+    """Клиент и 7 его заказов (для листания страницами)"""
+    customer = client.post("/customers", json={"name": "Листающий", "phone": "+7 900 555-00-01"}).json()
+    return [
+        client.post("/orders", json={"customer_id": customer["id"], "total_amount": n}).json()["id"]
+        for n in range(7)
+    ]
+
+@pytest.mark.parametrize("resource", ["/orders", "/customers"])
+def test_keyset_pages_cover_all_rows_once(client, many_orders, resource):
+    ids = []
+    params = {"limit": 3}
+    while True:
+        response = client.get(resource, params=params)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page) <= 3
+        ids.extend(row["id"] for row in page)
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            assert "Link" not in response.headers
+            break
+        assert int(cursor) == page[-1]["id"]
+        assert 'rel="next"' in response.headers["Link"]
+        params = {"limit": 3, "after": cursor}
+
+    assert ids == sorted(set(ids))  # По возрастанию id, без повторов
+    if resource == "/orders":
+        assert set(many_orders) <= set(ids)
+
+def test_page_after_cursor_starts_after_it(client, many_orders):
+    page = client.get("/orders", params={"after": many_orders[2], "limit": 2}).json()
+    assert [order["id"] for order in page] == many_orders[3:5]
+
+def test_page_limit_is_validated(client):
+    assert client.get("/orders", params={"limit": 0}).status_code == 422
+    assert client.get("/orders", params={"limit": 100000}).status_code == 422
+
+@pytest.mark.parametrize("resource", ["/orders", "/customers"])
+def test_stream_matches_pages(client, many_orders, resource):
+    response = client.get(resource, params={"stream": "true"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/json")
+    streamed = [row["id"] for row in response.json()]
+
+    paged = [row["id"] for row in client.get(resource, params={"limit": 1000}).json()]
+    assert streamed == paged
+
+    after = client.get(resource, params={"stream": "true", "after": streamed[0], "limit": 2}).json()
+    assert [row["id"] for row in after] == streamed[1:3]
+
+def test_stream_sql_stats_recorded_after_body(client, many_orders):
+    before = client.get("/debug/sql-stats").json().get("GET /orders", {}).get("queries", 0)
+    response = client.get("/orders", params={"stream": "true"})
+
+    # Запросы потока выполняются после отправки заголовков - заголовков X-DB-* нет,
+    # а статистика эндпоинта учитывает их, когда тело отдано
+    assert "X-DB-Query-Count" not in response.headers
+    assert client.get("/debug/sql-stats").json()["GET /orders"]["queries"] > before
+
+    paged = client.get("/orders", params={"limit": 2})
+    assert int(paged.headers["X-DB-Query-Count"]) >= 1
@@ -0,0 +1,146 @@
+"""Тесты обслуживания базы: массовая очистка и архивация заказов, импорт клиентов и меню"""
+import csv
+import json
+import uuid
+
+import pytest
+
+import main
+
+# ---------- Очистка и архивация заказов ----------
+
+def complete_order(client, order_id: int):
+    for action in ("pay", "start", "complete"):
+        assert client.patch(f"/orders/{order_id}/{action}").status_code == 200
+
+def test_cleanup_requires_condition_and_known_action(client):
+    assert client.post("/maintenance/orders/cleanup", json={"action": "archive"}).status_code == 400
+    assert client.post("/maintenance/orders/cleanup", json={"action": "drop", "status": "CREATED"}).status_code == 400
+
+def test_cleanup_archive_by_customer(client, customer, checkout):
+    kept = checkout()["order_id"]
+    done = [checkout([("Тест латте", 2)])["order_id"] for _ in range(3)]
+    for order_id in done:
+        complete_order(client, order_id)
+    cleanup = {"action": "archive", "status": "COMPLETED", "customer_id": customer["id"], "batch_size": 2}
+
+    dry_run = client.post("/maintenance/orders/cleanup", json={**cleanup, "dry_run": True}).json()
+    assert (dry_run["dry_run"], dry_run["orders"]) == (True, 3)
+
+    report = client.post("/maintenance/orders/cleanup", json=cleanup).json()
+    assert (report["orders"], report["items"], report["batches"]) == (3, 3, 2)
+
+    # Архивный заказ по-прежнему доступен по ID и в списке заказов клиента
+    archived = client.get(f"/orders/{done[0]}").json()
+    assert (archived["status"], archived["total_amount"]) == ("COMPLETED", pytest.approx(2 * 180))
+    assert client.patch(f"/orders/{done[0]}/pay").status_code == 409
+    history = {order["id"]: order for order in client.get(f"/customers/{customer['id']}/orders").json()["orders"]}
+    assert sorted(history) == sorted([kept, *done])
+    assert all(history[order_id].get("archived_at") for order_id in done)
+    assert history[kept].get("archived_at") is None
+
+    # Клиента с архивными заказами удалить нельзя
+    assert client.delete(f"/customers/{customer['id']}").status_code in (400, 409)
+
+def test_archived_order_items_and_detail(client, customer, checkout):
+    order = checkout([("Тест эспрессо", 1), ("Тест латте", 2)])
+    complete_order(client, order["order_id"])
+    live_detail = client.get(f"/orders/{order['order_id']}/detail").json()
+    live_items = client.get(f"/orders/{order['order_id']}/items").json()
+    cleanup = {"action": "archive", "status": "COMPLETED", "customer_id": customer["id"]}
+    assert client.post("/maintenance/orders/cleanup", json=cleanup).json()["orders"] == 1
+
+    # После переноса в архив состав заказа тот же, что и до него
+    detail = client.get(f"/orders/{order['order_id']}/detail")
+    assert detail.status_code == 200, detail.text
+    assert detail.json() == live_detail
+    assert [item["menu_item_name"] for item in detail.json()["items"]] == ["Тест эспрессо", "Тест латте"]
+    assert client.get(f"/orders/{order['order_id']}/items").json() == live_items
+    assert client.get("/orders/999999999/detail").status_code == 404
+
+def test_cleanup_delete(client, customer, checkout):
+    order_id = checkout([("Тест эспрессо", 1), ("Тест латте", 1)])["order_id"]
+    cleanup = {"action": "delete", "status": "CREATED", "customer_id": customer["id"]}
+    report = client.post("/maintenance/orders/cleanup", json=cleanup).json()
+    assert (report["orders"], report["items"]) == (1, 2)
+    assert client.get(f"/orders/{order_id}").status_code == 404
+
+def test_scheduled_archive_moves_only_completed_paid_orders(client, customer, checkout):
+    paid = checkout()["order_id"]
+    client.patch(f"/orders/{paid}/pay")
+    completed = checkout()["order_id"]
+    complete_order(client, completed)
+
+    # Старше 1 дня таких заказов нет - архивировать нечего
+    assert client.post("/maintenance/archive", params={"older_than_days": 1}).json()["orders"] == 0
+    report = client.post("/maintenance/archive", params={"older_than_days": 0}).json()
+    assert report["orders"] >= 1
+    history = {order["id"]: order for order in client.get(f"/customers/{customer['id']}/orders").json()["orders"]}
+    assert history[completed].get("archived_at") is not None
+    assert history[paid].get("archived_at") is None
+
+    status = client.get("/maintenance/archive").json()
+    assert status["last_result"]["orders"] == report["orders"]
+    assert status["archived_orders"] >= 1
+
+def test_new_order_does_not_reuse_archived_id(client, customer, checkout):
+    newest = checkout()["order_id"]
+    cleanup = {"action": "delete", "status": "CREATED", "customer_id": customer["id"]}
+    assert client.post("/maintenance/orders/cleanup", json=cleanup).json()["orders"] == 1
+
+    assert checkout()["order_id"] > newest
+    assert client.get(f"/orders/{newest}").status_code == 404
+
+# ---------- Импорт ----------
+
+def test_import_customers_csv_reports_bad_rows(client):
+    phone = f"+7 901 {uuid.uuid4().int % 10**7:07d}"
+    body = "\n".join([
+        "name,phone,email",
+        f"Импорт Первый,{phone},first@example.com",
+        f'"Импорт, Второй",{phone}9,',               # Запятая в кавычках, пустой email
+        "Импорт Третий",                              # Не хватает колонок
+        f"Импорт Четвертый,{phone}8,fourth@example.com",
+    ])
+    response = client.post("/import/customers", content=body.encode("utf-8"), headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200
+    report = response.json()
+    assert report["format"] == "csv"
+    assert (report["received"], report["imported"], report["failed"]) == (4, 3, 1)
+    assert report["errors"][0]["row"] == 3
+
+    found = client.get("/customers/search", params={"q": "импорт, второй"}).json()
+    assert [(c["name"], c["email"]) for c in found] == [("Импорт, Второй", None)]
+
+def test_import_menu_ndjson(client):
+    name = f"Импорт {uuid.uuid4().hex[:8]}"
+    lines = [
+        json.dumps({"name": name, "category": "test-import", "price": 99.5}),
+        "{не json",
+        json.dumps({"name": "Без цены", "category": "test-import"}),
+        json.dumps([1, 2]),
+        json.dumps({"name": name + " 2", "category": "test-import", "price": 10, "is_available": False}),
+    ]
+    response = client.post(
+        "/import/menu", params={"batch_size": 2},
+        content="\n".join(lines).encode("utf-8"), headers={"Content-Type": "application/x-ndjson"}
+    )
+    report = response.json()
+    assert report["format"] == "ndjson"
+    assert (report["received"], report["imported"], report["failed"]) == (5, 2, 3)
+    assert [error["row"] for error in report["errors"]] == [2, 3, 4]
+
+    # Кэш меню сброшен: новые позиции видны сразу (недоступные в меню категории не показываются)
+    items = {item["name"]: item for item in client.get("/menu/test-import").json()}
+    assert items[name]["price"] == pytest.approx(99.5)
+    assert name + " 2" not in items
+
+def test_copy_csv_keeps_empty_string_apart_from_null():
+    # COPY (FORMAT csv) читает NULL из пустого поля без кавычек, а "" - как пустую строку
+    values = [None, "", 'кофе "Раф", с сиропом', "строка\nвторая", 99.5, True]
+    line = ",".join(main.copy_csv_value(value) for value in values)
+    assert line.startswith(',"",')
+    assert next(csv.reader([line])) == ["", "", 'кофе "Раф", с сиропом', "строка\nвторая", "99.5", "True"]
+
+def test_import_rejects_unknown_format(client):
+    assert client.post("/import/menu", params={"format": "xml"}, content=b"<menu/>").status_code == 400
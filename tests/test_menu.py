@@ -0,0 +1,40 @@
+"""Тесты кэша меню: сброс при изменении меню и статистика попаданий"""
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+
+def cache_stats(client) -> dict:
+    return client.get("/menu/cache/stats").json()
+
+def test_menu_reads_are_served_from_cache(client, menu):
+    client.get("/menu")
+    before = cache_stats(client)
+    for path in ("/menu", "/menu/available", "/menu/test-coffee"):
+        assert client.get(path).status_code == 200
+    after = cache_stats(client)
+    assert after["hits"] >= before["hits"] + 3
+    assert (after["reloads"], after["version"]) == (before["reloads"], before["version"])
+
+def test_menu_writes_invalidate_cache(client, menu):
+    client.get("/menu")
+    before = cache_stats(client)
+    created = client.post("/menu", json={"name": "Тест раф", "category": "test-coffee", "price": 210.0}).json()
+    after = cache_stats(client)
+    assert after["invalidations"] == before["invalidations"] + 1
+    assert after["version"] > before["version"]
+    # Новая позиция видна сразу, без ожидания TTL
+    assert created["id"] in [item["id"] for item in client.get("/menu/available").json()]
+
+    client.patch(f"/menu/{created['id']}", json={"is_available": False})
+    assert created["id"] not in [item["id"] for item in client.get("/menu/available").json()]
+    assert client.delete(f"/menu/{created['id']}").status_code == 200
+    assert client.get(f"/menu/item/{created['id']}").status_code == 404
+
+def test_cache_counters_are_exact_under_concurrent_reads(client, menu):
+    catalog = main.MenuCatalog(ttl_seconds=60)
+    lookups = 2000
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(lambda _: catalog.all_items(), range(lookups)))
+    stats = catalog.stats()
+    assert stats["hits"] + stats["misses"] == lookups
+    assert (stats["misses"], stats["reloads"]) == (1, 1)  # Меню загружено один раз
@@ -0,0 +1,58 @@
+"""Тесты метрик Prometheus: запросы по шаблонам путей, время ответа, кэш меню, пулы"""
+import os
+
+import main
+
+def metrics(client) -> dict:
+    """Значения метрик GET /metrics: {"имя{метки}": число}"""
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    samples = {}
+    for line in response.text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+def labels(**values) -> str:
+    return main.metric_labels(pid=os.getpid(), **values)
+
+def test_requests_are_counted_by_route_template(client, customer):
+    requests = "coffee_http_requests_total" + labels(method="GET", route="/customers/{customer_id}", status=200)
+    duration = "coffee_http_request_duration_seconds_count" + labels(method="GET", route="/customers/{customer_id}")
+    before = metrics(client)
+    for _ in range(3):
+        client.get(f"/customers/{customer['id']}")
+    client.get("/no-such-path")
+    after = metrics(client)
+
+    assert after[requests] == before.get(requests, 0) + 3
+    assert after[duration] == before.get(duration, 0) + 3
+    # Корзина +Inf содержит все наблюдения гистограммы
+    inf_bucket = "coffee_http_request_duration_seconds_bucket" + labels(method="GET", route="/customers/{customer_id}", le="+Inf")
+    assert after[inf_bucket] == after[duration]
+    unmatched = "coffee_http_requests_total" + labels(method="GET", route=main.UNMATCHED_ROUTE, status=404)
+    assert after[unmatched] == before.get(unmatched, 0) + 1
+
+def test_menu_cache_and_pool_metrics(client, menu):
+    client.get("/menu")
+    before = metrics(client)
+    client.get("/menu")
+    after = metrics(client)
+    hits = "coffee_menu_cache_hits_total" + labels()
+    assert after[hits] >= before[hits] + 1
+    assert after[hits] == main.menu_catalog.stats()["hits"]
+
+    for name, pool in main.database_pools():
+        assert after["coffee_db_pool_size" + labels(pool=name)] == pool.size()
+        assert "coffee_db_pool_wait_seconds_count" + labels(pool=name) in after
+
+def test_order_events_are_counted_after_commit(client, checkout):
+    created = "coffee_order_events_total" + labels(type="order.created")
+    before = metrics(client).get(created, 0)
+    checkout()
+    assert metrics(client)[created] == before + 1
+
+def test_label_values_are_escaped():
+    assert main.metric_labels(route='/a"b\\c\nd') == '{route="/a\\"b\\\\c\\nd"}'
@@ -0,0 +1,66 @@
+"""Тесты запуска без побочных эффектов и версионных миграций схемы"""
+import os
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy import inspect, text
+from sqlmodel import Session, select
+
+import main
+from conftest import ROOT_DIR, TEST_DIR
+
+LATEST = main.MIGRATIONS[-1][0]
+
+@pytest.fixture
+def empty_engine():
+    """Движок новой пустой базы SQLite"""
+    path = os.path.join(TEST_DIR, f"migrations-{os.getpid()}.db")
+    if os.path.exists(path):
+        os.remove(path)
+    target_engine = main.create_database_engine(f"sqlite:///{path}", 2)
+    yield target_engine
+    target_engine.dispose()
+
+def test_migration_numbers_are_increasing():
+    versions = [version for version, _, _ in main.MIGRATIONS]
+    assert versions == list(range(1, len(versions) + 1))
+
+def test_import_does_not_touch_database():
+    path = os.path.join(TEST_DIR, "import-only.db")
+    env = {**os.environ, "COFFEE_DATABASE_URL": f"sqlite:///{path}"}
+    subprocess.run([sys.executable, "-c", "import main"], cwd=ROOT_DIR, env=env, check=True, capture_output=True)
+    assert not os.path.exists(path)
+
+def test_new_database_gets_all_migrations_once(empty_engine):
+    assert main.migrate_database(empty_engine) == list(range(1, LATEST + 1))
+    assert main.schema_version(empty_engine) == LATEST
+    with Session(empty_engine) as session:
+        recorded = session.exec(select(main.SchemaMigration.version).order_by(main.SchemaMigration.version)).all()
+    assert recorded == list(range(1, LATEST + 1))
+
+    # Повторный запуск - один запрос версии, миграции не применяются
+    assert main.migrate_database(empty_engine) == []
+
+def test_database_created_before_migrations_is_upgraded(empty_engine):
+    # База старой версии: таблицы есть, таблицы schema_migrations и новых колонок нет
+    main.SQLModel.metadata.create_all(empty_engine, tables=[main.Customer.__table__])
+    with empty_engine.begin() as connection:
+        connection.execute(text("ALTER TABLE customer DROP COLUMN name_last_word"))
+        connection.execute(text("INSERT INTO customer (name, phone, created_at) VALUES ('Старый Клиент', '+79990000000', '2024-01-01')"))
+
+    assert main.migrate_database(empty_engine) == list(range(1, LATEST + 1))
+    assert "name_last_word" in {column["name"] for column in inspect(empty_engine).get_columns("customer")}
+    with Session(empty_engine) as session:
+        customer = session.exec(select(main.Customer)).one()
+    assert (customer.phone_normalized, customer.name_last_word) == ("79990000000", "клиент")
+
+def test_worker_requires_current_schema(empty_engine):
+    with pytest.raises(RuntimeError, match="python main.py migrate"):
+        main.require_current_schema(empty_engine)
+    main.migrate_database(empty_engine)
+    main.require_current_schema(empty_engine)
+
+def test_startup_timings_are_reported(client):
+    timings = client.get("/database/health").json()["startup_ms"]
+    assert {"connect", "migrate", "features"} <= set(timings)
@@ -0,0 +1,227 @@
+"""Тесты заказов: оформление, позиции и суммы, переходы статусов, Idempotency-Key, ETag"""
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql
+from sqlmodel import Session
+
+import main
+
+# ---------- Оформление заказа (POST /checkout) ----------
+
+def test_checkout_creates_order_with_lines(client, checkout, menu):
+    order = checkout([("Тест эспрессо", 2), ("Тест чизкейк", 1)])
+
+    assert order["status"] == "CREATED"
+    assert order["total_amount"] == pytest.approx(2 * 120 + 250)
+    assert [(item["menu_item_name"], item["quantity"]) for item in order["items"]] == [
+        ("Тест эспрессо", 2), ("Тест чизкейк", 1)
+    ]
+    detail = client.get(f"/orders/{order['order_id']}/detail").json()
+    assert detail["total_amount"] == order["total_amount"]
+    assert len(detail["items"]) == 2
+
+@pytest.mark.parametrize("lines, status_code", [
+    ([], 400),                                   # Пустой заказ
+    ([{"menu_item_id": 10**9}], 404),            # Нет такой позиции меню
+    ([{"menu_item_id": None, "quantity": 0}], 400),  # Количество меньше 1 (позиция подставляется ниже)
+])
+def test_checkout_rejects_invalid_lines(client, customer, menu, lines, status_code):
+    for line in lines:
+        if line["menu_item_id"] is None:
+            line["menu_item_id"] = menu["Тест эспрессо"]["id"]
+    response = client.post("/checkout", json={"customer_id": customer["id"], "items": lines})
+    assert response.status_code == status_code
+
+def test_checkout_rejects_unavailable_item_and_unknown_customer(client, customer, menu):
+    unavailable = {"menu_item_id": menu["Тест сезонный"]["id"]}
+    assert client.post("/checkout", json={"customer_id": customer["id"], "items": [unavailable]}).status_code == 400
+    available = {"menu_item_id": menu["Тест эспрессо"]["id"]}
+    assert client.post("/checkout", json={"customer_id": 10**9, "items": [available]}).status_code == 404
+
+# ---------- Позиции заказа и сумма ----------
+
+def test_order_total_follows_added_and_removed_lines(client, customer, menu):
+    # Сумма, указанная клиентом, действует до первой позиции
+    order = client.post("/orders", json={"customer_id": customer["id"], "total_amount": 999}).json()
+    assert order["total_amount"] == 999
+
+    lines = []
+    for name, quantity in [("Тест эспрессо", 1), ("Тест латте", 2)]:
+        response = client.post("/order-items", json={
+            "order_id": order["id"], "menu_item_id": menu[name]["id"], "quantity": quantity
+        })
+        assert response.status_code == 201, response.text
+        lines.append(response.json())
+    assert client.get(f"/orders/{order['id']}").json()["total_amount"] == pytest.approx(120 + 2 * 180)
+
+    assert client.delete(f"/order-items/{lines[1]['id']}").status_code == 200
+    assert client.get(f"/orders/{order['id']}").json()["total_amount"] == pytest.approx(120)
+
+    # Без позиций сумма - ноль
+    assert client.delete(f"/order-items/{lines[0]['id']}").status_code == 200
+    assert client.get(f"/orders/{order['id']}").json()["total_amount"] == 0
+
+def test_concurrent_first_lines_are_all_counted(client, customer, menu):
+    # Сумма клиента заменяется первой позицией; параллельные "первые" позиции не должны теряться
+    order = client.post("/orders", json={"customer_id": customer["id"], "total_amount": 999}).json()
+    names = ["Тест эспрессо", "Тест латте", "Тест чизкейк"] * 4
+
+    def add_line(name):
+        return client.post("/order-items", json={"order_id": order["id"], "menu_item_id": menu[name]["id"]})
+
+    with ThreadPoolExecutor(max_workers=len(names)) as pool:
+        responses = list(pool.map(add_line, names))
+    assert [response.status_code for response in responses] == [201] * len(names)
+
+    expected = sum(menu[name]["price"] for name in names)
+    assert client.get(f"/orders/{order['id']}").json()["total_amount"] == pytest.approx(expected)
+    report = client.get("/maintenance/order-totals").json()
+    assert order["id"] not in [row["order_id"] for row in report["orders"]]
+
+def test_concurrent_writes_all_succeed(client, customer, menu):
+    # В режиме async запись в SQLite идет по одной сессии, одновременные запросы ждут, а не падают
+    line = {"menu_item_id": menu["Тест эспрессо"]["id"], "quantity": 1}
+
+    def checkout_and_pay(_):
+        response = client.post("/checkout", json={"customer_id": customer["id"], "items": [line]})
+        if response.status_code != 201:
+            return response.status_code
+        return client.patch(f"/orders/{response.json()['order_id']}/pay").status_code
+
+    with ThreadPoolExecutor(max_workers=24) as pool:
+        assert list(pool.map(checkout_and_pay, range(48))) == [200] * 48
+
+def test_order_row_is_locked_before_total_update():
+    # В PostgreSQL без блокировки строки UPDATE может проверить EXISTS по старому снимку
+    sql = str(main.lock_order_statement(1).compile(dialect=postgresql.dialect()))
+    assert sql.endswith("FOR UPDATE")
+
+def test_add_line_errors(client, customer, menu):
+    order = client.post("/orders", json={"customer_id": customer["id"], "total_amount": 0}).json()
+    missing_order = {"order_id": 10**9, "menu_item_id": menu["Тест эспрессо"]["id"]}
+    assert client.post("/order-items", json=missing_order).status_code == 404
+    unavailable = {"order_id": order["id"], "menu_item_id": menu["Тест сезонный"]["id"]}
+    assert client.post("/order-items", json=unavailable).status_code == 400
+    assert client.delete("/order-items/999999999").status_code == 404
+
+def test_reconcile_finds_and_fixes_wrong_total(client, checkout):
+    order = checkout([("Тест латте", 1)])
+    with Session(main.engine) as session:
+        # Портим сумму в обход API (как старая ошибка подсчета)
+        session.exec(update(main.Order).where(main.Order.id == order["order_id"]).values(total_amount=1.0))
+        session.commit()
+
+    report = client.get("/maintenance/order-totals").json()
+    assert order["order_id"] in [row["order_id"] for row in report["orders"]]
+
+    client.post("/maintenance/order-totals")
+    assert client.get(f"/orders/{order['order_id']}").json()["total_amount"] == pytest.approx(180)
+    report = client.get("/maintenance/order-totals").json()
+    assert order["order_id"] not in [row["order_id"] for row in report["orders"]]
+
+# ---------- Переходы статусов ----------
+
+def test_order_state_machine(client, checkout):
+    order_id = checkout()["order_id"]
+
+    assert client.patch(f"/orders/{order_id}/complete").status_code == 409  # Сначала оплата
+    paid = client.patch(f"/orders/{order_id}/pay").json()
+    assert (paid["status"], paid["payment_status"]) == ("PAID", "PAID")
+    assert client.patch(f"/orders/{order_id}/pay").status_code == 409  # Уже оплачен
+
+    started = client.patch(f"/orders/{order_id}/start").json()
+    assert started["status"] == "IN_PROGRESS"
+    completed = client.patch(f"/orders/{order_id}/complete").json()
+    assert completed["status"] == "COMPLETED"
+    assert completed["completed_at"] is not None
+    assert completed["version"] == paid["version"] + 2
+
+def test_transition_version_conflict_and_missing_order(client, checkout):
+    order_id = checkout()["order_id"]
+    version = client.get(f"/orders/{order_id}").json()["version"]
+
+    response = client.patch(f"/orders/{order_id}/pay", params={"version": version + 1})
+    assert response.status_code == 409
+    assert client.patch(f"/orders/{order_id}/pay", params={"version": version}).status_code == 200
+    assert client.patch("/orders/999999999/pay").status_code == 404
+
+def test_batch_transition_reports_skipped_orders(client, checkout):
+    first, second, third = (checkout()["order_id"] for _ in range(3))
+    client.patch(f"/orders/{second}/pay")
+
+    report = client.post("/orders/transitions", json={"action": "pay", "order_ids": [first, second, third]}).json()
+    assert report["updated_ids"] == [first, third]
+    assert report["skipped_ids"] == [second]
+
+    report = client.post("/orders/transitions", json={"action": "complete", "order_ids": [first, second, third]}).json()
+    assert report["updated"] == 3
+    assert client.post("/orders/transitions", json={"action": "refund", "order_ids": [first]}).status_code in (400, 422)
+
+# ---------- Idempotency-Key ----------
+
+def test_checkout_retry_with_same_key_returns_same_order(client, checkout):
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+    first = checkout([("Тест эспрессо", 1)], headers=headers)
+    retry = checkout([("Тест эспрессо", 1)], headers=headers)
+    assert retry == first
+
+    other = checkout([("Тест эспрессо", 1)], headers={"Idempotency-Key": str(uuid.uuid4())})
+    assert other["order_id"] != first["order_id"]
+
+def test_order_and_line_retries_do_not_duplicate(client, customer, menu):
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+    body = {"customer_id": customer["id"], "total_amount": 0}
+    first = client.post("/orders", json=body, headers=headers)
+    retry = client.post("/orders", json=body, headers=headers)
+    assert retry.status_code == 201
+    assert retry.headers.get("Idempotent-Replayed") == "true"
+    assert retry.json()["id"] == first.json()["id"]
+
+    line = {"order_id": first.json()["id"], "menu_item_id": menu["Тест латте"]["id"]}
+    line_headers = {"Idempotency-Key": str(uuid.uuid4())}
+    for _ in range(3):
+        assert client.post("/order-items", json=line, headers=line_headers).status_code == 201
+    items = client.get(f"/orders/{first.json()['id']}/items").json()
+    assert len(items["items"]) == 1
+    assert items["total_amount"] == pytest.approx(180)
+
+def test_same_key_with_different_body_is_rejected(client, customer):
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+    assert client.post("/orders", json={"customer_id": customer["id"], "total_amount": 1}, headers=headers).status_code == 201
+    assert client.post("/orders", json={"customer_id": customer["id"], "total_amount": 2}, headers=headers).status_code == 422
+
+# ---------- ETag и If-None-Match ----------
+
+def test_menu_etag_changes_after_menu_write(client, menu):
+    client.get("/menu")
+    etag = client.get("/menu").headers["etag"]
+    assert client.get("/menu", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/menu/test-coffee", headers={"If-None-Match": etag}).status_code == 304
+
+    item_id = menu["Тест чизкейк"]["id"]
+    client.patch(f"/menu/{item_id}", json={"price": 260.0})  # ETag считается по содержимому меню
+    response = client.get("/menu", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    client.patch(f"/menu/{item_id}", json={"price": 250.0})
+
+@pytest.mark.parametrize("resource", ["", "/detail"])
+def test_order_etag_invalidated_by_order_changes(client, checkout, menu, resource):
+    order_id = checkout()["order_id"]
+    url = f"/orders/{order_id}{resource}"
+
+    etag = client.get(url).headers["etag"]
+    not_modified = client.get(url, headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["X-DB-Query-Count"] == "0"  # 304 без обращения к базе данных
+
+    client.post("/order-items", json={"order_id": order_id, "menu_item_id": menu["Тест латте"]["id"]})
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    client.patch(f"/orders/{order_id}/pay")
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 200
@@ -0,0 +1,69 @@
+"""Тесты чтения с реплики и возврата клиента к основной базе после изменения"""
+import os
+import subprocess
+import sys
+import textwrap
+import time
+
+from starlette.requests import Request
+
+import main
+from conftest import ROOT_DIR, TEST_DIR
+
+def request_with_cookie(value: str = None) -> Request:
+    headers = [(b"cookie", f"{main.PRIMARY_READS_COOKIE}={value}".encode())] if value is not None else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "query_string": b""})
+
+def test_reads_primary_only_until_cookie_expires():
+    assert not main.reads_primary(request_with_cookie())
+    assert main.reads_primary(request_with_cookie(str(int(time.time()) + 60)))
+    assert not main.reads_primary(request_with_cookie(str(int(time.time()) - 1)))
+    assert not main.reads_primary(request_with_cookie("испорчено"))
+
+def test_read_engine_prefers_replica():
+    replica, primary = object(), object()
+    request = request_with_cookie()
+    assert main.read_engine(request, replica, primary) is replica
+    assert request.state.db_route == "replica"
+
+    sticky = request_with_cookie(str(int(time.time()) + 60))
+    assert main.read_engine(sticky, replica, primary) is primary
+    assert sticky.state.db_route == "primary"
+    assert main.read_engine(request, None, primary) is primary  # Реплика не настроена
+
+def test_client_reads_own_write_then_returns_to_replica():
+    # Реплика - копия файла основной базы, сделанная до создания клиента (отстающая реплика)
+    primary = os.path.join(TEST_DIR, "replica-primary.db")
+    replica = os.path.join(TEST_DIR, "replica-copy.db")
+    code = textwrap.dedent(f"""
+        import shutil
+        import main
+        from fastapi.testclient import TestClient
+        main.prepare_database(main.engine)
+        main.engine.dispose()
+        shutil.copy({primary!r}, {replica!r})
+        with TestClient(main.app) as client:
+            created = client.post("/customers", json={{"name": "Клиент Реплики", "phone": "+79995550011"}})
+            assert created.status_code == 201, created.text
+            assert int(client.cookies[main.PRIMARY_READS_COOKIE]) > main.time.time()
+            own = client.get(f"/customers/{{created.json()['id']}}")
+            assert (own.status_code, own.headers["X-DB-Route"]) == (200, "primary")
+
+            client.cookies.clear()  # Время чтения из основной базы истекло
+            stale = client.get(f"/customers/{{created.json()['id']}}")
+            assert (stale.status_code, stale.headers["X-DB-Route"]) == (404, "replica")
+            assert main.PRIMARY_READS_COOKIE not in stale.headers.get("set-cookie", "")
+        print("ok")
+    """)
+    for path in (primary, replica):
+        if os.path.exists(path):
+            os.remove(path)
+    env = {name: value for name, value in os.environ.items() if not name.startswith("COFFEE_")}
+    env.update(
+        COFFEE_DATABASE_URL=f"sqlite:///{primary}", COFFEE_REPLICA_URL=f"sqlite:///{replica}",
+        COFFEE_CONFIG=os.path.join(TEST_DIR, "missing.json"), COFFEE_ARCHIVE_INTERVAL="0",
+        COFFEE_HEALTH_INTERVAL="3600", COFFEE_DB_MODE=main.DB_MODE,
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr[-3000:]
+    assert result.stdout.strip().splitlines()[-1] == "ok"
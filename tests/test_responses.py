@@ -0,0 +1,46 @@
+"""Тесты быстрых JSON ответов и сжатия"""
+import json
+import uuid
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+
+import main
+
+def create_customers(client, count: int):
+    for number in range(count):
+        phone = f"+7901{uuid.uuid4().int % 10**7:07d}"
+        assert client.post("/customers", json={"name": f"Клиент Сжатия {number}", "phone": phone}).status_code == 201
+
+def test_large_list_is_gzipped(client):
+    create_customers(client, 20)
+    response = client.get("/customers?limit=50", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    # Заголовок длины относится к сжатому телу, клиент получает исходный JSON
+    assert int(response.headers["content-length"]) < len(response.content)
+    assert response.json() == client.get("/customers?limit=50", headers={"Accept-Encoding": "identity"}).json()
+
+def test_small_and_streaming_responses_are_not_compressed(client):
+    assert "content-encoding" not in client.get("/health/live", headers={"Accept-Encoding": "gzip"}).headers
+    streamed = client.get("/customers?stream=true", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in streamed.headers
+    assert isinstance(streamed.json(), list)
+
+def test_fast_json_matches_response_model(client, monkeypatch, checkout):
+    checkout()
+    create_customers(client, 2)
+    fast = {path: client.get(path).json() for path in ("/customers?limit=20", "/orders?limit=20")}
+    monkeypatch.setattr(main, "FAST_JSON", False)  # Обычный путь FastAPI: проверка по response_model
+    for path, body in fast.items():
+        assert client.get(path).json() == body
+    # Скрытые поля (exclude=True) не попадают в быстрый ответ
+    assert "phone_normalized" not in fast["/customers?limit=20"][0]
+
+def test_encode_json_matches_standard_encoder():
+    row = main.Customer(id=1, name="Клиент", phone="+79990000000", phone_normalized="79990000000",
+                        created_at=datetime(2024, 5, 1, 12, 30))
+    content = {"items": [row], "total": 1}
+    expected = jsonable_encoder({"items": [row.model_dump()], "total": 1})
+    assert json.loads(main.encode_json(content)) == expected
+    assert json.loads(main.FastJSONResponse(content).body) == expected